@@ -10,240 +10,387 @@ Usage:
 """
 
 import os
+import datetime
+import itertools
 import streamlit as st
-import sys
-import subprocess
 import shutil
-import importlib
-import time
+import importlib.util
 import logging
+import hashlib
 import requests
 import re
+import sys
+import time
+import subprocess
+import traceback
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from backoff import is_quota_error
+from dirs import ensure_dir
+from log_config import configure_logging
+from preflight import read_request_text
 
 # Streamlitページ設定を最初に行う（このアプリ全体で一度だけ）
 st.set_page_config(page_title="AIプレゼンテーション生成", page_icon="📊", layout="wide")
 
-# ロギングの設定
-logging.basicConfig(level=logging.INFO)
+# ロギングの設定（ログの出力設定はエントリーポイントで一度だけ行う）
+configure_logging()
 logger = logging.getLogger(__name__)
 
-# 必要なライブラリが存在するか確認し、なければインストールする
+# 起動時に存在を確認するモジュールと、requirements.txt に記載したパッケージ指定の対応表
+REQUIRED_MODULES = {
+    "langchain_core": "langchain-core==0.3.0",
+    "langchain_openai": "langchain-openai==0.2.0",
+    "langchain_community": "langchain-community>=0.0.10",
+    "langgraph": "langgraph==0.2.22",
+    "pptx": "python-pptx==1.0.2",
+}
+
+# アップロードファイルをディスクへ書き出す際のチャンクサイズ（1MB）
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# アップロードを受け付けるメディアファイルの拡張子
+MEDIA_EXTENSIONS = ["jpg", "jpeg", "png", "gif", "mp4", "mov"]
+
+# 複数メディアファイルを並列に保存する際の最大スレッド数
+MEDIA_UPLOAD_WORKERS = 8
+
+# 生成されたスクリプトの実行タイムアウト（秒）
+SCRIPT_TIMEOUT = 300
+
+# 生成コードを安全なヘルパー関数呼び出しに書き換えるためのパターン
+ADD_PICTURE_PATTERN = re.compile(r"slide\.shapes\.add_picture\(")
+PLACEHOLDER_INDEX_PATTERN = re.compile(r"slide\.placeholders\[(\d+)\]")
+# obj.fill.fore_color.rgb = X、shape.line.fill.fore_color.rgb = X、fill.fore_color.rgb = X を1つのパターンで扱う
+# （属性の連鎖全体を取り込み、連鎖の途中から一致しないよう直前が識別子やドットでないことを確認する）
+FILL_COLOR_PATTERN = re.compile(r'(?<![\w.])((?:[A-Za-z_][A-Za-z0-9_]*\.)*)fill\.fore_color\.rgb\s*=\s*([^;\n]+)')
+
+# 旧形式のLangChainからのOpenAIインポート
+LANGCHAIN_OPENAI_IMPORT_PATTERN = re.compile(r'from\s+langchain\s+import\s+OpenAI')
+
+# 必要なライブラリが存在するか確認する（サーバープロセスごとに一度だけ実行）
+@st.cache_resource(show_spinner=False)
 def check_and_install_dependencies():
     """
-    必要な依存関係をチェックし、不足している場合はインストールする
-    エラーハンドリングを強化し、インストール失敗時の代替手段も提供
+    必要な依存関係が導入済みかどうかを確認する
+    パッケージのインストールはビルド時に requirements.txt で行い、Streamlitプロセスからpipは呼び出さない
+
+    Returns:
+        bool: Google Gemini APIのサポートが利用可能かどうか
     """
-    # インストール履歴ファイルの確認
-    install_history_file = "installed_packages.txt"
-    installed_packages = set()
-    
-    if os.path.exists(install_history_file):
-        try:
-            with open(install_history_file, 'r') as f:
-                installed_packages = set(line.strip() for line in f if line.strip())
-            
-            st.info("前回のインストール情報を読み込みました。必要なパッケージのみインストールします。")
-        except Exception as e:
-            st.warning(f"インストール履歴の読み込みに失敗しました。すべてのパッケージを確認します: {e}")
-    
-    required_packages = [
-        "langchain-core==0.3.0",
-        "langchain-openai==0.2.0",
-        "langchain-community>=0.0.10",
-        "langgraph==0.2.22",
-        "python-pptx==1.0.2",
-        "ipython"
-    ]
-    
-    # Gemini関連のパッケージ（オプション）
-    gemini_packages = [
-        "google-generativeai>=0.3.0",
-        "langchain-google-genai==0.1.5"
-    ]
-    
-    # 未インストールのパッケージのみを選択
-    to_install = [pkg for pkg in required_packages if pkg.split('==')[0].split('>=')[0] not in installed_packages]
-    
-    if not to_install:
-        st.success("必要なパッケージはすべてインストール済みです。")
-    else:
-        st.info(f"{len(to_install)}個のパッケージをインストールします...")
-    
-    # 基本パッケージのインストール
-    all_success = install_packages(to_install, critical=True, install_history=installed_packages)
-    
-    # 特別な方法でGeminiパッケージをインストール
-    gemini_available = install_gemini_packages(installed_packages)
-    
-    # インストール履歴を保存
-    try:
-        with open(install_history_file, 'w') as f:
-            for package in installed_packages:
-                f.write(f"{package}\n")
-    except Exception as e:
-        st.warning(f"インストール履歴の保存に失敗しました: {e}")
-    
-    return gemini_available
+    missing = [package for module, package in REQUIRED_MODULES.items()
+               if importlib.util.find_spec(module) is None]
+    if missing:
+        st.error(f"必要なパッケージがインストールされていません: {', '.join(missing)}")
+        st.info("次のコマンドでインストールしてから、アプリケーションを再起動してください:")
+        st.code("pip install --cache-dir ~/.cache/pip -r requirements.txt")
+    
+    # Gemini関連のパッケージ（オプション）はモジュールの有無のみで判定する
+    return importlib.util.find_spec("langchain_google_genai") is not None
 
-def install_gemini_packages(install_history=None):
+# ディレクトリ構造を確認し、存在しない場合は作成
+@st.cache_resource(show_spinner=False)
+def ensure_directories():
     """
-    Gemini API関連パッケージを特別な方法でインストールする
-    
+    必要なディレクトリ構造を確保する
+    """
+    os.makedirs("workspace/input", exist_ok=True)
+    os.makedirs("workspace/output", exist_ok=True)
+    os.makedirs("workspace/input/images", exist_ok=True)
+
+@st.cache_resource(show_spinner=False)
+def get_llm(api_provider, model, key_hash, _api_key):
+    """
+    LLMモデルを初期化する（同じプロバイダー・モデル・APIキーの組み合わせではキャッシュを再利用）
+
     Args:
-        install_history (set): インストール済みパッケージの集合
-    
+        api_provider (str): 使用するAPIプロバイダー ("OpenAI" または "Google Gemini")
+        model (str): 使用するモデル名
+        key_hash (str): APIキーのハッシュ値（キャッシュキーとして使用）
+        _api_key (str): APIキー（キャッシュキーには含めない）
+
     Returns:
-        bool: Geminiパッケージのインストールに成功したかどうか
+        BaseChatModel: 初期化済みのLLM
     """
-    if install_history is None:
-        install_history = set()
-    
-    # すでにインストールされているか確認
-    if "google-generativeai" in install_history and "langchain-google-genai" in install_history:
-        st.success("Google Gemini APIのサポートは既に有効化されています！")
-        return True
-    
-    try:
-        # まずgoogle-generativeaiをインストール
-        if "google-generativeai" not in install_history:
-            st.info("Google AI SDKをインストールしています...")
-            subprocess.check_call(
-                [sys.executable, "-m", "pip", "install", "--no-cache-dir", "google-generativeai>=0.3.0"],
-                stderr=subprocess.PIPE
-            )
-            install_history.add("google-generativeai")
-        
-        # 依存関係のチェック
-        if "langchain-google-genai" not in install_history:
-            st.info("LangChain Google Genai拡張をインストールしています...")
-            
-            # 複数の方法を試す
-            install_success = False
-            
-            methods = [
-                # 方法1: 最新バージョンで直接インストール
-                [sys.executable, "-m", "pip", "install", "--no-cache-dir", "langchain-google-genai"],
-                # 方法2: 特定バージョンを指定してインストール
-                [sys.executable, "-m", "pip", "install", "--no-cache-dir", "--use-pep517", "langchain-google-genai==0.1.5"],
-                # 方法3: 依存関係を明示的に指定
-                [sys.executable, "-m", "pip", "install", "--no-cache-dir", "langchain-google-genai==0.1.5", "typing-inspect>=0.8.0", "typing-extensions>=4.5.0"],
-                # 方法4: 最小限の依存関係でインストール
-                [sys.executable, "-m", "pip", "install", "--no-cache-dir", "--no-deps", "langchain-google-genai", "google-ai-generativelanguage>=0.6.0"]
-            ]
-            
-            for i, cmd in enumerate(methods):
-                try:
-                    st.info(f"インストール方法 {i+1}/{len(methods)} を試行中...")
-                    subprocess.check_call(cmd, stderr=subprocess.PIPE)
-                    install_success = True
-                    st.success(f"インストール方法 {i+1} で成功しました！")
-                    install_history.add("langchain-google-genai")
-                    break
-                except subprocess.CalledProcessError as e:
-                    st.warning(f"インストール方法 {i+1} が失敗しました: {e}")
-                    continue
-            
-            # インポートテスト
-            try:
-                import langchain_google_genai
-                st.success("Google Gemini APIのサポートが有効化されました！")
-                return True
-            except ImportError as e:
-                if "langchain-google-genai" in install_history:
-                    st.warning(f"パッケージはインストールされましたが、インポートできませんでした: {e}")
-                    st.info("アプリケーションを再起動して再試行してください。")
-                else:
-                    st.error("すべてのインストール方法が失敗しました。")
-                return False
-            
-    except Exception as e:
-        st.warning(f"Google Gemini APIサポートのインストールに失敗しました: {e}")
-        st.info("OpenAI APIのみ使用可能です。手動インストールを試すには次のコマンドを実行してください:")
-        st.code("pip install langchain-google-genai --no-cache-dir")
-        return False
+    if api_provider == "OpenAI":
+        from langchain_openai import ChatOpenAI
+        from http_client import get_http_client
+        return ChatOpenAI(model=model, temperature=0.0, openai_api_key=_api_key, http_client=get_http_client())
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(model=model, temperature=0.0, google_api_key=_api_key)
 
-def install_packages(packages, critical=False, install_history=None):
+def get_agent(api_provider, model, key_hash, use_fallback, fallback_model, _api_key):
     """
-    パッケージのリストをインストールする
+    PPTXAgentを初期化する（LLMはキャッシュを再利用する）
+    エージェントは実行中の状態を持つため、セッション間で共有せずに実行ごとに作成する
 
     Args:
-        packages (list): インストールするパッケージのリスト
-        critical (bool): 重要なパッケージかどうか。Trueの場合、インストール失敗時にエラーを表示
-        install_history (set): インストール済みパッケージの集合（Noneの場合は作成）
+        api_provider (str): 使用するAPIプロバイダー ("OpenAI" または "Google Gemini")
+        model (str): 使用するモデル名
+        key_hash (str): APIキーのハッシュ値（キャッシュキーとして使用）
+        use_fallback (bool): APIエラー時にフォールバックを使用するかどうか
+        fallback_model (str): フォールバック用のモデル名（Noneの場合は自動選択）
+        _api_key (str): APIキー（キャッシュキーには含めない）
 
     Returns:
-        bool: すべてのパッケージのインストールに成功したかどうか
+        PPTXAgent: 初期化済みのエージェント
     """
-    if install_history is None:
-        install_history = set()
-    
-    all_success = True
-    
-    for package in packages:
-        try:
-            package_name = package.split("==")[0].split(">=")[0]
-            
-            # すでに履歴にあればスキップ
-            if package_name in install_history:
-                logger.info(f"{package_name} は既にインストールされています")
-                continue
-                
-            try:
-                # すでにインストールされているか確認
-                importlib.import_module(package_name.replace("-", "_"))
-                logger.info(f"{package_name} は既にインストールされています")
-                install_history.add(package_name)
+    from pptx_agent import PPTXAgent
+    llm = get_llm(api_provider, model, key_hash, _api_key)
+    return PPTXAgent(llm=llm, use_fallback=use_fallback, api_provider=api_provider, fallback_model=fallback_model)
+
+@st.cache_resource(show_spinner=False)
+def get_io_executor():
+    """
+    生成コードのファイル書き込みに使用するスレッドプールを取得する（サーバープロセス全体で共有）
+
+    Returns:
+        ThreadPoolExecutor: ファイル書き込み用のスレッドプール
+    """
+    return ThreadPoolExecutor(max_workers=2)
+
+@st.cache_resource(show_spinner=False)
+def get_filename_counter():
+    """
+    ファイル名の接尾辞に使用する連番を取得する（サーバープロセス全体で共有し、再実行でリセットしない）
+
+    Returns:
+        itertools.count: 1から始まる連番
+    """
+    return itertools.count(1)
+
+def _write_text(path, text):
+    """
+    テキストをUTF-8でファイルに書き込む
+
+    Args:
+        path (str): 書き込み先のパス
+        text (str): 書き込む内容
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+# 同じ入力・同じモデルでの再生成はLLMを呼び出さずに結果を再利用する（失敗時は例外を発生させるため、失敗した結果はキャッシュされない）
+@st.cache_data(show_spinner=False, ttl=3600, max_entries=32)
+def cached_agent_run(content, api_provider, model, key_hash, use_fallback, fallback_model, _api_key):
+    """
+    PPTXAgentを実行して生成されたPythonコードを返す（入力テキストと設定が同じ場合はキャッシュを再利用）
+
+    Args:
+        content (str): プレゼンテーションの元になるテキスト
+        api_provider (str): 使用するAPIプロバイダー ("OpenAI" または "Google Gemini")
+        model (str): 使用するモデル名
+        key_hash (str): APIキーのハッシュ値（キャッシュキーとして使用）
+        use_fallback (bool): APIエラー時にフォールバックを使用するかどうか
+        fallback_model (str): フォールバック用のモデル名（Noneの場合は自動選択）
+        _api_key (str): APIキー（キャッシュキーには含めない）
+
+    Returns:
+        str: エージェントの最終出力
+
+    Raises:
+        Exception: エージェントの実行中にエラーが発生した場合
+    """
+    agent = get_agent(api_provider, model, key_hash, use_fallback, fallback_model, _api_key=_api_key)
+    return agent.generate(user_request=content)
+
+@st.cache_data(show_spinner=False)
+def list_media(mtime):
+    """
+    メディアディレクトリ内のファイル一覧を取得する（ディレクトリの更新時刻をキーにキャッシュ）
+
+    Args:
+        mtime (float): workspace/input/images の更新時刻
+
+    Returns:
+        list: ファイル名のリスト（名前順）
+    """
+    # DirEntry は種別情報を保持しているため、ファイル判定で追加のstatが発生しない
+    with os.scandir("workspace/input/images") as entries:
+        return sorted(entry.name for entry in entries if entry.is_file())
+
+@st.cache_data(show_spinner=False)
+def load_image_bytes(path, mtime):
+    """
+    画像ファイルの内容を読み込む（ファイルパスと更新時刻をキーにキャッシュ）
+
+    Args:
+        path (str): 画像ファイルのパス
+        mtime (float): 画像ファイルの更新時刻
+
+    Returns:
+        bytes: 画像ファイルの内容
+    """
+    with open(path, "rb") as f:
+        return f.read()
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def load_output_bytes(path, mtime):
+    """
+    生成されたプレゼンテーションの内容を読み込む（ファイルパスと更新時刻をキーにキャッシュ）
+    ダウンロードボタンの再描画のたびにファイル全体を読み直さないようにする
+
+    Args:
+        path (str): .pptxファイルのパス
+        mtime (float): .pptxファイルの更新時刻
+
+    Returns:
+        bytes: .pptxファイルの内容
+    """
+    with open(path, "rb", buffering=UPLOAD_CHUNK_SIZE) as f:
+        return f.read()
+
+def _delete_media_file(file_name):
+    """
+    メディアファイルを削除し、完了メッセージをセッション状態に保存する（削除ボタンのコールバック）
+
+    Args:
+        file_name (str): 削除するファイル名
+    """
+    file_path = f"workspace/input/images/{file_name}"
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    st.session_state.media_message = f"{file_name} を削除しました。"
+
+def _extract_media_zip(zip_file):
+    """
+    ZIPアーカイブ内の画像・動画ファイルをメディアディレクトリへ展開する
+    ディレクトリ構成は無視してファイル名のみで保存し、対応していない拡張子のファイルは読み飛ばす
+
+    Args:
+        zip_file: ZIPアーカイブ（アップロードされたファイルなどのファイルライクオブジェクト）
+    """
+    with zipfile.ZipFile(zip_file) as zf:
+        for member in zf.infolist():
+            file_name = os.path.basename(member.filename)
+            if member.is_dir() or file_name.rpartition(".")[2].lower() not in MEDIA_EXTENSIONS:
                 continue
-            except ImportError:
-                st.info(f"{package_name} をインストールしています...")
-                
-                # インストール試行回数
-                max_attempts = 3
-                
-                for attempt in range(max_attempts):
-                    try:
-                        # インストールコマンドを実行 - オプションを追加して成功率を高める
-                        subprocess.check_call(
-                            [sys.executable, "-m", "pip", "install", "--no-cache-dir", "--upgrade", package],
-                            stderr=subprocess.STDOUT
-                        )
-                        st.success(f"{package_name} のインストールが完了しました！")
-                        install_history.add(package_name)
-                        break
-                    except subprocess.CalledProcessError as e:
-                        logger.warning(f"{package_name} のインストールに失敗しました（試行 {attempt+1}/{max_attempts}）: {e}")
-                        
-                        if attempt == max_attempts - 1:
-                            # すべての試行が失敗
-                            if critical:
-                                st.error(f"重要なパッケージ {package_name} のインストールに失敗しました。")
-                                st.error(f"手動でインストールするには: pip install {package}")
-                                all_success = False
-                            else:
-                                st.warning(f"オプションパッケージ {package_name} のインストールに失敗しました。一部の機能が制限される場合があります。")
-                                all_success = False
-                        else:
-                            # 短い遅延後に再試行
-                            time.sleep(2)
-        except Exception as e:
-            logger.error(f"パッケージ {package} の処理中にエラーが発生しました: {e}")
-            if critical:
-                st.error(f"パッケージ {package} の処理中にエラーが発生しました: {e}")
-                all_success = False
-            else:
-                st.warning(f"オプションパッケージ {package} の処理中にエラーが発生しました。一部の機能が制限される場合があります。")
-                all_success = False
-    
-    return all_success
+            with zf.open(member) as src, open(f"workspace/input/images/{file_name}", "wb") as dst:
+                shutil.copyfileobj(src, dst, length=UPLOAD_CHUNK_SIZE)
 
-# ディレクトリ構造を確認し、存在しない場合は作成
-def ensure_directories():
+def _save_uploaded_media():
     """
-    必要なディレクトリ構造を確保する
+    アップロードされた画像・動画ファイルを保存し、完了メッセージをセッション状態に保存する（アップローダーのコールバック）
     """
-    os.makedirs("workspace/input", exist_ok=True)
-    os.makedirs("workspace/output", exist_ok=True)
-    os.makedirs("workspace/input/images", exist_ok=True)
+    uploaded_media_files = st.session_state.media_uploader
+    if not uploaded_media_files:
+        return
+
+    def _save(media_file):
+        media_file.seek(0)
+        if media_file.name.lower().endswith(".zip"):
+            _extract_media_zip(media_file)
+            return
+        with open(f"workspace/input/images/{media_file.name}", "wb") as f:
+            shutil.copyfileobj(media_file, f, length=UPLOAD_CHUNK_SIZE)
+
+    # I/O待ちを重ねるため、ファイルの書き出しはスレッドプールで並列に行う
+    with ThreadPoolExecutor(max_workers=min(MEDIA_UPLOAD_WORKERS, len(uploaded_media_files))) as executor:
+        list(executor.map(_save, uploaded_media_files))
+
+    st.session_state.media_message = f"{len(uploaded_media_files)}個のファイルがアップロードされました！"
+
+def run_generated_script(script_path, api_provider, api_key):
+    """
+    生成されたPythonスクリプトを別プロセスで実行する
+    スクリプトは workspace/ からの相対パスを使用するため、作業ディレクトリはアプリと同じにする
+    ソースを直接実行し、スクリプトと同じディレクトリのモジュール（slide_helpers など）をインポートできるようにする
+
+    Args:
+        script_path (str): 実行するスクリプトのパス
+        api_provider (str): APIプロバイダー（"OpenAI" または "Google Gemini"）
+        api_key (str): 子プロセスに環境変数として渡すAPIキー
+
+    Returns:
+        subprocess.CompletedProcess: 終了コード・標準出力・標準エラー出力を含む実行結果
+    """
+    env = os.environ.copy()
+    env["PYTHONIOENCODING"] = "utf-8"
+    if api_provider == "OpenAI":
+        env["OPENAI_API_KEY"] = api_key
+    else:  # Gemini
+        env["GOOGLE_API_KEY"] = api_key
+
+    return subprocess.run(
+        [sys.executable, script_path],
+        capture_output=True,
+        text=True,
+        encoding="utf-8",
+        timeout=SCRIPT_TIMEOUT,
+        env=env,
+    )
+
+def find_latest_output(since):
+    """
+    指定時刻以降に作成・更新された最新の.pptxファイルを探す
+
+    Args:
+        since (float): 探索対象とする更新時刻の下限（time.time()の値）
+
+    Returns:
+        str: 見つかったファイルの絶対パス（見つからない場合はNone）
+    """
+    # 1回の走査で更新時刻を取得し、ファイルごとのstatを1回に抑える
+    with os.scandir("workspace/output") as entries:
+        candidates = [
+            (entry.stat().st_mtime, entry.path)
+            for entry in entries
+            if entry.name.endswith(".pptx")
+        ]
+    latest = max((c for c in candidates if c[0] >= since), default=None)
+    return os.path.abspath(latest[1]) if latest else None
+
+def get_output_mtime(path):
+    """
+    出力ファイルの更新時刻を取得する（存在確認を兼ね、statは1回のみ）
+
+    Args:
+        path (str): 出力ファイルのパス
+
+    Returns:
+        float: ファイルの更新時刻（存在しない場合はNone）
+    """
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+@st.fragment
+def media_gallery():
+    """
+    アップロード済みの画像・動画ファイルの一覧と、アップロード・削除用のウィジェットを表示する
+    フラグメントとして定義し、ギャラリー内の操作ではこの部分のみを再実行する
+    """
+    # 既存の画像・動画ファイルを表示（一覧と画像はディレクトリ・ファイルの更新時刻をキーにキャッシュ）
+    if "media_message" in st.session_state:
+        st.success(st.session_state.pop("media_message"))
+    existing_media_files = list_media(os.path.getmtime("workspace/input/images"))
+    if existing_media_files:
+        st.write("現在アップロードされているファイル:")
+        cols = st.columns(4)
+        for i, file in enumerate(existing_media_files):
+            file_path = f"workspace/input/images/{file}"
+            file_type = file.rpartition(".")[2].lower()
+            with cols[i % 4]:
+                if file_type in ["jpg", "jpeg", "png", "gif"]:
+                    st.image(load_image_bytes(file_path, os.path.getmtime(file_path)), caption=file, width=150)
+                elif file_type in ["mp4", "mov", "avi"]:
+                    st.video(file_path)
+                else:
+                    st.write(f"📁 {file}")
+                
+                # ファイル削除ボタン
+                st.button(f"削除: {file}", key=f"delete_{file}", on_click=_delete_media_file, args=(file,))
+    
+    # 新しいファイルのアップロード
+    # 保存は on_change コールバックで行うため、強制的な再実行は不要
+    # 多数のファイルはZIPにまとめてアップロードすると、1回の読み込みでまとめて展開できる
+    st.file_uploader("画像・動画ファイルをアップロード (.jpg, .jpeg, .png, .gif, .mp4, .mov, またはそれらをまとめた .zip)", 
+                     type=MEDIA_EXTENSIONS + ["zip"], 
+                     accept_multiple_files=True,
+                     key="media_uploader",
+                     on_change=_save_uploaded_media)
 
 # 安全なプレゼンテーション生成関数をここに直接定義（サブプロセスで呼び出す代わりに）
 def generate_safe_presentation():
@@ -253,9 +400,7 @@ def generate_safe_presentation():
     Returns:
         str: 生成されたファイルのパス
     """
-    import os
-    import datetime
-    import random
+    # python-pptxはこのフォールバック経路でのみ使用するため、起動時ではなくここで読み込む
     from pptx import Presentation
     from pptx.util import Inches, Pt
     from pptx.enum.text import PP_ALIGN
@@ -264,50 +409,57 @@ def generate_safe_presentation():
     # 一意のファイル名を生成
     now = datetime.datetime.now()
     timestamp = now.strftime("%Y%m%d_%H%M%S")
-    random_suffix = f"_{random.randint(1000, 9999)}"
-    filename = f"Safe_Presentation_{timestamp}{random_suffix}.pptx"
+    unique_suffix = f"_{os.getpid():x}{next(get_filename_counter()):04x}"
+    filename = f"Safe_Presentation_{timestamp}{unique_suffix}.pptx"
     output_dir = os.path.join("workspace", "output")
-    os.makedirs(output_dir, exist_ok=True)
+    ensure_dir(output_dir)
     output_path = os.path.join(output_dir, filename)
     
     # 新しいプレゼンテーションを作成
     prs = Presentation()
+    slide_layouts = prs.slide_layouts
+    body_font_size = Pt(24)  # 箇条書きで共通のフォントサイズ
     
     # タイトルスライド
-    slide = prs.slides.add_slide(prs.slide_layouts[0])
+    slide = prs.slides.add_slide(slide_layouts[0])
     
     # テキストボックスでタイトルを追加
     title_shape = slide.shapes.add_textbox(Inches(1), Inches(1), Inches(8), Inches(1.5))
     title_frame = title_shape.text_frame
     title_frame.text = "安全に生成されたプレゼンテーション"
-    title_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-    title_frame.paragraphs[0].font.size = Pt(44)
-    title_frame.paragraphs[0].font.bold = True
+    title_para = title_frame.paragraphs[0]
+    title_font = title_para.font
+    title_para.alignment = PP_ALIGN.CENTER
+    title_font.size = Pt(44)
+    title_font.bold = True
     
     # サブタイトル
     subtitle_shape = slide.shapes.add_textbox(Inches(2), Inches(3), Inches(6), Inches(1))
     subtitle_frame = subtitle_shape.text_frame
     subtitle_frame.text = "プレースホルダーエラーを回避する安全な実装"
-    subtitle_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-    subtitle_frame.paragraphs[0].font.size = Pt(28)
+    subtitle_para = subtitle_frame.paragraphs[0]
+    subtitle_para.alignment = PP_ALIGN.CENTER
+    subtitle_para.font.size = Pt(28)
     
     # 日付情報
     date_shape = slide.shapes.add_textbox(Inches(2), Inches(4.5), Inches(6), Inches(0.5))
     date_frame = date_shape.text_frame
-    current_date = datetime.datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
+    current_date = now.strftime("%Y年%m月%d日 %H:%M:%S")  # ファイル名と同じ時刻を表示
     date_frame.text = f"作成日時: {current_date}"
     date_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
     
     # コンテンツスライド
-    slide = prs.slides.add_slide(prs.slide_layouts[1])
+    slide = prs.slides.add_slide(slide_layouts[1])
     
     # タイトル
     title_shape = slide.shapes.add_textbox(Inches(0.5), Inches(0.5), Inches(9), Inches(1))
     title_frame = title_shape.text_frame
     title_frame.text = "安全なプレゼンテーション生成"
-    title_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-    title_frame.paragraphs[0].font.size = Pt(40)
-    title_frame.paragraphs[0].font.bold = True
+    title_para = title_frame.paragraphs[0]
+    title_font = title_para.font
+    title_para.alignment = PP_ALIGN.CENTER
+    title_font.size = Pt(40)
+    title_font.bold = True
     
     # コンテンツ
     content_shape = slide.shapes.add_textbox(Inches(1), Inches(2), Inches(8), Inches(4))
@@ -315,18 +467,19 @@ def generate_safe_presentation():
     
     p = content_frame.paragraphs[0]
     p.text = "• プレースホルダーエラーを回避するために安全モードで生成"
-    p.font.size = Pt(24)
+    p.font.size = body_font_size
     
     p = content_frame.add_paragraph()
     p.text = "• テキストボックスと図形のみを使用"
-    p.font.size = Pt(24)
+    p.font.size = body_font_size
     
     p = content_frame.add_paragraph()
     p.text = "• 日付とタイムスタンプを含む一意なファイル名"
-    p.font.size = Pt(24)
+    p.font.size = body_font_size
     
-    # 保存
-    prs.save(output_path)
+    # 保存（大きなバッファを介して書き出し、パーツごとの細かい書き込みをまとめる）
+    with open(output_path, "wb", buffering=1 << 20) as f:
+        prs.save(f)
     return output_path
 
 def main():
@@ -336,19 +489,7 @@ def main():
     # 依存関係のチェックとインストール
     gemini_available = check_and_install_dependencies()
     
-    # モジュールのインポート
-    try:
-        from langchain_openai import ChatOpenAI
-        if gemini_available:
-            try:
-                from langchain_google_genai import ChatGoogleGenerativeAI
-            except ImportError:
-                gemini_available = False
-        from pptx_agent import PPTXAgent
-    except ImportError as e:
-        st.error(f"必要なライブラリをインポートできませんでした: {e}")
-        st.error("アプリケーションを再起動してください。")
-        return
+    # LangChain・PPTXAgentのインポートは生成時（get_llm / get_agent内）まで遅延させ、通常の再実行では行わない
     
     # ディレクトリの確認
     ensure_directories()
@@ -365,7 +506,7 @@ def main():
     if gemini_available:
         api_provider_options.append("Google Gemini")
     else:
-        st.warning("Google Gemini APIの依存関係をインストールできませんでした。OpenAI APIのみ使用可能です。")
+        st.warning("Google Gemini APIの依存関係 (langchain-google-genai) が見つかりません。OpenAI APIのみ使用可能です。")
     
     api_provider = st.radio("使用するAPIプロバイダー", api_provider_options, horizontal=True)
     
@@ -387,49 +528,16 @@ def main():
     # テンプレートファイルのアップロード
     template_file = st.file_uploader("テンプレートファイルをアップロード (.pptx)", type=["pptx"])
     if template_file:
+        template_file.seek(0)
         with open("workspace/input/template.pptx", "wb") as f:
-            f.write(template_file.getbuffer())
+            shutil.copyfileobj(template_file, f, length=UPLOAD_CHUNK_SIZE)
         st.success("テンプレートファイルがアップロードされました！")
     
     # 画像・動画ファイルのアップロード（複数可）
     st.subheader("画像・動画ファイルのアップロード(オプション)")
     st.write("プレゼンテーションに使用する画像や動画ファイルをアップロードできます.")
     
-    # 既存の画像・動画ファイルを表示
-    existing_media_files = os.listdir("workspace/input/images")
-    if existing_media_files:
-        st.write("現在アップロードされているファイル:")
-        cols = st.columns(4)
-        for i, file in enumerate(existing_media_files):
-            file_path = f"workspace/input/images/{file}"
-            file_type = file.split(".")[-1].lower()
-            with cols[i % 4]:
-                if file_type in ["jpg", "jpeg", "png", "gif"]:
-                    st.image(file_path, caption=file, width=150)
-                elif file_type in ["mp4", "mov", "avi"]:
-                    st.video(file_path)
-                else:
-                    st.write(f"📁 {file}")
-                
-                # ファイル削除ボタン
-                if st.button(f"削除: {file}", key=f"delete_{file}"):
-                    os.remove(file_path)
-                    st.success(f"{file} を削除しました。")
-                    st.experimental_rerun()
-    
-    # 新しいファイルのアップロード
-    uploaded_media_files = st.file_uploader("画像・動画ファイルをアップロード (.jpg, .jpeg, .png, .gif, .mp4, .mov)", 
-                                          type=["jpg", "jpeg", "png", "gif", "mp4", "mov"], 
-                                          accept_multiple_files=True)
-    
-    if uploaded_media_files:
-        for uploaded_file in uploaded_media_files:
-            file_path = f"workspace/input/images/{uploaded_file.name}"
-            with open(file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-        
-        st.success(f"{len(uploaded_media_files)}個のファイルがアップロードされました！")
-        st.experimental_rerun()
+    media_gallery()
     
     # main関数の外側のtryブロック開始
     try:
@@ -448,39 +556,38 @@ def main():
                     else:  # Gemini
                         os.environ["GOOGLE_API_KEY"] = api_key
                     
-                    # アップロードされたファイルを保存
-                    content = uploaded_file.read().decode("utf-8")
-                    
-                    # LLMモデルを初期化
+                    # アップロードされたファイルの内容を取得（同じファイルであればセッション状態に保存した内容を再利用）
+                    text_key = (uploaded_file.name, uploaded_file.size)
+                    if st.session_state.get("uploaded_text_key") != text_key:
+                        st.session_state.uploaded_text = read_request_text(uploaded_file, uploaded_file.name)
+                        st.session_state.uploaded_text_key = text_key
+                    content = st.session_state.uploaded_text
+                    if not content.strip():
+                        # 空のファイルではLLMを呼び出さない
+                        st.error("アップロードされたファイルにテキストが含まれていません。")
+                        return
+
+                    # LLMモデルとPPTXAgentを初期化・実行（キャッシュ済みであれば再利用）
+                    key_hash = hashlib.sha1(api_key.encode()).hexdigest()
                     try:
                         if api_provider == "OpenAI":
-                            llm = ChatOpenAI(model=model, temperature=0.0)
                             fallback_model = "gpt-3.5-turbo" if model != "gpt-3.5-turbo" else None
                         else:  # Gemini
-                            llm = ChatGoogleGenerativeAI(model=model, temperature=0.0)
                             fallback_model = "gemini-1.5-flash" if model != "gemini-1.5-flash" else None
                         
-                        # PPTXAgentを初期化
-                        agent = PPTXAgent(llm=llm, use_fallback=use_fallback, api_provider=api_provider, fallback_model=fallback_model)
-                        
-                        # エージェントを実行して最終的な出力を取得
-                        final_output = agent.run(user_request=content)
+                        # エージェントを実行して最終的な出力を取得（同じ入力・設定の結果はキャッシュから取得）
+                        final_output = cached_agent_run(content, api_provider, model, key_hash, use_fallback, fallback_model, _api_key=api_key)
                     except Exception as api_error:
-                        # APIクォータ超過エラー・レート制限エラーの処理
-                        error_msg = str(api_error).lower()
-                        quota_error = any(err in error_msg for err in ["insufficient_quota", "rate_limit", "quota exceeded"])
+                        # APIクォータ超過エラーの処理（通常のレート制限はエージェント内で待機して再試行済み）
+                        quota_error = is_quota_error(api_error)
                         
                         if quota_error:
                             st.warning(f"{api_provider} APIの制限に達しました。バックアップモデルを使用します。")
                             if use_fallback:
                                 if api_provider == "OpenAI" and model != "gpt-3.5-turbo":
-                                    llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.0)
-                                    agent = PPTXAgent(llm=llm, use_fallback=use_fallback, api_provider=api_provider)
-                                    final_output = agent.run(user_request=content)
+                                    final_output = cached_agent_run(content, api_provider, "gpt-3.5-turbo", key_hash, use_fallback, None, _api_key=api_key)
                                 elif api_provider == "Google Gemini" and model != "gemini-1.5-flash":
-                                    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.0)
-                                    agent = PPTXAgent(llm=llm, use_fallback=use_fallback, api_provider=api_provider)
-                                    final_output = agent.run(user_request=content)
+                                    final_output = cached_agent_run(content, api_provider, "gemini-1.5-flash", key_hash, use_fallback, None, _api_key=api_key)
                                 else:
                                     st.error(f"{api_provider} APIの制限に達しました。APIキーの制限を確認するか、別のAPIキーを使用してください。")
                                     st.error("この問題を解決するには：")
@@ -496,31 +603,40 @@ def main():
                                 st.error("3. 別のAPIキーを使用する")
                                 return
                         else:
-                            raise api_error
+                            # その他のエラーの場合は、簡易的なプレゼンテーションを作成するコードを使用する（キャッシュしない）
+                            from pptx_agent import error_presentation_code
+                            st.warning(f"プレゼンテーションの生成中にエラーが発生しました: {api_error}")
+                            final_output = error_presentation_code(api_provider)
                     
                     # Python コードブロックが含まれている場合の処理
-                    if "```python" in final_output:
-                        final_output = final_output.split("```python\n")[-1].split("```")[0]
+                    from pptx_code_generator import extract_code_block
+                    code = extract_code_block(final_output)
+                    if code is not None:
+                        final_output = code
+                        # 生成コード内の古いLangChainインポートを修正（APIキーは環境変数で子プロセスに渡す）
+                        final_output = LANGCHAIN_OPENAI_IMPORT_PATTERN.sub("from langchain_openai import OpenAI", final_output)
                         
-                        # 出力をファイルに保存（UTF-8エンコーディングを明示的に指定）
-                        with open("workspace/output/create_pptx.py", "w", encoding="utf-8") as f:
-                            f.write(final_output)
+                        # 出力をファイルに保存（書き込みはバックグラウンドで行い、実行直前に完了を待つ）
+                        io_executor = get_io_executor()
+                        pending_writes = [io_executor.submit(_write_text, "workspace/output/create_pptx.py", final_output)]
                         
-                        # Pythonコードを表示
-                        with st.expander("生成されたPythonコード"):
-                            st.code(final_output, language="python")
+                        # Pythonコードはセッション状態に保存し、表示は下部のエクスパンダーでユーザーが要求したときのみ行う
+                        st.session_state.last_code = final_output
+                        st.session_state.show_code = False
                         
                         # 変数初期化 - 常に modified_code を設定
                         modified_code = final_output  # デフォルトでは最初のコード生成物をそのまま使用
+                        safe_code_generated = False
                         
                         # プレースホルダーエラーに対処するコードを追加
                         # 出力コード内にプレースホルダーへの参照があれば、安全なアクセス方法に置換
-                        if "placeholder" in final_output and "slide.placeholders" in final_output:
+                        if PLACEHOLDER_INDEX_PATTERN.search(final_output):
                             st.info("プレースホルダーを使用するコードが検出されました。安全なアクセス方法に変換します。")
                             # 安全なプレースホルダーアクセスコードを追加する部分
                             safe_placeholder_code = """
 # 必要なインポート
 import os
+from io import BytesIO
 from pptx.util import Inches, Pt
 from pptx.enum.text import PP_ALIGN
 from pptx.dml.color import RGBColor
@@ -530,7 +646,8 @@ from pptx.enum.shapes import MSO_SHAPE
 def set_fill_color_safe(fill, color):
     '''フィルに安全に色を設定する(Noneフィルの場合はsolid()を先に呼び出す)'''
     try:
-        if hasattr(fill, 'type') and fill.type == None:
+        # fill.type の取得に失敗した場合は下の except で solid() からやり直す
+        if fill.type is None:
             fill.solid()
         fill.fore_color.rgb = color
         return True
@@ -545,12 +662,19 @@ def set_fill_color_safe(fill, color):
             print(f"フィルの色設定の2回目の試行も失敗しました: {e2}")
             return False
 
+# 読み込み済みの画像データ(同じ画像を複数のスライドで使う場合もファイルの読み込みは1回にする)
+_image_cache = {}
+
 # 画像ファイルを安全に扱うためのヘルパー関数
 def add_image_safe(slide, image_path, left=Inches(1), top=Inches(2), width=Inches(4), height=Inches(3)):
     '''指定された画像を安全に追加する(ファイルが存在しない場合はプレースホルダーを作成)'''
-    if os.path.exists(image_path):
+    if image_path in _image_cache or os.path.exists(image_path):
         try:
-            return slide.shapes.add_picture(image_path, left, top, width, height)
+            data = _image_cache.get(image_path)
+            if data is None:
+                with open(image_path, 'rb') as f:
+                    data = _image_cache[image_path] = f.read()
+            return slide.shapes.add_picture(BytesIO(data), left, top, width, height)
         except Exception as e:
             print(f"画像の追加に失敗しました: {e}")
             # 画像の追加に失敗した場合 代わりにテキストボックスを作成
@@ -595,372 +719,96 @@ def get_placeholder_safe(slide, idx, default_title="", default_content=""):
             return shape
 """
 
-                            # 元のコードに必要なインポートが含まれているか確認し 不足していれば追加
-                            modified_code = final_output
-                            required_imports = [
+                            # ヘルパー関数の先頭で読み込むインポート文と同じ行は元のコードから取り除く（重複したインポートを実行しない）
+                            helper_imports = {
                                 "import os",
+                                "from io import BytesIO",
                                 "from pptx.util import Inches, Pt",
                                 "from pptx.enum.text import PP_ALIGN",
                                 "from pptx.dml.color import RGBColor",
                                 "from pptx.enum.shapes import MSO_SHAPE"
-                            ]
-                            
-                            # 元のコードにインポート文がなければ追加
-                            for import_line in required_imports:
-                                if import_line not in modified_code:
-                                    # コードの先頭に追加(既存のインポート文の後に)
-                                    import_section_end = modified_code.find("\n\n", modified_code.find("import"))
-                                    if import_section_end > 0:
-                                        modified_code = modified_code[:import_section_end] + "\n" + import_line + modified_code[import_section_end:]
-                                    else:
-                                        # インポートセクションが見つからない場合は コードの先頭に追加
-                                        modified_code = import_line + "\n\n" + modified_code
-                            
-                            # 先頭に安全関数を追加
-                            modified_code = safe_placeholder_code + "\n\n" + modified_code
+                            }
+                            modified_code = "\n".join(line for line in final_output.split("\n") if line not in helper_imports)
                             
                             # 画像ファイルのパスを安全な関数に置き換え
-                            modified_code = modified_code.replace("slide.shapes.add_picture(", "add_image_safe(slide, ")
+                            # （書き換えは生成コードのみに適用し、ヘルパー関数自身の呼び出しが再帰にならないよう関数の追加は最後に行う）
+                            modified_code = ADD_PICTURE_PATTERN.sub("add_image_safe(slide, ", modified_code)
                             
-                            # 直接アクセスを安全な関数に置き換え
-                            modified_code = modified_code.replace("slide.placeholders[0]", "get_placeholder_safe(slide, 0)")
-                            modified_code = modified_code.replace("slide.placeholders[1]", "get_placeholder_safe(slide, 1)")
-                            # 特にプレースホルダー11に対応
-                            modified_code = modified_code.replace("slide.placeholders[11]", "get_placeholder_safe(slide, 11)")
-                            # 他のプレースホルダーインデックスにも対応（2から15まで）
-                            for idx in range(2, 16):
-                                modified_code = modified_code.replace(f"slide.placeholders[{idx}]", f"get_placeholder_safe(slide, {idx})")
+                            # 直接アクセスを安全な関数に置き換え（全インデックスを1回の走査で処理）
+                            modified_code = PLACEHOLDER_INDEX_PATTERN.sub(r"get_placeholder_safe(slide, \1)", modified_code)
                                 
-                            # フィル処理用のコードをさらに改善
-                            modified_code = re.sub(
-                                r'([a-zA-Z0-9_]+)\.fill\.fore_color\.rgb\s*=\s*([^;\n]+)',
-                                r'set_fill_color_safe(\1.fill, \2)',
-                                modified_code
-                            )
+                            # フィルの色設定を安全な関数に置き換え（オブジェクト経由・フィル直接アクセスの両方を1回の走査で処理）
+                            modified_code = FILL_COLOR_PATTERN.sub(r"set_fill_color_safe(\1fill, \2)", modified_code)
                             
-                            # フィル直接アクセスの場合も置き換え
-                            modified_code = re.sub(
-                                r'fill\.fore_color\.rgb\s*=\s*([^;\n]+)',
-                                r'set_fill_color_safe(fill, \1)',
-                                modified_code
-                            )
+                            # 先頭に安全関数を追加
+                            modified_code = safe_placeholder_code + "\n\n" + modified_code
 
                             # 修正したコードを保存
-                            with open("workspace/output/create_pptx_safe.py", "w", encoding="utf-8") as f:
-                                f.write(modified_code)
+                            pending_writes.append(io_executor.submit(_write_text, "workspace/output/create_pptx_safe.py", modified_code))
                             
+                            safe_code_generated = True
                             # ユーザーに通知
                             st.info("プレースホルダーエラーを回避するために安全なバージョンも生成しました")
                         
-                        # コードを実行
+                        script_path = "workspace/output/create_pptx_safe.py" if safe_code_generated else "workspace/output/create_pptx.py"
+                        # 実行前にファイルの書き込み完了を待つ（書き込みエラーはここで送出される）
+                        for pending_write in pending_writes:
+                            pending_write.result()
+                        
+                        # コードを別プロセスで実行（Streamlitプロセスをブロック・汚染しない）
                         st.info("生成されたPythonコードを実行中...")
                         generation_successful = False # 成功フラグ
                         output_filename = None # 生成されたファイル名を格納
+                        run_started_at = time.time()
 
-                        # execをラップするtryブロック開始
                         try:
-                            # 安全なコードを実行する前に、必要なモジュールを明示的にインポート
-                            import importlib
-                            from pptx.util import Inches, Pt
-                            from pptx.enum.text import PP_ALIGN
-                            from pptx.dml.color import RGBColor
-                            from pptx.enum.shapes import MSO_SHAPE
-                            
-                            # APIキーを環境変数に確実に設定
-                            if api_provider == "OpenAI":
-                                os.environ["OPENAI_API_KEY"] = api_key
-                            else:  # Gemini
-                                os.environ["GOOGLE_API_KEY"] = api_key
-                            
-                            # 実行環境に必要なモジュールを追加
-                            exec_globals = {
-                                "Inches": Inches,
-                                "Pt": Pt,
-                                "PP_ALIGN": PP_ALIGN,
-                                "RGBColor": RGBColor,
-                                "os": os,
-                                "datetime": importlib.import_module('datetime'),
-                                "random": importlib.import_module('random'),
-                                "Presentation": importlib.import_module('pptx').Presentation,
-                                "MSO_SHAPE": MSO_SHAPE,
-                                # APIキーを直接渡す
-                                "OPENAI_API_KEY": api_key if api_provider == "OpenAI" else "",
-                                "GOOGLE_API_KEY": api_key if api_provider == "Google Gemini" else "",
-                                # 安全な画像追加関数を追加
-                                "add_image_safe": lambda slide, image_path, left=Inches(1), top=Inches(2), width=Inches(4), height=Inches(3): (
-                                    slide.shapes.add_picture(image_path, left, top, width, height) 
-                                    if os.path.exists(image_path) else 
-                                    slide.shapes.add_textbox(left, top, width, height)
-                                ),
-                                # 塗りつぶし色設定用の安全関数を追加
-                                "set_fill_color_safe": lambda fill, color: _set_fill_color(fill, color)
-                            }
+                            proc = run_generated_script(script_path, api_provider, api_key)
                             
-                            # APIキーを使用したOpenAIインスタンス生成サポート
-                            if api_provider == "OpenAI":
-                                # OpenAIインポートを試行
-                                try:
-                                    from langchain_openai import ChatOpenAI, OpenAI
-                                    exec_globals["ChatOpenAI"] = ChatOpenAI
-                                    exec_globals["OpenAI"] = OpenAI
-                                    
-                                    # APIキーが設定されたOpenAIインスタンスを作成
-                                    exec_globals["openai_llm"] = OpenAI(openai_api_key=api_key)
-                                    exec_globals["openai_chat"] = ChatOpenAI(openai_api_key=api_key)
-                                except ImportError:
-                                    st.warning("langchain_openaiモジュールのインポートに失敗しました。修正されたコードで対応します。")
-                            elif api_provider == "Google Gemini":
-                                # Geminiインポートを試行
-                                try:
-                                    from langchain_google_genai import ChatGoogleGenerativeAI
-                                    exec_globals["ChatGoogleGenerativeAI"] = ChatGoogleGenerativeAI
-                                    
-                                    # APIキーが設定されたGeminiインスタンスを作成
-                                    exec_globals["gemini_chat"] = ChatGoogleGenerativeAI(model=model, google_api_key=api_key)
-                                except ImportError:
-                                    st.warning("langchain_google_genaiモジュールのインポートに失敗しました。修正されたコードで対応します。")
-                                
-                            # OpenAIのインポートと初期化コードパターンを探して置換
-                            modified_code = re.sub(
-                                r'from\s+langchain\s+import\s+OpenAI',
-                                'from langchain_openai import OpenAI',
-                                modified_code
-                            )
-                            
-                            # OpenAIの初期化を修正
-                            modified_code = re.sub(
-                                r'OpenAI\(\s*\)',
-                                f'OpenAI(openai_api_key="{api_key}")',
-                                modified_code
-                            )
-                            modified_code = re.sub(
-                                r'OpenAI\(\s*temperature\s*=\s*([^,\)]+)\s*\)',
-                                f'OpenAI(temperature=\\1, openai_api_key="{api_key}")',
-                                modified_code
-                            )
-                            
-                            # fill 色設定用のヘルパー関数を追加
-                            def _set_fill_color(fill, color):
-                                if hasattr(fill, 'type') and fill.type == None:
-                                    fill.solid()
-                                if hasattr(fill, 'fore_color'):
-                                    fill.fore_color.rgb = color
-                                    return color
-                                return None
-                            
-                            # _set_fill_color関数をexec_globalsに追加
-                            exec_globals["_set_fill_color"] = _set_fill_color
-                            
-                            exec_locals = {}
+                            # 安全なバージョンがあれば最初からそれを実行しているため、失敗時は下の組み込みの生成関数に任せる
+                            if proc.returncode != 0 and "no placeholder on this slide with idx" in proc.stderr:
+                                st.warning("プレースホルダーに関するエラーが発生しました。")
                             
-                            # 安全なコードを実行
-                            exec(modified_code, exec_globals, exec_locals)
+                            if proc.stdout:
+                                with st.expander("実行ログ"):
+                                    st.text(proc.stdout)
                             
-                            generation_successful = True
-                            st.success("プレゼンテーションの生成が完了しました！")
-
-                            # 生成されたファイル名を取得
-                            if 'output_filename' in exec_locals:
-                                output_filename = exec_locals['output_filename']
-                                if not os.path.isabs(output_filename):
-                                    output_filename = os.path.abspath(os.path.join("workspace/output", output_filename))
-                            if not output_filename or not os.path.exists(output_filename):
-                                output_files = [f for f in os.listdir("workspace/output") if f.endswith(".pptx")]
-                                if output_files:
-                                    latest_file_path = max([os.path.join("workspace/output", f) for f in output_files], key=os.path.getmtime)
-                                    output_filename = os.path.abspath(latest_file_path)
-
-                        except KeyError as ke:
-                            # プレースホルダーエラーの場合
-                            if "no placeholder on this slide with idx" in str(ke):
-                                st.warning("プレースホルダーに関するエラーが発生しました。")
-                                
-                                # 安全バージョンのコードがあれば、それを試す
-                                safe_code_path = "workspace/output/create_pptx_safe.py"
-                                if os.path.exists(safe_code_path):
-                                    st.info("安全なバージョンのコードを試行します...")
-                                    try:
-                                        with open(safe_code_path, "r", encoding="utf-8") as f:
-                                            safe_code = f.read()
-                                        
-                                        # 変数を確実に初期化
-                                        if not 'safe_code' in locals() or safe_code is None or safe_code == "":
-                                            # 安全なコードが読み込めない場合、元のコードを使用
-                                            safe_code = final_output
-                                        
-                                        # 安全なコードを実行する前に、必要なモジュールを明示的にインポート
-                                        import importlib
-                                        from pptx.util import Inches, Pt
-                                        from pptx.enum.text import PP_ALIGN
-                                        from pptx.dml.color import RGBColor
-                                        from pptx.enum.shapes import MSO_SHAPE
-                                        
-                                        # APIキーを環境変数に確実に設定
-                                        if api_provider == "OpenAI":
-                                            os.environ["OPENAI_API_KEY"] = api_key
-                                        else:  # Gemini
-                                            os.environ["GOOGLE_API_KEY"] = api_key
-                                        
-                                        # 実行環境に必要なモジュールを追加
-                                        exec_globals = {
-                                            "Inches": Inches,
-                                            "Pt": Pt,
-                                            "PP_ALIGN": PP_ALIGN,
-                                            "RGBColor": RGBColor,
-                                            "os": os,
-                                            "datetime": importlib.import_module('datetime'),
-                                            "random": importlib.import_module('random'),
-                                            "Presentation": importlib.import_module('pptx').Presentation,
-                                            "MSO_SHAPE": MSO_SHAPE,
-                                            # APIキーを直接渡す
-                                            "OPENAI_API_KEY": api_key if api_provider == "OpenAI" else "",
-                                            "GOOGLE_API_KEY": api_key if api_provider == "Google Gemini" else "",
-                                            # 安全な画像追加関数を追加
-                                            "add_image_safe": lambda slide, image_path, left=Inches(1), top=Inches(2), width=Inches(4), height=Inches(3): (
-                                                slide.shapes.add_picture(image_path, left, top, width, height) 
-                                                if os.path.exists(image_path) else 
-                                                slide.shapes.add_textbox(left, top, width, height)
-                                            ),
-                                            # 塗りつぶし色設定用の安全関数を追加
-                                            "set_fill_color_safe": lambda fill, color: _set_fill_color(fill, color)
-                                        }
-                                        
-                                        # APIキーを使用したOpenAIインスタンス生成サポート
-                                        if api_provider == "OpenAI":
-                                            # OpenAIインポートを試行
-                                            try:
-                                                from langchain_openai import ChatOpenAI, OpenAI
-                                                exec_globals["ChatOpenAI"] = ChatOpenAI
-                                                exec_globals["OpenAI"] = OpenAI
-                                                
-                                                # APIキーが設定されたOpenAIインスタンスを作成
-                                                exec_globals["openai_llm"] = OpenAI(openai_api_key=api_key)
-                                                exec_globals["openai_chat"] = ChatOpenAI(openai_api_key=api_key)
-                                            except ImportError:
-                                                st.warning("langchain_openaiモジュールのインポートに失敗しました。修正されたコードで対応します。")
-                                        elif api_provider == "Google Gemini":
-                                            # Geminiインポートを試行
-                                            try:
-                                                from langchain_google_genai import ChatGoogleGenerativeAI
-                                                exec_globals["ChatGoogleGenerativeAI"] = ChatGoogleGenerativeAI
-                                                
-                                                # APIキーが設定されたGeminiインスタンスを作成
-                                                exec_globals["gemini_chat"] = ChatGoogleGenerativeAI(model=model, google_api_key=api_key)
-                                            except ImportError:
-                                                st.warning("langchain_google_genaiモジュールのインポートに失敗しました。修正されたコードで対応します。")
-                                        
-                                        # OpenAIのインポートと初期化コードパターンを探して置換
-                                        safe_code = re.sub(
-                                            r'from\s+langchain\s+import\s+OpenAI',
-                                            'from langchain_openai import OpenAI',
-                                            safe_code
-                                        )
-                                        
-                                        # OpenAIの初期化を修正
-                                        safe_code = re.sub(
-                                            r'OpenAI\(\s*\)',
-                                            f'OpenAI(openai_api_key="{api_key}")',
-                                            safe_code
-                                        )
-                                        safe_code = re.sub(
-                                            r'OpenAI\(\s*temperature\s*=\s*([^,\)]+)\s*\)',
-                                            f'OpenAI(temperature=\\1, openai_api_key="{api_key}")',
-                                            safe_code
-                                        )
-                                        
-                                        # fill 色設定用のヘルパー関数を追加
-                                        def _set_fill_color(fill, color):
-                                            if hasattr(fill, 'type') and fill.type == None:
-                                                fill.solid()
-                                            if hasattr(fill, 'fore_color'):
-                                                fill.fore_color.rgb = color
-                                                return color
-                                            return None
-                                        
-                                        # _set_fill_color関数をexec_globalsに追加
-                                        exec_globals["_set_fill_color"] = _set_fill_color
-                                        
-                                        exec_locals = {}
-                                        
-                                        # 安全なコードを実行
-                                        exec(safe_code, exec_globals, exec_locals)
-                                        
-                                        generation_successful = True
-                                        st.success("安全なコードでプレゼンテーションの生成が完了しました！")
-                                        
-                                        # 生成されたファイル名を取得
-                                        if 'output_filename' in exec_locals:
-                                            output_filename = exec_locals['output_filename']
-                                            if not os.path.isabs(output_filename):
-                                                output_filename = os.path.abspath(os.path.join("workspace/output", output_filename))
-                                        if not output_filename or not os.path.exists(output_filename):
-                                            output_files = [f for f in os.listdir("workspace/output") if f.endswith(".pptx")]
-                                            if output_files:
-                                                latest_file_path = max([os.path.join("workspace/output", f) for f in output_files], key=os.path.getmtime)
-                                                output_filename = os.path.abspath(latest_file_path)
-                                    
-                                    except ImportError as import_err:
-                                        st.error(f"必要なモジュールのインポートに失敗しました: {import_err}")
-                                        st.info("組み込みの安全な生成関数を使用します...")
-                                        try:
-                                            output_filename = generate_safe_presentation()
-                                            if output_filename and os.path.exists(output_filename):
-                                                st.success("安全なプレゼンテーションの生成が完了しました！")
-                                                st.info(f"生成されたプレゼンテーション: {output_filename}")
-                                                generation_successful = True
-                                        except Exception as safe_gen_err:
-                                            st.error(f"安全なプレゼンテーション生成中にエラーが発生しました: {safe_gen_err}")
-                                            import traceback
-                                            st.error(traceback.format_exc())
-                                    
-                                    except Exception as safe_code_err:
-                                        st.error(f"安全なコードの実行にも失敗しました: {safe_code_err}")
-                                        # 組み込みの安全な生成関数を使用
-                                        st.info("組み込みの安全な生成関数を使用します...")
-                                        try:
-                                            output_filename = generate_safe_presentation()
-                                            
-                                            if output_filename and os.path.exists(output_filename):
-                                                st.success("安全なプレゼンテーションの生成が完了しました！")
-                                                st.info(f"生成されたプレゼンテーション: {output_filename}")
-                                                generation_successful = True
-                                        except Exception as safe_gen_err:
-                                            st.error(f"安全なプレゼンテーション生成中にエラーが発生しました: {safe_gen_err}")
-                                            import traceback
-                                            st.error(traceback.format_exc())
-                                else:
-                                    # 安全バージョンのコードがなければ、直接安全な生成関数を使用
-                                    st.info("安全なプレゼンテーションを生成中...")
-                                    try:
-                                        output_filename = generate_safe_presentation()
-                                        
-                                        if output_filename and os.path.exists(output_filename):
-                                            st.success("安全なプレゼンテーションの生成が完了しました！")
-                                            st.info(f"生成されたプレゼンテーション: {output_filename}")
-                                            generation_successful = True
-                                    except Exception as safe_gen_err:
-                                        st.error(f"安全なプレゼンテーション生成中にエラーが発生しました: {safe_gen_err}")
-                                        import traceback
-                                        st.error(traceback.format_exc())
-                        except Exception as exec_e:
-                            # exec実行中のその他のエラーの場合
-                            st.error(f"コード実行中にエラーが発生しました: {str(exec_e)}")
-                            import traceback
-                            st.error(traceback.format_exc())
+                            if proc.returncode == 0:
+                                output_filename = find_latest_output(run_started_at)
+                                generation_successful = True
+                                st.success("プレゼンテーションの生成が完了しました！")
+                            else:
+                                st.error("コード実行中にエラーが発生しました:")
+                                st.code(proc.stderr)
+                        except subprocess.TimeoutExpired:
+                            st.error(f"コードの実行が{SCRIPT_TIMEOUT}秒以内に完了しませんでした。")
+                        
+                        # 生成コードで作成できなかった場合は組み込みの安全な生成関数を使用
+                        if not generation_successful:
+                            st.info("組み込みの安全な生成関数を使用します...")
+                            try:
+                                # 保存に失敗した場合は例外が送出されるため、戻り値があればファイルは存在する
+                                output_filename = generate_safe_presentation()
+                                if output_filename:
+                                    st.success("安全なプレゼンテーションの生成が完了しました！")
+                                    st.info(f"生成されたプレゼンテーション: {output_filename}")
+                                    generation_successful = True
+                            except Exception as safe_gen_err:
+                                st.error(f"安全なプレゼンテーション生成中にエラーが発生しました: {safe_gen_err}")
+                                st.error(traceback.format_exc())
 
                         # ダウンロードボタンの表示 (成功した場合のみ) - tryブロック3の外側、ブロック2の内側
                         if generation_successful and output_filename:
-                            # ファイルが存在するか最終確認
-                            if os.path.exists(output_filename):
+                            # ファイルが存在するか最終確認（更新時刻の取得と兼ねる）
+                            output_mtime = get_output_mtime(output_filename)
+                            if output_mtime is not None:
                                 try:
-                                    with open(output_filename, "rb") as f:
-                                        st.download_button(
-                                            label=f"{os.path.basename(output_filename)}をダウンロード",
-                                            data=f,
-                                            file_name=os.path.basename(output_filename),
-                                            mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
-                                            key=f"download-{os.path.basename(output_filename)}"
-                                        )
+                                    st.download_button(
+                                        label=f"{os.path.basename(output_filename)}をダウンロード",
+                                        data=load_output_bytes(output_filename, output_mtime),
+                                        file_name=os.path.basename(output_filename),
+                                        mime="application/vnd.openxmlformats-officedocument.presentationml.presentation",
+                                        key=f"download-{os.path.basename(output_filename)}"
+                                    )
                                 except FileNotFoundError:
                                     st.error(f"ダウンロード用にファイルを開けませんでした: {output_filename}")
                                 except Exception as download_err:
@@ -970,21 +818,29 @@ def get_placeholder_safe(slide, idx, default_title="", default_content=""):
                         elif generation_successful:
                             st.warning("プレゼンテーションは生成されましたが、ダウンロード用のファイルが見つかりませんでした。")
 
+                except ImportError as import_err: # LangChain等のライブラリが読み込めない場合
+                    st.error(f"必要なライブラリをインポートできませんでした: {import_err}")
+                    st.error("アプリケーションを再起動してください。")
                 except requests.exceptions.RequestException as req_err: # APIコール関連のエラー
                     st.error(f"APIリクエスト中にエラーが発生しました: {req_err}")
                 except Exception as e: # AI生成やファイル書き込み段階のエラー
                     st.error(f"プレゼンテーション生成プロセスでエラーが発生しました: {str(e)}")
-                    error_msg = str(e).lower()
-                    if any(err in error_msg for err in ["insufficient_quota", "quota exceeded", "rate_limit"]):
+                    if is_quota_error(e):
                         st.error(f"{api_provider} APIの制限に達しました。APIキーの制限を確認するか、別のAPIキーを使用してください。")
                     else:
                         st.error("詳細なエラー情報を確認するには、コンソールログを確認してください。")
 
     except Exception as main_e:
         st.error(f"メイン処理で予期せぬエラーが発生しました: {main_e}")
-        import traceback
         st.error(traceback.format_exc())
 
+    # 生成されたPythonコード（シンタックスハイライト付きの描画は表示ボタンが押されるまで行わない）
+    if "last_code" in st.session_state:
+        with st.expander("生成されたPythonコード"):
+            if st.session_state.get("show_code") or st.button("コードを表示", key="show_generated_code"):
+                st.session_state.show_code = True
+                st.code(st.session_state.last_code, language="python")
+
     # 使用方法のガイド - ブロック1の外側で、main関数内
     with st.expander("使用方法"):
         st.write("""
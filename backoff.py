@@ -0,0 +1,245 @@
+"""
+このモジュールはAPI呼び出しを再試行する際の待機時間を計算する機能を提供します。
+指数バックオフにランダムな揺らぎ（ジッター）を加え、複数の処理が同時に再試行して負荷が集中するのを防ぎます。
+プロバイダーがRetry-Afterヘッダーで待機時間を指定している場合はそれを優先します。
+各生成器で共通の、エラーの種類に応じて再試行・送出・フォールバックを切り替える呼び出しも提供します。
+
+Functions:
+    backoff_delay: 再試行までの待機時間を計算する
+    call_with_retries: API呼び出しを再試行付きで実行する
+    acall_with_retries: API呼び出しを再試行付きで非同期に実行する（call_with_retries の非同期版）
+    stream_with_retries: API呼び出しを再試行付きでストリーミング実行する（call_with_retries のストリーミング版）
+    is_quota_error: 再試行しても解決しないAPIクォータ超過のエラーかどうかを判定する
+    is_rate_limit_error: 待機して再試行すべきレート制限のエラーかどうかを判定する
+"""
+
+import asyncio
+import logging
+import random
+import re
+import time
+from typing import Awaitable, Callable, Generator, Iterable, Optional, Tuple, TypeVar
+
+# ロガーの設定
+logger = logging.getLogger(__name__)
+
+# 呼び出し結果の型
+T = TypeVar("T")
+
+# APIクォータ超過のエラーメッセージのパターン（表記揺れと大文字小文字の違いに対応）
+# 通常のレート制限（429）は待機すれば解消するため含めない
+QUOTA_ERROR_PATTERN = re.compile(r"insufficient_quota|quota[ _]exceeded", re.IGNORECASE)
+
+# 待機して再試行するレート制限エラーのメッセージのパターン（"Rate limit reached"・"rate_limit_exceeded" など）
+RATE_LIMIT_ERROR_PATTERN = re.compile(r"rate[_ ]?limit", re.IGNORECASE)
+
+# エラーの判定に使用するメッセージの最大文字数（HTTPレスポンス本文を含む長いメッセージ全体を走査しない）
+MAX_ERROR_MESSAGE_CHARS = 1024
+
+def _error_message(error: BaseException) -> str:
+    """
+    エラーの判定に使用するメッセージを取得する
+
+    Args:
+        error (BaseException): API呼び出しで発生したエラー
+
+    Returns:
+        str: 先頭の MAX_ERROR_MESSAGE_CHARS 文字までのエラーメッセージ
+    """
+    return str(error)[:MAX_ERROR_MESSAGE_CHARS]
+
+def is_quota_error(error: BaseException) -> bool:
+    """
+    再試行しても解決しないAPIクォータ超過のエラーかどうかを判定する
+
+    Args:
+        error (BaseException): API呼び出しで発生したエラー
+
+    Returns:
+        bool: エラーメッセージがクォータ超過を示す場合はTrue
+    """
+    return QUOTA_ERROR_PATTERN.search(_error_message(error)) is not None
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """
+    待機して再試行すべきレート制限のエラーかどうかを判定する
+
+    Args:
+        error (BaseException): API呼び出しで発生したエラー
+
+    Returns:
+        bool: エラーメッセージがレート制限を示す場合はTrue
+    """
+    return RATE_LIMIT_ERROR_PATTERN.search(_error_message(error)) is not None
+
+def _retry_after_seconds(error: Optional[BaseException]) -> Optional[float]:
+    """
+    エラーのレスポンスからRetry-Afterヘッダーの秒数を取得する
+
+    Args:
+        error (BaseException): API呼び出しで発生したエラー
+
+    Returns:
+        Optional[float]: 指定された待機秒数（指定がない・秒数でない場合はNone）
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, error: Optional[BaseException] = None) -> float:
+    """
+    再試行までの待機時間を計算する
+
+    Args:
+        attempt (int): 失敗した試行の番号（0始まり）
+        base_delay (float, optional): 1回目の再試行までの基本待機秒数。デフォルトは1.0
+        error (BaseException, optional): 直前に発生したエラー（Retry-Afterヘッダーの確認に使用）
+
+    Returns:
+        float: 待機秒数（指数バックオフまたはRetry-Afterの大きい方に、0〜base_delay秒のジッターを加えた値）
+    """
+    delay = base_delay * (2 ** attempt)
+    retry_after = _retry_after_seconds(error)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay + random.uniform(0, base_delay)
+
+def _next_retry_delay(error: Exception, attempt: int, max_retries: int, base_delay: float, task: str,
+                      has_fallback: bool) -> Optional[float]:
+    """
+    API呼び出しで発生したエラーの種類から、次の試行までの待機秒数を決める
+
+    Args:
+        error (Exception): API呼び出しで発生したエラー
+        attempt (int): 失敗した試行の番号（0始まり）
+        max_retries (int): 最大再試行回数
+        base_delay (float): 再試行までの基本待機秒数
+        task (str): ログに表示する処理の名前
+        has_fallback (bool): 再試行の上限に達した場合に返すフォールバックの内容があるかどうか
+
+    Returns:
+        Optional[float]: 待機秒数（0の場合は待機せずに再試行し、Noneの場合はフォールバックの内容を返す）
+
+    Raises:
+        Exception: クォータ超過のエラー、またはレート制限などで再試行の上限に達した場合は元のエラー
+    """
+    # クォータ超過は再試行しても解決しないので、すぐに例外を発生させる
+    if is_quota_error(error):
+        logger.error("APIクォータ超過エラー: %s", error)
+        raise error
+    
+    # レート制限エラーの場合は少し待機してから再試行（上限に達した場合は呼び出し元のフォールバックLLMに任せる）
+    if is_rate_limit_error(error):
+        logger.warning("レート制限エラーが発生しました（試行 %s/%s）: %s", attempt + 1, max_retries + 1, error)
+        if attempt >= max_retries:
+            raise error
+        return backoff_delay(attempt, base_delay, error)  # ジッター付き指数バックオフ
+    
+    # その他のエラーの場合はすぐに再試行し、最後の試行ではフォールバックの内容を返す
+    logger.warning("%s中にエラーが発生しました（試行 %s/%s）: %s", task, attempt + 1, max_retries + 1, error)
+    if attempt < max_retries:
+        return 0.0
+    if not has_fallback:
+        raise error
+    logger.error("最大試行回数に達しました。フォールバックの内容を返します。")
+    return None
+
+def call_with_retries(invoke: Callable[[], T], max_retries: int, base_delay: float = 1.0,
+                      fallback: Optional[Callable[[], T]] = None, task: str = "API呼び出し") -> Tuple[T, bool]:
+    """
+    API呼び出しを再試行付きで実行する
+    クォータ超過はすぐに送出し、レート制限は待機してから再試行し、その他のエラーは上限まで再試行する
+
+    Args:
+        invoke (Callable[[], T]): API呼び出しを行う関数
+        max_retries (int): 最大再試行回数
+        base_delay (float, optional): 再試行までの基本待機秒数。デフォルトは1.0
+        fallback (Callable[[], T], optional): 再試行の上限に達した場合に返す内容を作る関数。指定がなければ例外を送出する
+        task (str, optional): ログに表示する処理の名前
+
+    Returns:
+        Tuple[T, bool]: 呼び出し結果と、フォールバックの内容を返したかどうか
+
+    Raises:
+        Exception: クォータ超過の場合、またはフォールバックの内容を返せずに再試行の上限に達した場合
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return invoke(), False
+        except Exception as e:
+            delay = _next_retry_delay(e, attempt, max_retries, base_delay, task, fallback is not None)
+            if delay is None:
+                return fallback(), True
+            if delay:
+                time.sleep(delay)
+
+async def acall_with_retries(invoke: Callable[[], Awaitable[T]], max_retries: int, base_delay: float = 1.0,
+                             fallback: Optional[Callable[[], T]] = None, task: str = "API呼び出し") -> Tuple[T, bool]:
+    """
+    API呼び出しを再試行付きで非同期に実行する（call_with_retries の非同期版）
+
+    Args:
+        invoke (Callable[[], Awaitable[T]]): API呼び出しを行うコルーチン関数
+        max_retries (int): 最大再試行回数
+        base_delay (float, optional): 再試行までの基本待機秒数。デフォルトは1.0
+        fallback (Callable[[], T], optional): 再試行の上限に達した場合に返す内容を作る関数。指定がなければ例外を送出する
+        task (str, optional): ログに表示する処理の名前
+
+    Returns:
+        Tuple[T, bool]: 呼び出し結果と、フォールバックの内容を返したかどうか
+
+    Raises:
+        Exception: クォータ超過の場合、またはフォールバックの内容を返せずに再試行の上限に達した場合
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return await invoke(), False
+        except Exception as e:
+            delay = _next_retry_delay(e, attempt, max_retries, base_delay, task, fallback is not None)
+            if delay is None:
+                return fallback(), True
+            if delay:
+                await asyncio.sleep(delay)
+
+def stream_with_retries(stream: Callable[[], Iterable[str]], max_retries: int, base_delay: float = 1.0,
+                        fallback: Optional[Callable[[], str]] = None,
+                        task: str = "API呼び出し") -> Generator[str, None, Tuple[str, bool]]:
+    """
+    API呼び出しを再試行付きでストリーミング実行し、受け取った断片を順に返す（call_with_retries のストリーミング版）
+    再試行した場合は新しい試行の断片が続けて返されるため、結果の全体は戻り値から取得する
+
+    Args:
+        stream (Callable[[], Iterable[str]]): ストリーミングでAPI呼び出しを行う関数
+        max_retries (int): 最大再試行回数
+        base_delay (float, optional): 再試行までの基本待機秒数。デフォルトは1.0
+        fallback (Callable[[], str], optional): 再試行の上限に達した場合に返す内容を作る関数。指定がなければ例外を送出する
+        task (str, optional): ログに表示する処理の名前
+
+    Yields:
+        str: 受け取った断片（フォールバックの場合はその内容全体）
+
+    Returns:
+        Tuple[str, bool]: 最後の試行で受け取った内容全体と、フォールバックの内容を返したかどうか
+
+    Raises:
+        Exception: クォータ超過の場合、またはフォールバックの内容を返せずに再試行の上限に達した場合
+    """
+    for attempt in range(max_retries + 1):
+        chunks = []
+        try:
+            for chunk in stream():
+                chunks.append(chunk)
+                yield chunk
+            return "".join(chunks), False
+        except Exception as e:
+            delay = _next_retry_delay(e, attempt, max_retries, base_delay, task, fallback is not None)
+            if delay is None:
+                result = fallback()
+                yield result
+                return result, True
+            if delay:
+                time.sleep(delay)
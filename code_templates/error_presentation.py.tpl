@@ -0,0 +1,47 @@
+```python
+# エラーが発生したため、簡易的なPPTXファイルを生成します
+from pptx import Presentation
+from pptx.util import Inches, Pt
+
+# 新しいプレゼンテーションを作成
+prs = Presentation()
+
+# タイトルスライドを追加
+title_slide_layout = prs.slide_layouts[0]
+slide = prs.slides.add_slide(title_slide_layout)
+title = slide.shapes.title
+subtitle = slide.placeholders[1]
+
+title.text = "エラーが発生しました"
+subtitle.text = "{provider_name} APIエラーまたはその他のエラーにより、プレゼンテーションを生成できませんでした。"
+
+# 情報スライドを追加
+bullet_slide_layout = prs.slide_layouts[1]
+slide = prs.slides.add_slide(bullet_slide_layout)
+title = slide.shapes.title
+body = slide.placeholders[1]
+
+title.text = "エラーの解決方法"
+tf = body.text_frame
+tf.text = "以下の方法を試してください："
+
+p = tf.add_paragraph()
+p.text = "1. {provider_name}ダッシュボードでAPIの使用状況と制限を確認する"
+p.level = 1
+
+p = tf.add_paragraph()
+p.text = "2. 有料プランにアップグレードする"
+p.level = 1
+
+p = tf.add_paragraph()
+p.text = "3. 別のAPIキーを使用する"
+p.level = 1
+
+p = tf.add_paragraph()
+p.text = "4. 別のAIプロバイダーを試す"
+p.level = 1
+
+# プレゼンテーションを保存
+prs.save('workspace/output/error_presentation.pptx')
+print("エラー用のプレゼンテーションが生成されました: workspace/output/error_presentation.pptx")
+```
@@ -0,0 +1,43 @@
+```python
+# APIエラーが発生したため、基本的なPPTXファイルを生成するコードを返します
+from pptx import Presentation
+from pptx.util import Inches, Pt
+from pptx.enum.text import PP_ALIGN
+
+# テンプレートから新しいプレゼンテーションを作成
+prs = Presentation('workspace/input/template.pptx')
+
+# タイトルスライドを追加
+slide_layout = prs.slide_layouts[2]
+slide = prs.slides.add_slide(slide_layout)
+
+# プレースホルダーへテキストを設定
+title_placeholder = slide.placeholders[10]
+subtitle_placeholder = slide.placeholders[11]
+presenter_placeholder = slide.placeholders[12]
+title_placeholder.text = "APIエラーが発生しました"
+subtitle_placeholder.text = "エラーのため簡易的なプレゼンテーションを生成しました"
+presenter_placeholder.text = "AI プレゼンテーション生成"
+
+# 内容スライドを追加
+slide_layout = prs.slide_layouts[0]
+slide = prs.slides.add_slide(slide_layout)
+title = slide.shapes.title
+body = slide.placeholders[1]
+title.text = "プレゼンテーション内容"
+tf = body.text_frame
+tf.text = "APIエラーが発生したため、本来の内容を生成できませんでした。"
+
+p = tf.add_paragraph()
+p.text = "1. 問題が解決するまでこの簡易版プレゼンテーションをご利用ください。"
+p.level = 1
+
+p = tf.add_paragraph()
+p.text = "2. APIの利用制限を確認してください。"
+p.level = 1
+
+# 保存
+output_file = 'workspace/output/error_presentation.pptx'
+prs.save(output_file)
+print(f"プレゼンテーションを {output_file} に保存しました。")
+```
@@ -4,10 +4,14 @@
 
 Classes:
     Judgement: ストーリーの評価結果を表すデータモデル
+    RevisedJudgement: ストーリーの評価結果と改善したストーリーを表すデータモデル
+    PresentationPlan: ストーリー・評価結果・スライド内容を一括で生成した結果を表すデータモデル
     State: ワークフロー全体の状態を管理するデータモデル
 """
 
-from langchain_core.pydantic_v1 import BaseModel, Field
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
 
 class Judgement(BaseModel):
     """
@@ -20,6 +24,28 @@ class Judgement(BaseModel):
     judge: bool = Field(default=False, description="ストーリーが十分かどうかの判定結果")
     reason: str = Field(default="", description="ストーリーが十分かどうかの判定理由")
 
+class RevisedJudgement(Judgement):
+    """
+    ストーリーの評価結果と、不十分な場合に改善したストーリーを表すデータモデル
+
+    Attributes:
+        improved_story (Optional[str]): 評価結果を反映して改善したストーリー（十分な場合はNone）
+    """
+    improved_story: Optional[str] = Field(default=None, description="ストーリーが不十分な場合に、判定理由を反映して改善したストーリーの全文（十分な場合はnull）")
+
+class PresentationPlan(BaseModel):
+    """
+    ストーリー・評価結果・スライド内容を1回の呼び出しで生成した結果を表すデータモデル
+
+    Attributes:
+        story (str): 生成されたストーリー
+        judgement (Judgement): ストーリーの自己評価の結果
+        slides (str): ストーリーに基づくスライドの内容
+    """
+    story: str = Field(default="", description="ユーザーリクエストに基づくプレゼンテーションのストーリー")
+    judgement: Judgement = Field(default_factory=Judgement, description="ストーリーが良いプレゼンテーション資料を作成するために十分で適切かどうかの評価")
+    slides: str = Field(default="", description="ストーリーに基づくスライドの内容（ルールに従ったテキスト）")
+
 class State(BaseModel):
     """
     ステートを表すデータモデル
@@ -30,6 +56,9 @@ class State(BaseModel):
         iteration (int): ストーリー生成の反復回数
         current_judge (bool): ストーリーが十分かどうかの判定結果
         judgement_reason (str): ストーリーが十分かどうかの判定理由
+        story_hashes (List[str]): これまでに生成したストーリーのハッシュ
+        converged (bool): 再生成しても前回とほぼ同じストーリーしか得られなくなったかどうか
+        story_revised (bool): 直前の評価でストーリーを改善したかどうか（改善したストーリーは続けて評価する）
         slide_contents (str): スライドの内容
         slide_gen_code (str): スライド生成のコード
     """
@@ -38,5 +67,8 @@ class State(BaseModel):
     iteration: int = Field(default=0, description="ストーリー生成の反復回数")
     current_judge: bool = Field(default=False, description="ストーリーが十分かどうかの判定結果")
     judgement_reason: str = Field(default="", description="ストーリーが十分かどうかの判定理由")
+    story_hashes: List[str] = Field(default_factory=list, description="これまでに生成したストーリーのハッシュ")
+    converged: bool = Field(default=False, description="再生成しても前回とほぼ同じストーリーしか得られなくなったかどうか")
+    story_revised: bool = Field(default=False, description="直前の評価でストーリーを改善したかどうか")
     slide_contents: str = Field(default="", description="スライドの内容")
     slide_gen_code: str = Field(default="", description="スライド生成のコード") 
\ No newline at end of file
@@ -0,0 +1,27 @@
+"""
+このモジュールは作業ディレクトリを作成する機能を提供します。
+一度作成を確認したディレクトリはプロセス内で記録し、以降の呼び出しではファイルシステムへの問い合わせを省略します。
+
+Functions:
+    ensure_dir: ディレクトリが存在しない場合に作成する（プロセスごとに一度だけ）
+"""
+
+import os
+from typing import Set
+
+# 作成済みであることを確認したディレクトリ
+_DIRS_READY: Set[str] = set()
+
+def ensure_dir(path: str) -> None:
+    """
+    ディレクトリが存在しない場合に作成する
+    同じパスに対する2回目以降の呼び出しではシステムコールを発行しない
+    （プロセスの実行中にディレクトリが削除された場合は再作成されない点に注意）
+
+    Args:
+        path (str): 作成するディレクトリのパス
+    """
+    if path in _DIRS_READY:
+        return
+    os.makedirs(path, exist_ok=True)
+    _DIRS_READY.add(path)
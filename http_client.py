@@ -0,0 +1,28 @@
+"""
+このモジュールはOpenAI APIの呼び出しで共有するHTTPクライアントを提供します。
+通常のLLMとフォールバック用のLLMで同じ接続プールを使い、TCP/TLSの接続を使い回します。
+
+Functions:
+    get_http_client: プロセス全体で共有するHTTPクライアントを取得する
+"""
+
+from functools import lru_cache
+
+import httpx
+from openai import DefaultHttpxClient
+
+# 接続プールの上限（スライドごとの並列生成と先行生成を合わせた同時接続数に余裕を持たせる）
+MAX_CONNECTIONS = 32
+MAX_KEEPALIVE_CONNECTIONS = 16
+
+@lru_cache(maxsize=1)
+def get_http_client() -> httpx.Client:
+    """
+    プロセス全体で共有するHTTPクライアントを取得する（初回の呼び出し時に作成）
+
+    Returns:
+        httpx.Client: OpenAIクライアントの既定設定に接続プールの上限を指定したクライアント
+    """
+    return DefaultHttpxClient(
+        limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS)
+    )
@@ -0,0 +1,433 @@
+"""
+このモジュールはLLMの生成結果をディスクにキャッシュするための機能を提供します。
+同じ入力・同じモデルでの再実行時にLLMを呼び出さずに結果を再利用するために使用します。
+キャッシュはコンテンツのハッシュをファイル名とし、書き込みは一時ファイルからの置き換えで行います。
+言い換えられたリクエストにも対応できるよう、埋め込みベクトルの類似度で検索するキャッシュも提供します。
+引用符で囲まれた語句だけが異なるリクエストには、生成したテキストの該当箇所を差し替えて再利用するキャッシュも提供します。
+
+Classes:
+    ResponseCache: ハッシュキーで生成結果を保存・取得するファイルキャッシュ
+    SemanticCache: 埋め込みベクトルのコサイン類似度で生成結果を検索するキャッシュ
+    TemplateCache: リクエストの可変部分を差し替えて生成したテキストを再利用するキャッシュ
+
+Functions:
+    make_cache_key: キャッシュキー（SHA-256）を生成する
+    describe_llm: キャッシュキーに含めるLLMの識別情報を取得する
+    with_prompt_cache_key: OpenAIのプロンプトキャッシュのルーティングキーをLLMに付与する
+    prompt_cache_key: 描画済みのプロンプトとLLMの設定からLLM呼び出し単位のキャッシュキーを生成する
+    messages_cache_key: 描画済みのメッセージとLLMの設定からLLM呼び出し単位のキャッシュキーを生成する
+    extract_template: テキストから引用符で囲まれた語句を取り出し、プレースホルダーに置き換える
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import Runnable
+from langchain_openai.chat_models.base import BaseChatOpenAI
+
+from dirs import ensure_dir
+
+# ロガーの設定
+logger = logging.getLogger(__name__)
+
+# リクエストの可変部分とみなす、引用符で囲まれた語句のパターン
+SLOT_PATTERN = re.compile(r"「([^「」\n]+)」|『([^『』\n]+)』|“([^“”\n]+)”|\"([^\"\n]+)\"")
+
+def make_cache_key(*parts: object) -> str:
+    """
+    キャッシュキーを生成する
+
+    Args:
+        *parts: キーに含める値（モデル名、入力テキストなど）
+
+    Returns:
+        str: 各値を連結した文字列のSHA-256ハッシュ
+    """
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+def extract_template(text: str) -> Tuple[str, List[str]]:
+    """
+    テキストから引用符で囲まれた語句を取り出し、プレースホルダーに置き換える
+
+    Args:
+        text (str): 対象のテキスト（ユーザーリクエストなど）
+
+    Returns:
+        Tuple[str, List[str]]: 語句を ⟦番号⟧ に置き換えたテキストと、取り出した語句のリスト
+    """
+    slots: List[str] = []
+
+    def replace(match: re.Match) -> str:
+        value = next(group for group in match.groups() if group is not None)
+        slots.append(value)
+        return match.group(0).replace(value, f"⟦{len(slots) - 1}⟧")
+
+    return SLOT_PATTERN.sub(replace, text), slots
+
+def describe_llm(llm: BaseChatModel) -> str:
+    """
+    キャッシュキーに含めるLLMの識別情報を取得する
+
+    Args:
+        llm (BaseChatModel): 対話型言語モデルのインスタンス
+
+    Returns:
+        str: クラス名・モデル名・温度を連結した文字列
+    """
+    model_name = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+    temperature = getattr(llm, "temperature", None)
+    return f"{llm.__class__.__name__}|{model_name}|{temperature}"
+
+def with_prompt_cache_key(llm: BaseChatModel, cache_key: str) -> Runnable:
+    """
+    OpenAIのプロンプトキャッシュのルーティングキーをLLMに付与する
+    同じ固定プレフィックスを持つリクエストを同じキャッシュに振り分け、ヒット率を上げるために使用する
+
+    Args:
+        llm (BaseChatModel): 対話型言語モデルのインスタンス
+        cache_key (str): プロンプトの種類を表すキー（生成器ごとに固定）
+
+    Returns:
+        Runnable: OpenAIの場合はキーを付与したLLM、それ以外はそのままのLLM
+    """
+    # クラス名の文字列ではなくクラスで判定する（ChatOpenAI と AzureChatOpenAI の共通の基底クラス）
+    if not isinstance(llm, BaseChatOpenAI):
+        # Geminiなどは暗黙的なキャッシュに任せる
+        return llm
+    return llm.bind(extra_body={"prompt_cache_key": cache_key})
+
+def prompt_cache_key(llm: Runnable, name: str, prompt: ChatPromptTemplate, inputs: Dict[str, Any]) -> Optional[str]:
+    """
+    描画済みのプロンプトとLLMの設定からLLM呼び出し単位のキャッシュキーを生成する
+    温度が0より大きい場合は出力が毎回異なることを期待しているため、キャッシュしない
+
+    Args:
+        llm (Runnable): 対話型言語モデル（構造化出力などでラップされたものも可）
+        name (str): 呼び出し元を表す名前（生成器ごとに固定）
+        prompt (ChatPromptTemplate): 呼び出しに使用するプロンプト
+        inputs (Dict[str, Any]): プロンプトに渡す入力
+
+    Returns:
+        Optional[str]: キャッシュキー（キャッシュしない場合はNone）
+    """
+    return messages_cache_key(llm, name, prompt.format_messages(**inputs))
+
+def messages_cache_key(llm: Runnable, name: str, messages: List[BaseMessage]) -> Optional[str]:
+    """
+    描画済みのメッセージとLLMの設定からLLM呼び出し単位のキャッシュキーを生成する
+    温度が0より大きい場合は出力が毎回異なることを期待しているため、キャッシュしない
+
+    Args:
+        llm (Runnable): 対話型言語モデル（構造化出力などでラップされたものも可）
+        name (str): 呼び出し元を表す名前（生成器ごとに固定）
+        messages (List[BaseMessage]): プロンプトを描画したメッセージ
+
+    Returns:
+        Optional[str]: キャッシュキー（キャッシュしない場合はNone）
+    """
+    # with_structured_output などでラップされている場合は元のモデルを取り出す
+    base_llm = llm
+    while not isinstance(base_llm, BaseChatModel):
+        base_llm = getattr(base_llm, "bound", None) or getattr(base_llm, "first", None)
+        if base_llm is None:
+            return None
+    if getattr(base_llm, "temperature", None):
+        return None
+    contents = [(message.type, message.content) for message in messages]
+    return make_cache_key(name, describe_llm(base_llm), json.dumps(contents, ensure_ascii=False))
+
+class ResponseCache:
+    """
+    ハッシュキーで生成結果を保存・取得するファイルキャッシュ
+    直近に使用したエントリはメモリ上にも保持し、ファイルの読み込みを省略する
+
+    Attributes:
+        cache_dir (str): キャッシュファイルを保存するディレクトリ
+        memory_size (int): メモリ上に保持するエントリの最大数
+    """
+    def __init__(self, cache_dir: str, memory_size: int = 128):
+        """
+        ResponseCacheクラスの初期化
+
+        Args:
+            cache_dir (str): キャッシュファイルを保存するディレクトリ
+            memory_size (int, optional): メモリ上に保持するエントリの最大数。デフォルトは128
+        """
+        self.cache_dir = cache_dir
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        # スライド内容の先行生成などで複数スレッドから使用されるため、メモリ上のエントリはロックで保護する
+        self._lock = threading.Lock()
+        ensure_dir(cache_dir)
+
+    def _remember(self, key: str, value: str) -> None:
+        """
+        エントリをメモリ上に保持する（上限を超えた場合は最も古いものから破棄）
+
+        Args:
+            key (str): キャッシュキー
+            value (str): 生成結果
+        """
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        """
+        キーに対応するキャッシュファイルのパスを取得する
+
+        Args:
+            key (str): キャッシュキー
+
+        Returns:
+            str: キャッシュファイルのパス
+        """
+        return os.path.join(self.cache_dir, f"{key}.txt")
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        キャッシュから生成結果を取得する
+
+        Args:
+            key (str): キャッシュキー
+
+        Returns:
+            Optional[str]: キャッシュされた生成結果（存在しない場合はNone）
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning("キャッシュの読み込みに失敗しました: %s", e)
+            return None
+        self._remember(key, value)
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        """
+        生成結果をキャッシュに保存する（一時ファイルに書き込んでから置き換えるため、途中の状態は読まれない）
+
+        Args:
+            key (str): キャッシュキー
+            value (str): 保存する生成結果
+        """
+        self._remember(key, value)
+        try:
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.cache_dir, delete=False, suffix=".tmp") as f:
+                f.write(value)
+                tmp_path = f.name
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning("キャッシュの書き込みに失敗しました: %s", e)
+
+class SemanticCache:
+    """
+    埋め込みベクトルのコサイン類似度で生成結果を検索するキャッシュ
+    正規化済みの埋め込みを N×D の行列として保持し、検索は行列とクエリの内積1回で行う
+
+    Attributes:
+        embeddings (Embeddings): テキストの埋め込みを計算するモデル
+        cache_dir (str): 埋め込み行列と生成結果を保存するディレクトリ
+        threshold (float): キャッシュを再利用するコサイン類似度の下限
+        vectors (np.ndarray): 正規化済みの埋め込み行列（float32, N×D）
+        values (List[str]): 各行に対応する生成結果
+    """
+    # エージェントは実行ごとに作成され同じディレクトリを使用し、スライド内容の先行生成のスレッドからも使用されるため、
+    # 行列と生成結果の読み書きはインスタンス間で共有するロックで保護する
+    _lock = threading.Lock()
+
+    def __init__(self, embeddings: Embeddings, cache_dir: str, threshold: float = 0.92):
+        """
+        SemanticCacheクラスの初期化
+
+        Args:
+            embeddings (Embeddings): テキストの埋め込みを計算するモデル
+            cache_dir (str): 埋め込み行列と生成結果を保存するディレクトリ
+            threshold (float, optional): キャッシュを再利用するコサイン類似度の下限。デフォルトは0.92
+        """
+        self.embeddings = embeddings
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        ensure_dir(cache_dir)
+        self._vectors_path = os.path.join(cache_dir, "embeddings.npy")
+        self._values_path = os.path.join(cache_dir, "values.json")
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.values: List[str] = []
+        self._load()
+
+    def _load(self) -> None:
+        """
+        保存済みの埋め込み行列と生成結果を読み込む（行列はメモリマップで開く）
+        """
+        if not (os.path.exists(self._vectors_path) and os.path.exists(self._values_path)):
+            return
+        try:
+            with self._lock:
+                vectors = np.load(self._vectors_path, mmap_mode="r")
+                with open(self._values_path, "r", encoding="utf-8") as f:
+                    values = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("セマンティックキャッシュの読み込みに失敗しました: %s", e)
+            return
+        if len(values) == vectors.shape[0]:
+            self.vectors, self.values = vectors, values
+
+    def _embed(self, text: str) -> np.ndarray:
+        """
+        テキストの正規化済み埋め込みベクトルを計算する
+
+        Args:
+            text (str): 埋め込みを計算するテキスト
+
+        Returns:
+            np.ndarray: L2ノルムが1の埋め込みベクトル（float32）
+        """
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def get(self, text: str) -> Optional[str]:
+        """
+        類似したテキストに対する生成結果を検索する
+
+        Args:
+            text (str): 検索するテキスト
+
+        Returns:
+            Optional[str]: 類似度がしきい値以上の生成結果（見つからない場合はNone）
+        """
+        with self._lock:
+            vectors, values = self.vectors, self.values
+        if not values:
+            return None
+        try:
+            query = self._embed(text)
+        except Exception as e:
+            logger.warning("埋め込みの計算に失敗したため、セマンティックキャッシュを使用しません: %s", e)
+            return None
+        if query.shape[0] != vectors.shape[1]:
+            return None
+        scores = vectors @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        logger.info("セマンティックキャッシュにヒットしました（類似度 %.3f）", scores[best])
+        return values[best]
+
+    def set(self, text: str, value: str) -> None:
+        """
+        テキストの埋め込みと生成結果をキャッシュに追加し、ディスクに保存する
+        開いているメモリマップの元ファイルを書き換えないよう、一時ファイルに書き込んでから置き換える
+
+        Args:
+            text (str): 生成結果の元になったテキスト
+            value (str): 保存する生成結果
+        """
+        try:
+            vector = self._embed(text)
+        except Exception as e:
+            logger.warning("埋め込みの計算に失敗したため、セマンティックキャッシュに保存しません: %s", e)
+            return
+        with self._lock:
+            if self.values:
+                if vector.shape[0] != self.vectors.shape[1]:
+                    logger.warning("埋め込みの次元が既存のキャッシュと異なるため保存しません")
+                    return
+                # 既に類似したエントリがあれば追加しない
+                if float(np.max(self.vectors @ vector)) >= self.threshold:
+                    return
+            self.vectors = np.vstack([self.vectors, vector]) if self.values else vector[np.newaxis, :]
+            self.values = self.values + [value]
+            try:
+                with tempfile.NamedTemporaryFile("wb", dir=self.cache_dir, delete=False, suffix=".tmp") as f:
+                    np.save(f, self.vectors)
+                    vectors_tmp_path = f.name
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.cache_dir, delete=False, suffix=".tmp") as f:
+                    json.dump(self.values, f, ensure_ascii=False)
+                    values_tmp_path = f.name
+                os.replace(vectors_tmp_path, self._vectors_path)
+                os.replace(values_tmp_path, self._values_path)
+            except OSError as e:
+                logger.warning("セマンティックキャッシュの書き込みに失敗しました: %s", e)
+
+class TemplateCache:
+    """
+    リクエストの可変部分を差し替えて生成したテキストを再利用するキャッシュ
+    「」などの引用符で囲まれた語句だけが異なるリクエストを同じひな形とみなし、
+    保存したテキストの語句を新しいリクエストの語句に置き換えて返す（LLMは呼び出さない）
+    差し替えは単純な文字列置換のため、実行されるコードではなくスライド内容などのテキストにのみ使用する
+
+    Attributes:
+        cache (ResponseCache): ひな形化したテキストを保存するキャッシュ
+    """
+    def __init__(self, cache: ResponseCache):
+        """
+        TemplateCacheクラスの初期化
+
+        Args:
+            cache (ResponseCache): ひな形化したテキストを保存するキャッシュ
+        """
+        self.cache = cache
+
+    def get(self, namespace: str, text: str) -> Optional[str]:
+        """
+        同じひな形のリクエストに対して生成したテキストを、語句を差し替えて取得する
+
+        Args:
+            namespace (str): キャッシュを区別する名前（生成器の名前とLLMの識別情報など）
+            text (str): ユーザーリクエスト
+
+        Returns:
+            Optional[str]: 語句を差し替えたテキスト（引用符で囲まれた語句がない、または見つからない場合はNone）
+        """
+        template, slots = extract_template(text)
+        if not slots:
+            return None
+        value = self.cache.get(make_cache_key("template", namespace, template))
+        if value is None:
+            return None
+        for i, slot in enumerate(slots):
+            value = value.replace(f"⟦{i}⟧", slot)
+        logger.info("同じひな形のリクエストに対して生成したテキストを、語句を差し替えて使用します")
+        return value
+
+    def set(self, namespace: str, text: str, value: str) -> None:
+        """
+        生成したテキストの語句をプレースホルダーに置き換えて保存する
+        語句が重複・包含している場合、1文字や数字のみの場合、テキストに含まれない場合は、正しく差し替えられないため保存しない
+
+        Args:
+            namespace (str): キャッシュを区別する名前（生成器の名前とLLMの識別情報など）
+            text (str): ユーザーリクエスト
+            value (str): 保存するテキスト
+        """
+        template, slots = extract_template(text)
+        if not slots or "⟦" in value:
+            return
+        for i, slot in enumerate(slots):
+            others = slots[:i] + slots[i + 1:]
+            if len(slot) < 2 or slot.isdigit() or slot not in value or any(slot in other for other in others):
+                return
+        for i, slot in enumerate(slots):
+            value = value.replace(slot, f"⟦{i}⟧")
+        self.cache.set(make_cache_key("template", namespace, template), value)
@@ -0,0 +1,25 @@
+"""
+このモジュールはアプリケーション全体のログ出力の設定を提供します。
+各モジュールはロガーの取得のみを行い、ログの出力先や出力レベルはエントリーポイント（main.py、app.py）で一度だけ設定します。
+
+Functions:
+    configure_logging: ルートロガーの出力レベルと出力形式を設定する
+"""
+
+import logging
+
+# 設定済みかどうか（Streamlitの再実行などで何度呼ばれても一度だけ設定する）
+_CONFIGURED = False
+
+def configure_logging(level: int = logging.INFO) -> None:
+    """
+    ルートロガーの出力レベルと出力形式を設定する（プロセスごとに一度だけ）
+
+    Args:
+        level (int, optional): ログの出力レベル。デフォルトは logging.INFO
+    """
+    global _CONFIGURED
+    if _CONFIGURED:
+        return
+    logging.basicConfig(level=level)
+    _CONFIGURED = True
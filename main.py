@@ -15,7 +15,11 @@ import argparse
 import os
 from langchain_openai import ChatOpenAI
 
+from http_client import get_http_client
+from log_config import configure_logging
 from pptx_agent import PPTXAgent
+from pptx_code_generator import extract_code_block
+from preflight import read_request_text
 
 def main():
     """
@@ -41,23 +45,25 @@ def main():
     
     # テキストの取得
     filepath = args.file
-    if filepath.endswith((".txt", ".docx", ".md")):
-        with open(filepath, "r") as f:
-            user_request = f.read()
+    if filepath.lower().endswith((".txt", ".docx", ".md")):
+        with open(filepath, "rb") as f:
+            user_request = read_request_text(f, filepath)
     else:
         raise ValueError("ファイル形式がサポートされていません")
     
     # ChatOpenAIモデルを初期化
-    llm = ChatOpenAI(model="gpt-4o", temperature=0.0)
+    llm = ChatOpenAI(model="gpt-4o", temperature=0.0, http_client=get_http_client())
     # PPTXAgentを初期化
     agent = PPTXAgent(llm=llm)
-    # エージェントを実行して最終的な出力を取得
-    final_output = agent.run(user_request=user_request)
+    # エージェントを実行して最終的な出力を取得（生成中のコードは順次表示する）
+    final_output = agent.run(user_request=user_request, on_code_chunk=lambda chunk: print(chunk, end="", flush=True))
+    print()
     # Python コードブロックが含まれている場合の処理
-    if "```python" in final_output:
-        final_output = final_output.split("```python\n")[-1].split("```")[0]
+    code = extract_code_block(final_output)
+    if code is not None:
+        final_output = code
     # 出力をファイルに保存
-    with open("workspace/output/create_pptx.py", "w") as f:
+    with open("workspace/output/create_pptx.py", "w", encoding="utf-8") as f:
         f.write(final_output)
         
     print("生成されたPythonコードを workspace/output/create_pptx.py に保存しました。")
@@ -72,4 +78,6 @@ def main():
     print("[動画: 説明テキスト]")
     
 if __name__ == "__main__":
+    # ログの出力設定はエントリーポイントで一度だけ行う
+    configure_logging()
     main()
@@ -6,32 +6,141 @@ OpenAIとGoogle Gemini両方のAPIに対応しています。
 
 Classes:
     PPTXAgent: PowerPoint資料を自動生成するAIエージェント
+
+Functions:
+    error_presentation_code: 生成に失敗した場合に実行する、簡易的なプレゼンテーションを作成するコードを返す
 """
 
-from typing import Any, Optional, Dict, Callable, Union
+from typing import Any, Optional, Dict, Callable, Tuple, Union
 import os
 import logging
+import threading
 import time
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
 
 # ロガーの設定
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 from langchain_openai import ChatOpenAI
+from openai import (APIConnectionError, APITimeoutError, AuthenticationError, BadRequestError, NotFoundError,
+                    PermissionDeniedError, RateLimitError, UnprocessableEntityError)
 try:
     from langchain_google_genai import ChatGoogleGenerativeAI
     GEMINI_AVAILABLE = True
 except ImportError:
     GEMINI_AVAILABLE = False
     logger.warning("langchain_google_genai をインポートできませんでした。Google Gemini機能は無効化されます。")
+from langchain_core.embeddings import Embeddings
 from langchain_core.language_models.chat_models import BaseChatModel
 from langgraph.graph import END, StateGraph
 
+from backoff import backoff_delay, is_quota_error
 from datamodel import Judgement, State
+from dirs import ensure_dir
+from http_client import get_http_client
+from llm_cache import ResponseCache, SemanticCache, TemplateCache, describe_llm, make_cache_key
 from story_generator import StoryGenerator
 from story_evaluator import StoryEvaluator
 from slide_contents_generator import SlideContentsGenerator
-from pptx_code_generator import PPTXCodeGenerator
+from pptx_code_generator import PPTXCodeGenerator, load_code_template
+from presentation_pipeline import PresentationPipeline
+from preflight import prepare_user_request
+from rate_limiter import RateLimiter
+
+# エージェントの最終出力（Pythonコード）をキャッシュするディレクトリ
+AGENT_CACHE_DIR = "workspace/cache/agent"
+
+# 再試行しても結果が変わらないエラー（認証・権限・リクエスト内容の誤り）
+NON_RETRYABLE_ERRORS = (AuthenticationError, PermissionDeniedError, BadRequestError, NotFoundError, UnprocessableEntityError)
+
+# 待機して再試行すれば解決する可能性のあるエラー（レート制限・接続エラー・タイムアウト）
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError)
+
+# 各生成器のLLM呼び出し結果をキャッシュするディレクトリ
+LLM_CACHE_DIR = "workspace/cache/llm"
+
+# 類似リクエストのストーリー・スライド内容をキャッシュするディレクトリ
+SEMANTIC_CACHE_DIR = "workspace/cache/semantic"
+
+# 引用符で囲まれた語句だけが異なるリクエストのスライド内容をキャッシュするディレクトリ
+TEMPLATE_CACHE_DIR = "workspace/cache/template"
+
+# ストーリー生成・評価を繰り返す最大回数
+MAX_STORY_ITERATIONS = 5
+
+# LLMで評価する前に差し戻すストーリーの最小文字数（空や極端に短い出力は評価するまでもなく不十分）
+MIN_STORY_LENGTH = 100
+
+# 再生成したストーリーを前回とほぼ同じとみなす類似度（差分が5%未満なら評価しても結果は変わらない）
+STORY_CONVERGENCE_RATIO = 0.95
+
+# 通常のLLMの呼び出しを止めてフォールバックに切り替えるまでの連続失敗回数
+BREAKER_FAILURE_THRESHOLD = 3
+
+# 通常のLLMの呼び出しを止める秒数（再開後の試行にも失敗した場合は倍にする）
+BREAKER_COOLDOWN = 60.0
+
+# エージェント間で共有するフォールバック用のLLM（プロバイダーとモデル名ごとに1つ）
+_fallback_llms: Dict[Tuple[str, str], BaseChatModel] = {}
+_fallback_llms_lock = threading.Lock()
+
+# 最後のストーリー評価と並行してスライド内容を先行生成するためのスレッドプール
+# （エージェントは実行ごとに作成されるため、スレッドが増え続けないようエージェント間で共有する）
+_speculation_executor = ThreadPoolExecutor(max_workers=2)
+
+def _get_fallback_llm(api_provider: str, model_name: str) -> BaseChatModel:
+    """
+    フォールバック用のLLMを取得する（初回の呼び出し時に作成）
+
+    Args:
+        api_provider (str): 使用するAPIプロバイダー ("OpenAI" または "Google Gemini")
+        model_name (str): フォールバック用のモデル名
+
+    Returns:
+        BaseChatModel: フォールバック用のLLM
+    """
+    with _fallback_llms_lock:
+        llm = _fallback_llms.get((api_provider, model_name))
+        if llm is None:
+            if api_provider == "OpenAI":
+                # 通常のLLMと接続プールを共有する
+                llm = ChatOpenAI(model=model_name, temperature=0.0, http_client=get_http_client())
+            else:
+                llm = ChatGoogleGenerativeAI(model=model_name, temperature=0.0)
+            _fallback_llms[(api_provider, model_name)] = llm
+        return llm
+
+def _is_quota_exhausted(error: BaseException) -> bool:
+    """
+    再試行しても解決しないAPIクォータ超過のエラーかどうかを判定する
+    OpenAIのエラーは例外クラスとエラーコードで判定し、それ以外のプロバイダーのエラーのみメッセージで判定する
+
+    Args:
+        error (BaseException): API呼び出しで発生したエラー
+
+    Returns:
+        bool: クォータ超過のエラーの場合はTrue
+    """
+    if isinstance(error, RateLimitError):
+        # 429のうち、クォータ超過のみを再試行の対象外とする
+        return getattr(error, "code", None) == "insufficient_quota"
+    if isinstance(error, RETRYABLE_ERRORS + NON_RETRYABLE_ERRORS):
+        return False
+    return is_quota_error(error)
+
+def error_presentation_code(api_provider: str) -> str:
+    """
+    生成に失敗した場合に実行する、簡易的なプレゼンテーションを作成するコードを返す
+
+    Args:
+        api_provider (str): 使用したAPIプロバイダー ("OpenAI" または "Google Gemini")
+
+    Returns:
+        str: エラー用のプレゼンテーションを作成するPythonコード
+    """
+    provider_name = "OpenAI" if api_provider == "OpenAI" else "Google Gemini"
+    return load_code_template("error_presentation.py.tpl").format(provider_name=provider_name)
 
 class PPTXAgent:
     """
@@ -46,10 +155,23 @@ class PPTXAgent:
         use_fallback (bool): APIエラー時にフォールバックを使用するかどうか
         fallback_llm (BaseChatModel): フォールバック用のLLM
         max_retries (int): 最大再試行回数
+        base_delay (float): 再試行までの基本待機秒数
+        revise_in_evaluation (bool): ストーリーの評価と改善を1回のLLM呼び出しで行うかどうか
+        fuse_story_pipeline (bool): 最初のストーリー生成・評価・スライド内容生成を1回のLLM呼び出しで行うかどうか
+        presentation_pipeline (PresentationPipeline): ストーリー・評価結果・スライド内容の一括生成器
         api_provider (str): 使用するAPIプロバイダー ("OpenAI" または "Google Gemini")
+        cache (ResponseCache): 生成されたPythonコードのキャッシュ
+        llm_cache (ResponseCache): 各生成器のLLM呼び出し結果のキャッシュ
+        story_cache (SemanticCache): 類似リクエストのストーリーのキャッシュ（埋め込みモデル未指定時はNone）
+        slide_contents_cache (SemanticCache): 類似ストーリーのスライド内容のキャッシュ（埋め込みモデル未指定時はNone）
+        rate_limiter (RateLimiter): 各生成器で共有するレートリミッター（未指定時はNone）
+        template_cache (TemplateCache): 語句だけが異なるリクエストのスライド内容のキャッシュ（無効時はNone）
     """
     def __init__(self, llm: BaseChatModel, use_fallback: bool = True, max_retries: int = 3, 
-                 api_provider: str = "OpenAI", fallback_model: Optional[str] = None):
+                 api_provider: str = "OpenAI", fallback_model: Optional[str] = None,
+                 embeddings: Optional[Embeddings] = None, base_delay: float = 1.0,
+                 revise_in_evaluation: bool = True, fuse_story_pipeline: bool = False,
+                 rate_limiter: Optional[RateLimiter] = None, reuse_templates: bool = False):
         """
         PPTXAgentクラスの初期化
 
@@ -59,6 +181,14 @@ class PPTXAgent:
             max_retries (int, optional): 最大再試行回数。デフォルトは3
             api_provider (str, optional): 使用するAPIプロバイダー。デフォルトは"OpenAI"
             fallback_model (str, optional): フォールバック用のモデル名。指定がなければ自動選択
+            embeddings (Embeddings, optional): セマンティックキャッシュに使用する埋め込みモデル。指定がなければ無効
+            base_delay (float, optional): 再試行までの基本待機秒数。デフォルトは1.0
+            revise_in_evaluation (bool, optional): ストーリーの評価と改善を1回のLLM呼び出しで行うかどうか。
+                Falseの場合は評価と再生成を別々に呼び出す。デフォルトはTrue
+            fuse_story_pipeline (bool, optional): 最初のストーリー生成・評価・スライド内容生成を1回のLLM呼び出しで行うかどうか。
+                自己評価で不十分と判断された場合は通常の評価・改善の流れに引き継ぐ。デフォルトはFalse
+            rate_limiter (RateLimiter, optional): すべての生成器で共有するレートリミッター。指定がなければ制限しない
+            reuse_templates (bool, optional): 「」などで囲まれた語句だけが異なるリクエストに、語句を差し替えたスライド内容を返すかどうか。デフォルトはFalse
         """
         # APIプロバイダーの設定
         self.api_provider = api_provider
@@ -66,41 +196,117 @@ class PPTXAgent:
         # フォールバックの設定
         self.use_fallback = use_fallback
         self.primary_llm = llm
-        self.fallback_llm = None
+        # フォールバック用のLLMは実際に必要になった時に作成する（ここではモデル名だけを決める）
+        self._fallback_llm = None
+        self._fallback_model_name = None
         
         if self.use_fallback:
-            try:
-                if api_provider == "OpenAI":
-                    fallback_model_name = fallback_model or "gpt-3.5-turbo"
-                    if getattr(llm, "model_name", "") != fallback_model_name:
-                        self.fallback_llm = ChatOpenAI(model=fallback_model_name, temperature=0.0)
-                elif api_provider == "Google Gemini" and GEMINI_AVAILABLE:
-                    fallback_model_name = fallback_model or "gemini-1.5-flash"
-                    if getattr(llm, "model", "") != fallback_model_name:
-                        self.fallback_llm = ChatGoogleGenerativeAI(model=fallback_model_name, temperature=0.0)
-                else:
-                    logger.warning(f"フォールバックLLMの初期化に失敗しました: サポートされていないAPIプロバイダー ({api_provider}) または必要なライブラリがインストールされていません")
-            except Exception as e:
-                logger.warning(f"フォールバックLLMの初期化に失敗しました: {e}")
+            if api_provider == "OpenAI":
+                fallback_model_name = fallback_model or "gpt-3.5-turbo"
+                if getattr(llm, "model_name", "") != fallback_model_name:
+                    self._fallback_model_name = fallback_model_name
+            elif api_provider == "Google Gemini" and GEMINI_AVAILABLE:
+                fallback_model_name = fallback_model or "gemini-1.5-flash"
+                if getattr(llm, "model", "") != fallback_model_name:
+                    self._fallback_model_name = fallback_model_name
+            else:
+                logger.warning("フォールバックLLMの初期化に失敗しました: サポートされていないAPIプロバイダー (%s) または必要なライブラリがインストールされていません", api_provider)
                 
         self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.revise_in_evaluation = revise_in_evaluation
+        self.fuse_story_pipeline = fuse_story_pipeline
+        self.rate_limiter = rate_limiter
+        
+        # 各生成器のLLM呼び出し結果のキャッシュ（エージェント全体の結果がキャッシュされていない場合も途中の段階を再利用）
+        self.llm_cache = ResponseCache(LLM_CACHE_DIR)
+        
+        # 語句だけが異なるリクエストでスライド内容の生成を省略するためのキャッシュ（任意）
+        self.template_cache = TemplateCache(ResponseCache(TEMPLATE_CACHE_DIR)) if reuse_templates else None
         
         # 各種ジェネレーターの初期化
-        self.story_generator = StoryGenerator(llm=llm, max_retries=2)
-        self.story_evaluator = StoryEvaluator(llm=llm)
-        self.slide_contents_generator = SlideContentsGenerator(llm=llm)
-        self.pptx_code_generator = PPTXCodeGenerator(llm=llm)
+        # レートリミッターは同じインスタンスを共有し、プロバイダーへの呼び出し全体の流量を制限する
+        self.story_generator = StoryGenerator(llm=llm, max_retries=2, cache=self.llm_cache, base_delay=base_delay,
+                                              rate_limiter=rate_limiter)
+        self.story_evaluator = StoryEvaluator(llm=llm, cache=self.llm_cache, rate_limiter=rate_limiter)
+        self.slide_contents_generator = SlideContentsGenerator(llm=llm, cache=self.llm_cache, base_delay=base_delay,
+                                                               rate_limiter=rate_limiter, template_cache=self.template_cache)
+        self.pptx_code_generator = PPTXCodeGenerator(llm=llm, cache=self.llm_cache, base_delay=base_delay,
+                                                     rate_limiter=rate_limiter)
+        self.presentation_pipeline = PresentationPipeline(llm=llm, cache=self.llm_cache, rate_limiter=rate_limiter)
+        
+        # 生成結果のキャッシュ（同じリクエスト・同じモデルでの再実行時に再利用）
+        self.cache = ResponseCache(AGENT_CACHE_DIR)
+        
+        # 言い換えられたリクエストでもLLM呼び出しを省略するためのセマンティックキャッシュ（任意）
+        self.story_cache = None
+        self.slide_contents_cache = None
+        if embeddings is not None:
+            self.story_cache = SemanticCache(embeddings, os.path.join(SEMANTIC_CACHE_DIR, "story"))
+            self.slide_contents_cache = SemanticCache(embeddings, os.path.join(SEMANTIC_CACHE_DIR, "slide_contents"))
+        
+        # 障害中のプロバイダーを呼び続けないためのサーキットブレーカーの状態（ノードは並行して実行されるためロックで保護する）
+        self._breaker_lock = threading.Lock()
+        self._breaker_failures = 0
+        self._breaker_open_until = 0.0
+        self._breaker_cooldown = BREAKER_COOLDOWN
+        self._breaker_probing = False
+        
+        # 生成中のPythonコードの断片を受け取る関数（run の呼び出しごとに設定）
+        self._on_code_chunk = None
+        # 実行中にいずれかのノードでフォールバックLLMを使用したかどうか（run の呼び出しごとにリセット）
+        self._used_fallback_llm = False
+        
+        # 初期状態のひな形（run の呼び出しごとに複製して使用する。リスト型の要素はノードで新しいリストに置き換えるため共有しても問題ない）
+        self._state_proto = State(user_request="")
+        
+        # 出力ディレクトリの確認
+        ensure_dir("workspace/output")
         
         # グラフの作成
         self.graph = self._create_graph()
         
+    @property
+    def fallback_llm(self) -> Optional[BaseChatModel]:
+        """
+        フォールバック用のLLM（初めて参照された時に作成し、同じ設定のエージェント間で共有する）
+        """
+        if self._fallback_llm is None and self._fallback_model_name is not None:
+            try:
+                self._fallback_llm = _get_fallback_llm(self.api_provider, self._fallback_model_name)
+            except Exception as e:
+                logger.warning("フォールバックLLMの初期化に失敗しました: %s", e)
+                self._fallback_model_name = None
+        return self._fallback_llm
+    
+    @fallback_llm.setter
+    def fallback_llm(self, llm: Optional[BaseChatModel]) -> None:
+        """
+        フォールバック用のLLMを設定する
+
+        Args:
+            llm (BaseChatModel): フォールバック用のLLM（Noneの場合はフォールバックしない）
+        """
+        self._fallback_llm = llm
+        self._fallback_model_name = None
+    
+    def _has_fallback(self) -> bool:
+        """
+        フォールバック用のLLMを使用できるかどうかを判定する（LLMの作成は行わない）
+
+        Returns:
+            bool: フォールバックが有効で、LLMが作成済みまたは作成可能な場合はTrue
+        """
+        return self.use_fallback and (self._fallback_llm is not None or self._fallback_model_name is not None)
+    
     def _with_retries_and_fallback(self, func: Callable, *args, **kwargs) -> Any:
         """
         リトライとフォールバックを実装した関数ラッパー
+        使用するLLMは生成器を差し替えずに呼び出しごとに渡すため、並行して実行されるノードに影響しない
 
         Args:
-            func (Callable): 実行する関数
-            *args: 関数に渡す位置引数
+            func (Callable): 実行する関数（呼び出しに使用するLLMを最初の引数に受け取る）
+            *args: 関数に渡す位置引数（LLMの後に渡す）
             **kwargs: 関数に渡すキーワード引数
 
         Returns:
@@ -108,54 +314,109 @@ class PPTXAgent:
 
         Raises:
             Exception: すべての試行が失敗した場合
+            RuntimeError: 通常のLLMが停止中で、フォールバックLLMも使用できない場合
         """
         last_error = None
+        has_fallback = self._has_fallback()
+        use_primary, probing = self._breaker_allows_primary() if has_fallback else (True, False)
+        if not use_primary:
+            logger.info("通常のLLMで失敗が続いているため、フォールバックLLMを直接使用します")
         
-        # 通常のLLMで試行
-        for attempt in range(self.max_retries):
+        # 通常のLLMで試行（ブレーカーの再開直後は1回だけ試す）
+        max_attempts = (1 if probing else self.max_retries) if use_primary else 0
+        breaker_failure = False
+        for attempt in range(max_attempts):
             try:
-                return func(*args, **kwargs)
+                result = func(self.primary_llm, *args, **kwargs)
+                if has_fallback:
+                    self._record_primary_result(True, probing)
+                return result
             except Exception as e:
                 last_error = e
-                error_msg = str(e).lower()
                 
-                # APIクォータ超過エラーまたはレート制限エラーの場合はすぐにフォールバック
-                quota_errors = ["insufficient_quota", "rate_limit", "quota exceeded"]
-                if any(err in error_msg for err in quota_errors):
-                    logger.warning(f"APIクォータ超過またはレート制限エラー: {e}")
+                # APIクォータ超過エラーの場合はすぐにフォールバック（例外クラスで判定し、OpenAI以外はメッセージで判定）
+                if _is_quota_exhausted(e):
+                    logger.warning("APIクォータ超過エラー: %s", e)
+                    breaker_failure = True
                     break
                 
-                # その他のエラーの場合はリトライ
-                logger.warning(f"エラーが発生しました（試行 {attempt+1}/{self.max_retries}）: {e}")
-                time.sleep(2 ** attempt)  # 指数バックオフ
+                # 認証エラーやリクエスト不正は再試行せず、すぐにフォールバック
+                if isinstance(e, NON_RETRYABLE_ERRORS):
+                    logger.warning("再試行しても解決しないエラーのため、再試行を中止します: %s", e)
+                    break
+                
+                # その他のエラー（レート制限・接続エラー・タイムアウト・サーバーエラー、OpenAI以外のプロバイダーのエラー）の場合はリトライ
+                logger.warning("エラーが発生しました（試行 %s/%s）: %s", attempt + 1, max_attempts, e)
+                breaker_failure = True
+                if attempt < max_attempts - 1:
+                    time.sleep(backoff_delay(attempt, self.base_delay, e))  # ジッター付き指数バックオフ
+        if has_fallback and use_primary:
+            # リクエスト内容に起因するエラーはプロバイダーの障害として数えない
+            if breaker_failure:
+                self._record_primary_result(False, probing)
+            elif probing:
+                self._record_primary_result(True, probing)
         
         # フォールバックが有効で利用可能な場合
-        if self.use_fallback and self.fallback_llm is not None:
-            logger.info(f"フォールバックLLMを使用します ({self.api_provider})")
-            
-            # 元のLLMを一時的にフォールバックに置き換え
-            orig_llm = {}
-            for component_name in ["story_generator", "story_evaluator", "slide_contents_generator", "pptx_code_generator"]:
-                component = getattr(self, component_name)
-                orig_llm[component_name] = component.llm
-                component.llm = self.fallback_llm
+        if has_fallback and self.fallback_llm is not None:
+            logger.info("フォールバックLLMを使用します (%s)", self.api_provider)
             
+            # 通常のLLMのキーで生成結果をキャッシュしないよう、フォールバックLLMの使用を記録する
+            self._used_fallback_llm = True
             try:
-                # フォールバックLLMで再実行
-                return func(*args, **kwargs)
+                # フォールバック用のLLMを渡して再実行
+                return func(self.fallback_llm, *args, **kwargs)
             except Exception as e:
-                logger.error(f"フォールバックLLMでも失敗しました: {e}")
+                logger.error("フォールバックLLMでも失敗しました: %s", e)
                 last_error = e
-            finally:
-                # 元のLLMを復元
-                for component_name, llm in orig_llm.items():
-                    component = getattr(self, component_name)
-                    component.llm = llm
         
         # すべての試行が失敗した場合
         if last_error:
             raise last_error
-        
+        # 通常のLLMが停止中で試行せず、フォールバックLLMも作成できなかった場合（結果なしのNoneを返さない）
+        raise RuntimeError("通常のLLMはサーキットブレーカーにより停止中で、フォールバックLLMも使用できません")
+    
+    def _breaker_allows_primary(self) -> Tuple[bool, bool]:
+        """
+        サーキットブレーカーの状態から通常のLLMを呼び出してよいかを判定する
+
+        Returns:
+            Tuple[bool, bool]: 通常のLLMを呼び出してよいかどうかと、停止期間明けの試行かどうか
+        """
+        with self._breaker_lock:
+            if self._breaker_open_until == 0.0:
+                return True, False
+            if self._breaker_probing or time.monotonic() < self._breaker_open_until:
+                return False, False
+            # 停止期間が明けたら1つの呼び出しだけで回復を確認する
+            self._breaker_probing = True
+            return True, True
+    
+    def _record_primary_result(self, success: bool, probing: bool) -> None:
+        """
+        通常のLLMの呼び出し結果をサーキットブレーカーに記録する
+
+        Args:
+            success (bool): 呼び出しに成功したかどうか
+            probing (bool): 停止期間明けの試行だったかどうか
+        """
+        with self._breaker_lock:
+            if probing:
+                self._breaker_probing = False
+            if success:
+                self._breaker_failures = 0
+                self._breaker_open_until = 0.0
+                self._breaker_cooldown = BREAKER_COOLDOWN
+                return
+            self._breaker_failures += 1
+            if probing:
+                # 回復していなければ停止期間を倍にして再び止める
+                self._breaker_cooldown *= 2
+            elif self._breaker_failures < BREAKER_FAILURE_THRESHOLD or self._breaker_open_until:
+                return
+            self._breaker_open_until = time.monotonic() + self._breaker_cooldown
+            logger.warning("通常のLLMで失敗が続いたため、%.0f秒間フォールバックLLMに切り替えます", self._breaker_cooldown)
+    
     def _create_graph(self) -> StateGraph:
         """
         ワークフローグラフを作成する
@@ -171,23 +432,58 @@ class PPTXAgent:
         workflow.add_node("evaluate_story", self._evaluate_story)
         workflow.add_node("generate_slide_contents", self._generate_slide_contents)
         workflow.add_node("generate_pptx_code", self._generate_pptx_code)
+        if self.fuse_story_pipeline:
+            workflow.add_node("plan_presentation", self._plan_presentation)
         
-        # エントリーポイントの設定
-        workflow.set_entry_point("generate_story")
+        # エントリーポイントの設定（一括生成を使用する場合は、最初のストーリー生成の代わりに一括生成から開始する）
+        workflow.set_entry_point("plan_presentation" if self.fuse_story_pipeline else "generate_story")
         
         # ノード間のエッジの追加
         workflow.add_edge("generate_story", "evaluate_story")
         workflow.add_conditional_edges(
             "evaluate_story",
-            lambda state: not state.current_judge and state.iteration < 5,
-            {True: "generate_story", False: "generate_slide_contents"}
+            self._next_after_evaluation,
+            ["generate_story", "evaluate_story", "generate_slide_contents"]
         )
         workflow.add_edge("generate_slide_contents", "generate_pptx_code")
         workflow.add_edge("generate_pptx_code", END)
         
+        if self.fuse_story_pipeline:
+            workflow.add_conditional_edges(
+                "plan_presentation",
+                # 自己評価で十分と判断された場合はスライド内容まで揃っているため、コード生成に進む
+                lambda state: "generate_pptx_code" if state.current_judge and state.slide_contents else "evaluate_story",
+                ["generate_pptx_code", "evaluate_story"]
+            )
+        
         # グラフのコンパイル
         return workflow.compile()
     
+    def _plan_presentation(self, state: State) -> dict[str, Any]:
+        """
+        ストーリー・評価結果・スライド内容を1回のLLM呼び出しで生成するノード処理
+
+        Args:
+            state (State): 現在の状態
+
+        Returns:
+            dict[str, Any]: 更新する状態の要素
+        """
+        # 一括生成（リトライとフォールバックを使用）
+        def generate_plan(llm: BaseChatModel):
+            return self.presentation_pipeline.run(state.user_request, llm=llm)
+        
+        plan = self._with_retries_and_fallback(generate_plan)
+        update = self._new_story_update(state, plan.story)
+        judged = plan.judgement.judge and len(plan.story.strip()) >= MIN_STORY_LENGTH and bool(plan.slides.strip())
+        update["current_judge"] = judged
+        update["judgement_reason"] = plan.judgement.reason
+        if judged:
+            update["slide_contents"] = plan.slides
+        else:
+            logger.info("一括生成したストーリーが不十分と判断されたため、評価と改善を続けます")
+        return update
+    
     def _generate_story(self, state: State) -> dict[str, Any]:
         """
         ストーリーを生成するノード処理
@@ -198,16 +494,67 @@ class PPTXAgent:
         Returns:
             dict[str, Any]: 更新する状態の要素
         """
+        # 初回は類似リクエストのストーリーがあれば再利用（再生成時は評価結果を反映するため使用しない）
+        if self.story_cache is not None and state.iteration == 0:
+            cached_story = self.story_cache.get(state.user_request)
+            if cached_story is not None:
+                return {
+                    "story": cached_story,
+                    "iteration": state.iteration + 1
+                }
+        
         # ストーリーの生成（リトライとフォールバックを使用）
-        def generate():
-            return self.story_generator.run(state.user_request)
+        def generate(llm: BaseChatModel):
+            # 差し戻し後の再生成では同じ結果を返さないようにキャッシュを使用しない
+            return self.story_generator.run(state.user_request, use_cache=state.iteration == 0, llm=llm)
         
         new_story = self._with_retries_and_fallback(generate)
+        return self._new_story_update(state, new_story)
+    
+    def _new_story_update(self, state: State, new_story: str) -> dict[str, Any]:
+        """
+        新しいストーリーに置き換えるための状態の更新内容を作成する
+
+        Args:
+            state (State): 現在の状態
+            new_story (str): 新しいストーリー
+
+        Returns:
+            dict[str, Any]: 更新する状態の要素
+        """
+        # 以前と同じか前回とほぼ同じストーリーであれば、評価しても結果は変わらないため反復を打ち切る
+        story_hash = make_cache_key(new_story)
+        converged = story_hash in state.story_hashes or self._is_near_duplicate(state.story, new_story)
+        if converged:
+            logger.info("再生成したストーリーが以前とほぼ同じため、ストーリーの改善を打ち切ります")
         
         return {
             "story": new_story,
-            "iteration": state.iteration + 1
+            "iteration": state.iteration + 1,
+            "story_hashes": state.story_hashes + [story_hash],
+            "converged": converged,
+            "story_revised": False
         }
+    
+    @staticmethod
+    def _is_near_duplicate(previous: str, current: str) -> bool:
+        """
+        再生成したストーリーが前回のストーリーとほぼ同じかどうかを判定する
+
+        Args:
+            previous (str): 前回のストーリー
+            current (str): 再生成したストーリー
+
+        Returns:
+            bool: 類似度がSTORY_CONVERGENCE_RATIO以上の場合はTrue
+        """
+        if not previous:
+            return False
+        matcher = SequenceMatcher(None, previous, current, autojunk=False)
+        # 上限値で足切りしてから正確な類似度を計算する
+        return (matcher.real_quick_ratio() >= STORY_CONVERGENCE_RATIO
+                and matcher.quick_ratio() >= STORY_CONVERGENCE_RATIO
+                and matcher.ratio() >= STORY_CONVERGENCE_RATIO)
         
     def _evaluate_story(self, state: State) -> dict[str, Any]:
         """
@@ -219,17 +566,77 @@ class PPTXAgent:
         Returns:
             dict[str, Any]: 更新する状態の要素
         """
+        # 前回とほぼ同じストーリーは前回の評価結果をそのまま使用する（反復はここで打ち切られる）
+        if state.converged:
+            return {"current_judge": state.current_judge, "story_revised": False}
+        
+        # 明らかに不十分なストーリーはLLMを呼び出さずに差し戻す
+        if len(state.story.strip()) < MIN_STORY_LENGTH:
+            logger.info("ストーリーが短すぎるため、LLMによる評価を行わずに再生成します")
+            return {
+                "current_judge": False,
+                "judgement_reason": f"ストーリーが短すぎます（{MIN_STORY_LENGTH}文字未満）。",
+                "story_revised": False
+            }
+        
+        # 反復回数の上限に達した最後の評価では、結果にかかわらずこのストーリーでスライド内容を生成するため、評価と並行して先行生成する
+        # （差し戻される可能性がある評価では、破棄される生成にLLMを呼び出さないよう先行生成しない）
+        speculative_contents = None
+        if state.iteration >= MAX_STORY_ITERATIONS:
+            speculative_contents = _speculation_executor.submit(self._build_slide_contents, state.user_request, state.story)
+        
         # ストーリーの評価（リトライとフォールバックを使用）
-        def evaluate():
-            return self.story_evaluator.run(state.user_request, state.story)
+        # 差し戻しの余地がある場合は、不十分な場合の改善したストーリーも同じ呼び出しで受け取る
+        revise = self.revise_in_evaluation and state.iteration < MAX_STORY_ITERATIONS
+        def evaluate(llm: BaseChatModel):
+            if revise:
+                return self.story_evaluator.run_and_revise(state.user_request, state.story, llm=llm)
+            return self.story_evaluator.run(state.user_request, state.story, llm=llm)
         
         judgement = self._with_retries_and_fallback(evaluate)
         
-        return {
+        # 評価を通過したストーリーはセマンティックキャッシュに保存
+        if judgement.judge and self.story_cache is not None and not self.story_generator.used_fallback:
+            self.story_cache.set(state.user_request, state.story)
+        
+        update = {
             "current_judge": judgement.judge,
-            "judgement_reason": judgement.reason
+            "judgement_reason": judgement.reason,
+            "story_revised": False
         }
+        improved_story = getattr(judgement, "improved_story", None) if revise else None
+        if not judgement.judge and improved_story and improved_story.strip():
+            # 改善したストーリーに置き換え、ストーリー生成ノードを経由せずに続けて評価する
+            update.update(self._new_story_update(state, improved_story))
+            update["story_revised"] = True
+            return update
+        if speculative_contents is not None:
+            try:
+                update["slide_contents"] = speculative_contents.result()
+            except Exception as e:
+                # 先行生成に失敗した場合はスライド内容生成ノードで改めて生成する
+                logger.warning("スライド内容の先行生成に失敗しました: %s", e)
+        return update
         
+    def _next_after_evaluation(self, state: State) -> str:
+        """
+        ストーリー評価の次に実行するノードを決める
+
+        Args:
+            state (State): 現在の状態
+
+        Returns:
+            str: 次に実行するノード名
+        """
+        if state.current_judge or state.converged:
+            return "generate_slide_contents"
+        # 評価と同時に改善したストーリーは、改めて生成せずにそのまま評価する
+        if state.story_revised:
+            return "evaluate_story"
+        if state.iteration >= MAX_STORY_ITERATIONS:
+            return "generate_slide_contents"
+        return "generate_story"
+    
     def _generate_slide_contents(self, state: State) -> dict[str, Any]:
         """
         スライド内容を生成するノード処理
@@ -240,13 +647,40 @@ class PPTXAgent:
         Returns:
             dict[str, Any]: 更新する状態の要素
         """
+        # ストーリー評価と並行して先行生成済みであればそれを使用
+        if state.slide_contents:
+            return {"slide_contents": state.slide_contents}
+        
+        return {"slide_contents": self._build_slide_contents(state.user_request, state.story)}
+    
+    def _build_slide_contents(self, user_request: str, story: str) -> str:
+        """
+        スライド内容を生成する（セマンティックキャッシュが有効な場合は類似した結果を再利用）
+
+        Args:
+            user_request (str): ユーザーからのリクエスト
+            story (str): スライドの元になるストーリー
+
+        Returns:
+            str: 生成されたスライド内容
+        """
+        # 類似したリクエスト・ストーリーのスライド内容があれば再利用
+        cache_text = f"{user_request}\n\n{story}"
+        if self.slide_contents_cache is not None:
+            cached_contents = self.slide_contents_cache.get(cache_text)
+            if cached_contents is not None:
+                return cached_contents
+        
         # スライド内容の生成（リトライとフォールバックを使用）
-        def generate_contents():
-            return self.slide_contents_generator.run(state.user_request, state.story)
+        def generate_contents(llm: BaseChatModel):
+            return self.slide_contents_generator.run(user_request, story, llm=llm)
         
         slide_contents = self._with_retries_and_fallback(generate_contents)
         
-        return {"slide_contents": slide_contents}
+        if self.slide_contents_cache is not None and not self.slide_contents_generator.used_fallback:
+            self.slide_contents_cache.set(cache_text, slide_contents)
+        
+        return slide_contents
     
     def _generate_pptx_code(self, state: State) -> dict[str, Any]:
         """
@@ -259,82 +693,84 @@ class PPTXAgent:
             dict[str, Any]: 更新する状態の要素
         """
         # Python-pptxコードの生成（リトライとフォールバックを使用）
-        def generate_code():
-            return self.pptx_code_generator.run(state.slide_contents)
+        def generate_code(llm: BaseChatModel):
+            if self._on_code_chunk is None:
+                return self.pptx_code_generator.run(state.slide_contents, llm=llm)
+            # 生成されたコードを受け取り次第、呼び出し元に渡す（再試行した場合も、コード全体は最後の試行の内容を使用する）
+            stream = self.pptx_code_generator.run_stream(state.slide_contents, llm=llm)
+            while True:
+                try:
+                    chunk = next(stream)
+                except StopIteration as stop:
+                    return stop.value
+                self._on_code_chunk(chunk)
         
         pptx_code = self._with_retries_and_fallback(generate_code)
         
         return {"slide_gen_code": pptx_code}
     
-    def run(self, user_request: str) -> str:
+    def generate(self, user_request: str, on_code_chunk: Optional[Callable[[str], None]] = None) -> str:
         """
-        AIエージェントを実行する
+        AIエージェントを実行する（失敗時はエラー用のコードを返さずに例外を発生させる）
 
         Args:
             user_request (str): ユーザーからのリクエスト
+            on_code_chunk (Callable[[str], None], optional): 生成中のPythonコードの断片を受け取る関数。
+                指定した場合はコードを生成しながら順に渡す（再試行時は新しい試行の断片が続けて渡される）
 
         Returns:
             str: 生成されたPythonコード
+
+        Raises:
+            Exception: グラフの実行中にエラーが発生した場合
         """
-        # 初期状態の設定
-        initial_state = State(user_request=user_request)
+        # 空のリクエストはLLMを呼び出さずにエラーとし、長すぎるリクエストは切り詰める
+        user_request = prepare_user_request(user_request)
+        # 同じリクエスト・同じモデルで生成済みであればキャッシュを返す
+        cache_key = make_cache_key(describe_llm(self.primary_llm), user_request)
+        cached_code = self.cache.get(cache_key)
+        if cached_code is not None:
+            logger.info("キャッシュされた生成結果を使用します")
+            return cached_code
         
-        # 出力ディレクトリの確認
-        os.makedirs("workspace/output", exist_ok=True)
+        # 初期状態の設定（検証済みのひな形を複製し、リクエストだけを差し替える）
+        initial_state = self._state_proto.model_copy(update={"user_request": user_request})
+        self._on_code_chunk = on_code_chunk
+        self._used_fallback_llm = False
         
         try:
             # グラフの実行
             final_state = self.graph.invoke(initial_state)
-            # 最終的なPythonコードの取得
-            return final_state["slide_gen_code"]
+        finally:
+            self._on_code_chunk = None
+        # 最終的なPythonコードの取得
+        slide_gen_code = final_state["slide_gen_code"]
+        # いずれかの段階でフォールバックLLMまたはフォールバックの内容が使われた場合はキャッシュしない
+        generators = [self.story_generator, self.slide_contents_generator, self.pptx_code_generator]
+        if not self._used_fallback_llm and not any(generator.used_fallback for generator in generators):
+            self.cache.set(cache_key, slide_gen_code)
+        return slide_gen_code
+
+    def run(self, user_request: str, on_code_chunk: Optional[Callable[[str], None]] = None) -> str:
+        """
+        AIエージェントを実行する（失敗時は簡易的なプレゼンテーションを作成するコードを返す）
+
+        Args:
+            user_request (str): ユーザーからのリクエスト
+            on_code_chunk (Callable[[str], None], optional): 生成中のPythonコードの断片を受け取る関数。
+                指定した場合はコードを生成しながら順に渡す（再試行時は新しい試行の断片が続けて渡される）
+
+        Returns:
+            str: 生成されたPythonコード
+
+        Raises:
+            ValueError: リクエストが空または空白のみの場合
+        """
+        # 空のリクエストはエラー用のコードを返さずにエラーとする
+        user_request = prepare_user_request(user_request)
+        try:
+            return self.generate(user_request, on_code_chunk)
         except Exception as e:
-            logger.error(f"グラフの実行中にエラーが発生しました: {e}")
+            logger.error("グラフの実行中にエラーが発生しました: %s", e)
             # エラーが発生した場合は、簡易的なコードテンプレートを返す
-            provider_name = "OpenAI" if self.api_provider == "OpenAI" else "Google Gemini"
-            return f"""
-# エラーが発生したため、簡易的なPPTXファイルを生成します
-from pptx import Presentation
-from pptx.util import Inches, Pt
-
-# 新しいプレゼンテーションを作成
-prs = Presentation()
-
-# タイトルスライドを追加
-title_slide_layout = prs.slide_layouts[0]
-slide = prs.slides.add_slide(title_slide_layout)
-title = slide.shapes.title
-subtitle = slide.placeholders[1]
-
-title.text = "エラーが発生しました"
-subtitle.text = "{provider_name} APIエラーまたはその他のエラーにより、プレゼンテーションを生成できませんでした。"
-
-# 情報スライドを追加
-bullet_slide_layout = prs.slide_layouts[1]
-slide = prs.slides.add_slide(bullet_slide_layout)
-title = slide.shapes.title
-body = slide.placeholders[1]
-
-title.text = "エラーの解決方法"
-tf = body.text_frame
-tf.text = "以下の方法を試してください："
-
-p = tf.add_paragraph()
-p.text = "1. {provider_name}ダッシュボードでAPIの使用状況と制限を確認する"
-p.level = 1
-
-p = tf.add_paragraph()
-p.text = "2. 有料プランにアップグレードする"
-p.level = 1
-
-p = tf.add_paragraph()
-p.text = "3. 別のAPIキーを使用する"
-p.level = 1
-
-p = tf.add_paragraph()
-p.text = "4. 別のAIプロバイダーを試す"
-p.level = 1
-
-# プレゼンテーションを保存
-prs.save('workspace/output/error_presentation.pptx')
-print("エラー用のプレゼンテーションが生成されました: workspace/output/error_presentation.pptx")
-""" 
\ No newline at end of file
+            return error_presentation_code(self.api_provider)
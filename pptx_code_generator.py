@@ -6,26 +6,306 @@ OpenAIとGoogle Gemini両方のAPIに対応しています。
 
 Classes:
     PPTXCodeGenerator: PowerPointスライド生成コードを生成するクラス
+
+Functions:
+    build_simple_pptx_code: タイトルと箇条書きのみのスライド内容から、LLMを使わずにコードを生成する
+    extract_code_block: LLMの出力から最後のPythonコードブロックを取り出す
+    assemble_slide_codes: スライドごとに生成したコードを1つのスクリプトにまとめる
+    load_code_template: エラー時に返すコードのテンプレートを読み込む
 """
 
+import ast
 import os
+import re
 import logging
-from typing import Optional
+import textwrap
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Generator, Iterator, List, Optional, Tuple
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import Runnable
+from backoff import call_with_retries, stream_with_retries
+from dirs import ensure_dir
+from llm_cache import ResponseCache, prompt_cache_key, with_prompt_cache_key
+from providers import detect_api_provider
+from rate_limiter import RateLimiter, estimate_tokens
 
 # ロガーの設定
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Gemini APIの利用可能性をチェック
-try:
-    from langchain_google_genai import ChatGoogleGenerativeAI
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-    logger.warning("langchain_google_genai をインポートできませんでした。Google Gemini機能は無効化されます。")
+# PPTXコード生成のシステムプロンプト
+PPTX_SYSTEM_PROMPT = "python-pptxモジュールを用いてプレゼンテーション資料のスライドを自動生成する専門家です。"
+
+# テンプレートのレイアウト情報
+TEMPLATE_LAYOUT_INFO = (
+    "テンプレートのレイアウト情報は以下を参照してください。記載にないレイアウト番号やプレースホルダー番号は決して使用しないでください。\n"
+    "    タイトルスライド: slide_layouts[2]\n"
+    "        placeholder_format.idx:\n"
+    "            0: 会社名など\n"
+    "            10: 発表タイトル\n"
+    "            11: サブタイトル・日付など\n"
+    "            12: 発表者名など\n"
+    "    一般スライド: slide_layouts[0]\n"
+    "        placeholder_format.idx:\n"
+    "            0: スライドタイトル\n"
+    "            1: 内容\n"
+)
+
+# 使用できる要素に関するルール
+ELEMENT_RULES = (
+    "- 【重要】必ずpython-pptxモジュールを使用したpythonコードのみを出力してください。\n"
+    "- 使用が許可されているのは、テキスト、図形、表、画像、動画です。\n"
+    "- テキスト以外の要素（図形、表、画像、動画）を使用してほしい箇所には、その旨が明記されています。\n"
+    "- 画像を挿入する場合は `workspace/input/images/` ディレクトリの画像ファイルを使用するコードを生成してください。\n"
+    "- 動画を挿入する場合も同様に `workspace/input/images/` ディレクトリのファイルを使用するコードを生成してください。\n"
+)
+
+# 画像や動画の挿入方法のコード例
+MEDIA_EXAMPLES = (
+    "### 画像や動画の挿入方法について ###\n"
+    "以下のようなコード例を参考にしてください。\n"
+    "画像の挿入例:\n"
+    "```python\n"
+    "from pptx.util import Inches\n"
+    "slide = prs.slides.add_slide(prs.slide_layouts[0])\n"
+    "title = slide.shapes.title\n"
+    "title.text = \"画像の例\"\n"
+    "# 画像を追加\n"
+    "img_path = \"workspace/input/images/example.jpg\"\n"
+    "left = Inches(1)\n"
+    "top = Inches(2.5)\n"
+    "width = Inches(5)\n"
+    "slide.shapes.add_picture(img_path, left, top, width=width)\n"
+    "```\n"
+    "動画の挿入例:\n"
+    "```python\n"
+    "from pptx.util import Inches\n"
+    "slide = prs.slides.add_slide(prs.slide_layouts[0])\n"
+    "title = slide.shapes.title\n"
+    "title.text = \"動画の例\"\n"
+    "# 動画を追加\n"
+    "movie_path = \"workspace/input/images/example.mp4\"\n"
+    "left = Inches(2)\n"
+    "top = Inches(2.5)\n"
+    "width = Inches(5)\n"
+    "height = Inches(3)\n"
+    "slide.shapes.add_movie(movie_path, left, top, width, height)\n"
+    "```\n\n"
+)
+
+# エラー時に返すコードのテンプレートを置くディレクトリ（LLMの出力と同じく ```python のコードブロックで囲み、呼び出し元で同じように取り出せるようにする）
+CODE_TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "code_templates")
+
+@lru_cache(maxsize=4)
+def load_code_template(name: str) -> str:
+    """
+    エラー時に返すコードのテンプレートを読み込む（ファイルの読み込みはプロセスごとに一度だけ）
+
+    Args:
+        name (str): code_templates ディレクトリ内のファイル名
+
+    Returns:
+        str: テンプレートの内容
+    """
+    with open(os.path.join(CODE_TEMPLATES_DIR, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+# スライドごとにコードを生成する際の最大並列数（レート制限を考慮）
+MAX_SLIDE_WORKERS = 8
+
+# LLM出力からPythonコードブロックを取り出すパターン（```python / ```Python / ``` py などの表記揺れと、閉じの```がないまま途切れた出力に対応）
+CODE_FENCE_PATTERN = re.compile(r"```[ \t]*(?:python|py)?[ \t]*\n(.*?)(?:```|\Z)", re.DOTALL | re.IGNORECASE)
+
+# テキスト以外の要素（画像・動画・図形・表）の指定
+ELEMENT_MARKER_PATTERN = re.compile(r"\[(?:画像|動画|図形|表)\s*[:：]")
+# 箇条書きの行（先頭の空白の数で階層を判定する。行頭記号は文字クラス1つで判定し、記号の追加に実行時のコストはかからない）
+BULLET_PATTERN = re.compile(r"^( *)[-*・•▪]\s+(.+)$")
+
+# タイトルと箇条書きのみのスライドを生成するコードのテンプレート
+SIMPLE_PPTX_CODE_TEMPLATE = """```python
+import datetime
+from pptx import Presentation
+
+# (タイトル, [(階層, テキスト), ...]) のリスト
+SLIDES = [
+{slides}
+]
+
+prs = Presentation("workspace/input/template.pptx")
+for title, bullets in SLIDES:
+    if not bullets:
+        # 箇条書きのないスライドはタイトルスライドとして追加
+        slide = prs.slides.add_slide(prs.slide_layouts[2])
+        placeholders = {{shape.placeholder_format.idx: shape for shape in slide.placeholders}}
+        # 発表タイトル(idx 10)がないテンプレートではタイトルのプレースホルダーを使用
+        (placeholders.get(10) or slide.shapes.title).text = title
+        continue
+    slide = prs.slides.add_slide(prs.slide_layouts[0])
+    placeholders = {{shape.placeholder_format.idx: shape for shape in slide.placeholders}}
+    placeholders[0].text = title
+    text_frame = placeholders[1].text_frame
+    for i, (level, text) in enumerate(bullets):
+        paragraph = text_frame.paragraphs[0] if i == 0 else text_frame.add_paragraph()
+        paragraph.text = text
+        paragraph.level = level
+
+output_file = f"workspace/output/presentation_{{datetime.datetime.now():%Y%m%d_%H%M%S}}.pptx"
+prs.save(output_file)
+print(f"プレゼンテーションを {{output_file}} に保存しました。")
+```"""
+
+def build_simple_pptx_code(slide_contents: str) -> Optional[str]:
+    """
+    タイトルと箇条書きのみのスライド内容から、LLMを使わずにコードを生成する
+    各スライドが「# タイトル」と「- 箇条書き」だけで構成されている場合のみ対象とする
+
+    Args:
+        slide_contents (str): 生成されたスライド内容
+
+    Returns:
+        Optional[str]: PowerPointスライド生成のためのPythonコード（単純な構成でない場合はNone）
+    """
+    if ELEMENT_MARKER_PATTERN.search(slide_contents):
+        return None
+    slides = []
+    for section in slide_contents.split("---next---"):
+        lines = [line.rstrip() for line in section.splitlines() if line.strip()]
+        if not lines:
+            continue
+        heading = lines[0].strip()
+        if not heading.startswith("#"):
+            return None
+        bullets = []
+        for line in lines[1:]:
+            match = BULLET_PATTERN.match(line)
+            if not match:
+                return None
+            bullets.append((min(len(match.group(1)) // 2, 4), match.group(2).strip()))
+        slides.append(f"    ({heading.lstrip('#').strip()!r}, {bullets!r}),")
+    if not slides:
+        return None
+    return SIMPLE_PPTX_CODE_TEMPLATE.format(slides="\n".join(slides))
+
+def extract_code_block(text: str) -> Optional[str]:
+    """
+    LLMの出力から最後のPythonコードブロックを取り出す
+    説明用のコード片の後に完成版のコードが続く出力では完成版を、閉じの```がない場合は末尾までを返す
+
+    Args:
+        text (str): LLMの出力
+
+    Returns:
+        Optional[str]: コードブロックの中身（コードブロックがない場合はNone）
+    """
+    blocks = CODE_FENCE_PATTERN.findall(text)
+    return blocks[-1] if blocks else None
+
+def _is_presentation_statement(node: ast.stmt) -> bool:
+    """
+    スライドごとのコードから取り除く、プレゼンテーションの作成（prs = Presentation(...)）または保存（prs.save(...)）の文かどうかを判定する
+
+    Args:
+        node (ast.stmt): スライドごとのコードの最上位の文
+
+    Returns:
+        bool: プレゼンテーションの作成・保存の文であればTrue
+    """
+    if isinstance(node, (ast.Assign, ast.AnnAssign)) and isinstance(node.value, ast.Call):
+        func = node.value.func
+        return (func.id if isinstance(func, ast.Name) else getattr(func, "attr", None)) == "Presentation"
+    if isinstance(node, ast.Expr) and isinstance(node.value, ast.Call):
+        return getattr(node.value.func, "attr", None) == "save"
+    return False
+
+def assemble_slide_codes(fragments: List[str]) -> str:
+    """
+    スライドごとに生成したコードを1つのスクリプトにまとめる
+    import文は先頭にまとめ、各スライドのコードは変数名が衝突しないよう関数として定義する
+    import文とプレゼンテーションの作成・保存の文は構文木で判定するため、複数行にわたる文もまとめて扱う
+
+    Args:
+        fragments (List[str]): スライドごとに生成したコード（LLMの出力そのまま）
+
+    Returns:
+        str: PowerPointスライド生成のためのPythonコード
+    """
+    imports = ["import datetime", "from pptx import Presentation"]
+    functions = []
+    for index, fragment in enumerate(fragments, 1):
+        code = extract_code_block(fragment)
+        source = textwrap.dedent(fragment if code is None else code)
+        try:
+            statements = ast.parse(source).body
+        except SyntaxError:
+            # 構文エラーのあるコードはそのまま関数にし、実行時のエラーとして報告させる
+            statements = []
+        removed_lines = set()
+        for node in statements:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                statement = ast.unparse(node)
+                if statement not in imports:
+                    imports.append(statement)
+            elif not _is_presentation_statement(node):
+                continue
+            removed_lines.update(range(node.lineno - 1, node.end_lineno))
+        body = [line for number, line in enumerate(source.splitlines()) if number not in removed_lines]
+        code = textwrap.indent("\n".join(body).strip("\n"), "    ") or "    pass"
+        functions.append(f"# スライド{index}\ndef add_slide_{index}(prs):\n{code}\n")
+    calls = "\n".join(f"add_slide_{index}(prs)" for index in range(1, len(fragments) + 1))
+    return (
+        "```python\n"
+        + "\n".join(imports) + "\n\n"
+        + "\n".join(functions) + "\n"
+        + "prs = Presentation(\"workspace/input/template.pptx\")\n"
+        + calls + "\n\n"
+        + "output_file = f\"workspace/output/presentation_{datetime.datetime.now():%Y%m%d_%H%M%S}.pptx\"\n"
+        + "prs.save(output_file)\n"
+        + "print(f\"プレゼンテーションを {output_file} に保存しました。\")\n"
+        + "```"
+    )
+
+# 一括生成とスライドごとの生成で共通のシステムメッセージ
+# 固定のルールとコード例をすべてここにまとめ、呼び出しをまたいで同一のプレフィックスとしてプロンプトキャッシュに載せる
+PPTX_SYSTEM_MESSAGE = (
+    PPTX_SYSTEM_PROMPT + "\n\n"
+    + TEMPLATE_LAYOUT_INFO
+    + "\nルール:\n"
+    + ELEMENT_RULES + "\n"
+    + MEDIA_EXAMPLES
+)
+
+# PPTXコード生成のプロンプト（入力に依存しないため、モジュールの読み込み時に一度だけ作成する）
+PPTX_CODE_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", PPTX_SYSTEM_MESSAGE),
+        (
+            "human",
+            "末尾のスライドの内容を生成するためのpythonコードを生成してください。\n"
+            "workspace/input/template.pptx を読み込んでテンプレートとして使用し、"
+            "作成したパワーポイントはworkspace/output内に出力されるようにしてください。\n"
+            "'---next---' はスライド番号を進める合図です。このタイミングで新たなスライドを追加してください。\n\n"
+            "スライドの内容:\n{slide_contents}"
+        )
+    ]
+)
+
+# スライド1枚分のPPTXコード生成のプロンプト
+PPTX_SLIDE_CODE_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        ("system", PPTX_SYSTEM_MESSAGE),
+        (
+            "human",
+            "末尾のスライド1枚分をプレゼンテーションに追加するpythonコードを生成してください。\n"
+            "テンプレート(workspace/input/template.pptx)は変数 prs に読み込み済みです。"
+            "Presentationの作成とファイルの保存(prs.save)は記述しないでください。\n"
+            "スライド番号が1の場合は、タイトルスライドのレイアウトを使用してください。\n\n"
+            "スライド番号: {index}/{total}\n"
+            "スライドの内容:\n{slide}"
+        )
+    ]
+)
 
 class PPTXCodeGenerator:
     """
@@ -34,197 +314,255 @@ class PPTXCodeGenerator:
     Attributes:
         llm (BaseChatModel): 対話型言語モデルのインスタンス
         max_retries (int): APIコール失敗時の最大再試行回数
+        base_delay (float): 再試行までの基本待機秒数
+        used_fallback (bool): 直前の実行でフォールバックの内容を返したかどうか
+        cache (ResponseCache): LLM呼び出し結果のキャッシュ（未指定時はNone）
+        rate_limiter (RateLimiter): 呼び出し前に流量を制限するレートリミッター（未指定時はNone）
     """
-    def __init__(self, llm: BaseChatModel, max_retries: int = 2):
+    def __init__(self, llm: BaseChatModel, max_retries: int = 2, cache: Optional[ResponseCache] = None,
+                 base_delay: float = 1.0, rate_limiter: Optional[RateLimiter] = None):
         """
         PPTXCodeGeneratorクラスの初期化
 
         Args:
             llm (BaseChatModel): 対話型言語モデルのインスタンス
             max_retries (int, optional): 最大再試行回数。デフォルトは2
+            cache (ResponseCache, optional): LLM呼び出し結果のキャッシュ。指定がなければ無効
+            base_delay (float, optional): 再試行までの基本待機秒数。デフォルトは1.0
+            rate_limiter (RateLimiter, optional): 呼び出し前に流量を制限するレートリミッター。指定がなければ制限しない
         """
         self.llm = llm
         self.max_retries = max_retries
-        # APIプロバイダーの検出（クラス名でチェック）
-        self.api_provider = self._detect_api_provider(llm)
-        logger.info(f"PPTXCodeGenerator initialized with {self.api_provider} API")
+        self.base_delay = base_delay
+        self.used_fallback = False
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        # APIプロバイダーの検出（クラスでチェック）
+        self.api_provider = detect_api_provider(llm)
+        logger.info("PPTXCodeGenerator initialized with %s API", self.api_provider)
         
         # 画像アップロードディレクトリの確保
-        os.makedirs("workspace/input/images", exist_ok=True)
+        ensure_dir("workspace/input/images")
         
-    def _detect_api_provider(self, llm: BaseChatModel) -> str:
+    @property
+    def llm(self) -> BaseChatModel:
         """
-        使用されているAPIプロバイダーを検出する
-        
+        対話型言語モデルのインスタンス
+        """
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm: BaseChatModel) -> None:
+        """
+        対話型言語モデルを設定し、チェーンを作り直す
+
         Args:
             llm (BaseChatModel): 対話型言語モデルのインスタンス
-            
+        """
+        self._llm = llm
+        self._chains = self._build_chains(llm)
+        
+    @staticmethod
+    def _build_chains(llm: BaseChatModel) -> Tuple[Runnable, Runnable]:
+        """
+        一括生成とスライドごとの生成のチェーンを作成する
+
+        Args:
+            llm (BaseChatModel): 呼び出しに使用するLLM
+
+        Returns:
+            Tuple[Runnable, Runnable]: 一括生成のチェーンと、スライド1枚分のチェーン
+        """
+        return (PPTX_CODE_PROMPT | with_prompt_cache_key(llm, "pptx_code_generator") | StrOutputParser(),
+                PPTX_SLIDE_CODE_PROMPT | with_prompt_cache_key(llm, "pptx_slide_code_generator") | StrOutputParser())
+    
+    def _resolve(self, llm: Optional[BaseChatModel]) -> Tuple[BaseChatModel, Tuple[Runnable, Runnable]]:
+        """
+        呼び出しに使用するLLMとチェーンを決める
+        フォールバック用のLLMは生成器のLLMを差し替えずに呼び出しごとに渡すため、並行する呼び出しに影響しない
+
+        Args:
+            llm (BaseChatModel): 呼び出しに使用するLLM（Noneの場合は生成器のLLM）
+
+        Returns:
+            Tuple[BaseChatModel, Tuple[Runnable, Runnable]]: 呼び出しに使用するLLMと、一括生成・スライド1枚分のチェーン
+        """
+        if llm is None or llm is self._llm:
+            return self._llm, self._chains
+        return llm, self._build_chains(llm)
+    
+    def _acquire(self, prompt: ChatPromptTemplate, inputs: dict) -> None:
+        """
+        レートリミッターが指定されていれば、プロンプトの概算トークン数を予約してから呼び出せるまで待機する
+
+        Args:
+            prompt (ChatPromptTemplate): 呼び出しに使用するプロンプト
+            inputs (dict): プロンプトへの入力
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(estimate_tokens(*(message.content for message in prompt.format_messages(**inputs))))
+    
+    def _generate_slide_code(self, llm: BaseChatModel, slide_chain: Runnable, slide: str, index: int, total: int) -> str:
+        """
+        スライド1枚分のコードを生成する
+
+        Args:
+            llm (BaseChatModel): 呼び出しに使用するLLM
+            slide_chain (Runnable): スライド1枚分のチェーン
+            slide (str): スライドの内容
+            index (int): スライド番号（1始まり）
+            total (int): スライドの総数
+
+        Returns:
+            str: スライド1枚分のコード（LLMの出力そのまま）
+        """
+        inputs = {"slide": slide, "index": index, "total": total}
+        cache_key = prompt_cache_key(llm, "pptx_slide_code_generator", PPTX_SLIDE_CODE_PROMPT, inputs) if self.cache is not None else None
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        # 並列の呼び出しも1回ずつレートリミッターを通し、プロバイダーの制限を超えないようにする
+        self._acquire(PPTX_SLIDE_CODE_PROMPT, inputs)
+        result = slide_chain.invoke(inputs)
+        if cache_key is not None:
+            self.cache.set(cache_key, result)
+        return result
+    
+    def _run_per_slide(self, llm: BaseChatModel, slide_chain: Runnable, slides: List[str]) -> Optional[str]:
+        """
+        スライドごとにコードを並列で生成し、1つのスクリプトにまとめる
+        生成時間は出力トークン数に比例するため、全体を1回で生成するよりも短時間で完了する
+
+        Args:
+            llm (BaseChatModel): 呼び出しに使用するLLM
+            slide_chain (Runnable): スライド1枚分のチェーン
+            slides (List[str]): スライドごとの内容
+
+        Returns:
+            Optional[str]: PowerPointスライド生成のためのPythonコード（いずれかのスライドで失敗した場合はNone）
+        """
+        total = len(slides)
+        try:
+            with ThreadPoolExecutor(max_workers=min(MAX_SLIDE_WORKERS, total)) as executor:
+                fragments = list(executor.map(
+                    lambda args: self._generate_slide_code(llm, slide_chain, args[1], args[0], total),
+                    enumerate(slides, 1)
+                ))
+        except Exception as e:
+            # 一括生成（リトライ・フォールバックあり）に切り替える
+            logger.warning("スライドごとのPPTXコード生成に失敗したため、一括で生成します: %s", e)
+            return None
+        logger.info("%s APIで%s枚のスライドのPPTXコードを並列に生成しました", self.api_provider, total)
+        return assemble_slide_codes(fragments)
+    
+    def _prepare(self, llm: BaseChatModel, slide_chain: Runnable, slide_contents: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        一括生成のLLM呼び出しを行わずに用意できるコードを取得する
+        （単純な構成のスライド内容、キャッシュ、スライドごとの並列生成の順に試す）
+
+        Args:
+            llm (BaseChatModel): 呼び出しに使用するLLM
+            slide_chain (Runnable): スライド1枚分のチェーン
+            slide_contents (str): 生成されたスライド内容
+
+        Returns:
+            Tuple[Optional[str], Optional[str]]: 用意できたコード（ない場合はNone）と、一括生成の結果を保存するキャッシュキー
+        """
+        self.used_fallback = False
+        
+        # タイトルと箇条書きのみの単純な構成であればLLMを呼び出さない
+        simple_code = build_simple_pptx_code(slide_contents)
+        if simple_code is not None:
+            logger.info("単純な構成のスライド内容のため、LLMを使用せずにPPTXコードを生成しました")
+            return simple_code, None
+        
+        # 同じプロンプト・同じモデルでの呼び出し結果があれば、スライドごとの生成より先に再利用する
+        cache_key = prompt_cache_key(llm, "pptx_code_generator", PPTX_CODE_PROMPT, {"slide_contents": slide_contents}) if self.cache is not None else None
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("キャッシュされたPPTXコードを使用します")
+                return cached, cache_key
+        
+        # 複数のスライドがある場合はスライドごとに並列で生成し、次回は1回の読み込みで済むよう同じキーで保存する
+        slides = [section.strip() for section in slide_contents.split("---next---") if section.strip()]
+        if len(slides) > 1:
+            code = self._run_per_slide(llm, slide_chain, slides)
+            if code is not None:
+                return self._store(cache_key, code), None
+        return None, cache_key
+    
+    def _store(self, cache_key: Optional[str], result: str) -> str:
+        """
+        生成したコードをキャッシュに保存する（フォールバックのコードは保存しない）
+
+        Args:
+            cache_key (str): キャッシュキー（キャッシュしない場合はNone）
+            result (str): 生成されたコード
+
         Returns:
-            str: 検出されたAPIプロバイダー名 ("OpenAI" または "Google Gemini")
+            str: 生成されたコード
+        """
+        if not self.used_fallback:
+            logger.info("%s APIでPPTXコード生成に成功しました", self.api_provider)
+            if cache_key is not None:
+                self.cache.set(cache_key, result)
+        return result
+    
+    def run_stream(self, slide_contents: str, llm: Optional[BaseChatModel] = None) -> Generator[str, None, str]:
         """
-        llm_class_str = str(llm.__class__).lower()
+        スライド内容からPowerPointスライド生成コードを生成し、生成された順に少しずつ返す
+        LLMを使わずに用意できるコードは一度に返す。再試行・フォールバックは run と同じく行い、
+        再試行した場合は新しい試行の断片が続けて返されるため、コード全体は戻り値から取得する
+
+        Args:
+            slide_contents (str): 生成されたスライド内容
+            llm (BaseChatModel, optional): この呼び出しに使用するLLM（フォールバック時など）。指定がなければ生成器のLLM
+
+        Yields:
+            str: PowerPointスライド生成のためのPythonコードの断片
+
+        Returns:
+            str: PowerPointスライド生成のためのPythonコード全体（再試行した場合は最後の試行の内容）
+        """
+        llm, (chain, slide_chain) = self._resolve(llm)
+        code, cache_key = self._prepare(llm, slide_chain, slide_contents)
+        if code is not None:
+            yield code
+            return code
         
-        if "openai" in llm_class_str:
-            return "OpenAI"
-        elif "google" in llm_class_str or "gemini" in llm_class_str:
-            return "Google Gemini"
-        else:
-            logger.warning(f"不明なLLMタイプです: {llm.__class__.__name__}")
-            return "Unknown"
+        def stream() -> Iterator[str]:
+            self._acquire(PPTX_CODE_PROMPT, {"slide_contents": slide_contents})
+            return chain.stream({"slide_contents": slide_contents})
         
-    def run(self, slide_contents: str) -> str:
+        # 再試行しても生成できない場合はフォールバックコードを返す
+        result, self.used_fallback = yield from stream_with_retries(
+            stream, self.max_retries, self.base_delay,
+            lambda: load_code_template("error_presentation_with_template.py.tpl"), "PPTXコード生成")
+        return self._store(cache_key, result)
+    
+    def run(self, slide_contents: str, llm: Optional[BaseChatModel] = None) -> str:
         """
         スライド内容からPowerPointスライド生成コードを生成する
 
         Args:
             slide_contents (str): 生成されたスライド内容
+            llm (BaseChatModel, optional): この呼び出しに使用するLLM（フォールバック時など）。指定がなければ生成器のLLM
 
         Returns:
             str: PowerPointスライド生成のためのPythonコード
         """
-        # プロンプトを定義
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                (
-                    "system",
-                    "python-pptxモジュールを用いてプレゼンテーション資料のスライドを自動生成する専門家です。"
-                ),
-                (
-                    "human",
-                    "以下のスライドの内容を生成するためのpythonコードを生成してください。\n\n"
-                    "スライドの内容:\n{slide_contents}\n\n"
-                    "以下のpptxファイルを読み込み、テンプレートとして使用してください。\n"
-                    "workspace/input/template.pptx\n"
-                    "テンプレートのレイアウト情報は以下を参照してください。記載にないレイアウト番号やプレースホルダー番号は決して使用しないでください。\n"
-                    "    タイトルスライド: slide_layouts[2]\n"
-                    "        placeholder_format.idx:\n"
-                    "            0: 会社名など\n"
-                    "            10: 発表タイトル\n"
-                    "            11: サブタイトル・日付など\n"
-                    "            12: 発表者名など\n"
-                    "    一般スライド: slide_layouts[0]\n"
-                    "        placeholder_format.idx:\n"
-                    "            0: スライドタイトル\n"
-                    "            1: 内容\n"
-                    "作成したパワーポイントはworkspace/output内に出力されるようにしてください。\n\n"
-                    "ルール:\n"
-                    "- 【重要】必ずpython-pptxモジュールを使用したpythonコードのみを出力してください。\n"
-                    "- 使用が許可されているのは、テキスト、図形、表、画像、動画です。\n"
-                    "- テキスト以外の要素（図形、表、画像、動画）を使用してほしい箇所には、その旨が明記されています。\n"
-                    "- 画像を挿入する場合は `workspace/input/images/` ディレクトリの画像ファイルを使用するコードを生成してください。\n"
-                    "- 動画を挿入する場合も同様に `workspace/input/images/` ディレクトリのファイルを使用するコードを生成してください。\n"
-                    "- '---next---' はスライド番号を進める合図です。このタイミングで新たなスライドを追加してください。\n\n"
-                    "### 画像や動画の挿入方法について ###\n"
-                    "以下のようなコード例を参考にしてください。\n"
-                    "画像の挿入例:\n"
-                    "```python\n"
-                    "from pptx.util import Inches\n"
-                    "slide = prs.slides.add_slide(prs.slide_layouts[0])\n"
-                    "title = slide.shapes.title\n"
-                    "title.text = \"画像の例\"\n"
-                    "# 画像を追加\n"
-                    "img_path = \"workspace/input/images/example.jpg\"\n"
-                    "left = Inches(1)\n"
-                    "top = Inches(2.5)\n"
-                    "width = Inches(5)\n"
-                    "slide.shapes.add_picture(img_path, left, top, width=width)\n"
-                    "```\n"
-                    "動画の挿入例:\n"
-                    "```python\n"
-                    "from pptx.util import Inches\n"
-                    "slide = prs.slides.add_slide(prs.slide_layouts[0])\n"
-                    "title = slide.shapes.title\n"
-                    "title.text = \"動画の例\"\n"
-                    "# 動画を追加\n"
-                    "movie_path = \"workspace/input/images/example.mp4\"\n"
-                    "left = Inches(2)\n"
-                    "top = Inches(2.5)\n"
-                    "width = Inches(5)\n"
-                    "height = Inches(3)\n"
-                    "slide.shapes.add_movie(movie_path, left, top, width, height)\n"
-                    "```\n"
-                )
-            ]
-        )
+        llm, (chain, slide_chain) = self._resolve(llm)
+        code, cache_key = self._prepare(llm, slide_chain, slide_contents)
+        if code is not None:
+            return code
         
-        # エラーハンドリングを追加
-        last_error = None
-        for attempt in range(self.max_retries + 1):
-            try:
-                # スライド生成のためのチェーンを作成
-                chain = prompt | self.llm | StrOutputParser()
-                # スライド生成のコードを生成
-                result = chain.invoke({"slide_contents": slide_contents})
-                logger.info(f"{self.api_provider} APIでPPTXコード生成に成功しました")
-                return result
-            except Exception as e:
-                last_error = e
-                error_msg = str(e).lower()
-                
-                # APIクォータ超過エラーまたはレート制限エラーの場合
-                quota_errors = ["insufficient_quota", "quota exceeded", "rate_limit"]
-                if any(err in error_msg for err in quota_errors):
-                    logger.error(f"{self.api_provider} API制限エラー: {e}")
-                    # クォータ超過は再試行しても解決しないので、すぐに例外を発生させる
-                    raise e
-                
-                # レート制限エラーの場合は少し待機してから再試行
-                if "rate" in error_msg and "limit" in error_msg:
-                    logger.warning(f"レート制限エラーが発生しました（試行 {attempt+1}/{self.max_retries+1}）: {e}")
-                    import time
-                    time.sleep(2 ** attempt)  # 指数バックオフ
-                    continue
-                
-                # その他のエラーの場合
-                logger.warning(f"PPTXコード生成中にエラーが発生しました（試行 {attempt+1}/{self.max_retries+1}）: {e}")
-                
-                # 最後の試行の場合はフォールバックコードを返す
-                if attempt == self.max_retries:
-                    logger.error("最大試行回数に達しました。フォールバックコードを返します。")
-                    return """
-# APIエラーが発生したため、基本的なPPTXファイルを生成するコードを返します
-from pptx import Presentation
-from pptx.util import Inches, Pt
-from pptx.enum.text import PP_ALIGN
-
-# テンプレートから新しいプレゼンテーションを作成
-prs = Presentation('workspace/input/template.pptx')
-
-# タイトルスライドを追加
-slide_layout = prs.slide_layouts[2]
-slide = prs.slides.add_slide(slide_layout)
-
-# プレースホルダーへテキストを設定
-title_placeholder = slide.placeholders[10]
-subtitle_placeholder = slide.placeholders[11]
-presenter_placeholder = slide.placeholders[12]
-title_placeholder.text = "APIエラーが発生しました"
-subtitle_placeholder.text = "エラーのため簡易的なプレゼンテーションを生成しました"
-presenter_placeholder.text = "AI プレゼンテーション生成"
-
-# 内容スライドを追加
-slide_layout = prs.slide_layouts[0]
-slide = prs.slides.add_slide(slide_layout)
-title = slide.shapes.title
-body = slide.placeholders[1]
-title.text = "プレゼンテーション内容"
-tf = body.text_frame
-tf.text = "APIエラーが発生したため、本来の内容を生成できませんでした。"
-
-p = tf.add_paragraph()
-p.text = "1. 問題が解決するまでこの簡易版プレゼンテーションをご利用ください。"
-p.level = 1
-
-p = tf.add_paragraph()
-p.text = "2. APIの利用制限を確認してください。"
-p.level = 1
-
-# 保存
-output_file = 'workspace/output/error_presentation.pptx'
-prs.save(output_file)
-print(f"プレゼンテーションを {output_file} に保存しました。")
-"""
+        def invoke() -> str:
+            self._acquire(PPTX_CODE_PROMPT, {"slide_contents": slide_contents})
+            return chain.invoke({"slide_contents": slide_contents})
         
-        # すべての試行が失敗した場合
-        if last_error:
-            raise last_error 
\ No newline at end of file
+        # 再試行しても生成できない場合はフォールバックコードを返す
+        result, self.used_fallback = call_with_retries(invoke, self.max_retries, self.base_delay,
+                                                       lambda: load_code_template("error_presentation_with_template.py.tpl"), "PPTXコード生成")
+        return self._store(cache_key, result)
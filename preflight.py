@@ -0,0 +1,71 @@
+"""
+このモジュールはLLMを呼び出す前にユーザーリクエストを検証する機能を提供します。
+空のリクエストはLLMを呼び出さずにエラーとし、極端に長いリクエストはプロンプトの大きさを抑えるために切り詰めます。
+リクエストの元になる入力ファイル（.txt, .md, .docx）の読み込みも提供します。
+
+Functions:
+    read_request_text: 入力ファイルの内容を文字列として取得する
+    prepare_user_request: ユーザーリクエストを検証し、LLMに渡せる形に整える
+"""
+
+import io
+import logging
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import BinaryIO
+
+# ロガーの設定
+logger = logging.getLogger(__name__)
+
+# LLMに渡すユーザーリクエストの最大文字数（これを超える部分は切り捨てる）
+MAX_REQUEST_CHARS = 20000
+
+# .docx の本文XMLの名前空間
+DOCX_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+def read_request_text(file: BinaryIO, filename: str) -> str:
+    """
+    入力ファイルの内容を文字列として取得する
+    .docx はZIP形式のため、本文のXMLから段落ごとのテキストを取り出す
+
+    Args:
+        file (BinaryIO): バイナリモードで開いた入力ファイル（アップロードされたファイルも可）
+        filename (str): 入力ファイルの名前（拡張子で形式を判定する。.txt, .md, .docx）
+
+    Returns:
+        str: ファイルの内容
+    """
+    file.seek(0)
+    if filename.lower().endswith(".docx"):
+        with zipfile.ZipFile(file) as zf:
+            root = ET.fromstring(zf.read("word/document.xml"))
+        return "\n".join(
+            "".join(node.text or "" for node in paragraph.iter(f"{DOCX_NAMESPACE}t"))
+            for paragraph in root.iter(f"{DOCX_NAMESPACE}p")
+        )
+
+    # bytes全体を経由せずにテキストとして読み込む（読み込み後はラッパーを切り離し、元のファイルを閉じない）
+    text_stream = io.TextIOWrapper(file, encoding="utf-8", errors="replace")
+    content = text_stream.read()
+    text_stream.detach()
+    return content
+
+def prepare_user_request(user_request: str) -> str:
+    """
+    ユーザーリクエストを検証し、LLMに渡せる形に整える
+
+    Args:
+        user_request (str): ユーザーからのリクエスト
+
+    Returns:
+        str: 最大文字数までに切り詰めたユーザーリクエスト
+
+    Raises:
+        ValueError: リクエストが空または空白のみの場合
+    """
+    if not user_request or not user_request.strip():
+        raise ValueError("ユーザーリクエストが空です")
+    if len(user_request) > MAX_REQUEST_CHARS:
+        logger.warning("ユーザーリクエストが長すぎるため、先頭の%s文字のみを使用します（%s文字）", MAX_REQUEST_CHARS, len(user_request))
+        return user_request[:MAX_REQUEST_CHARS]
+    return user_request
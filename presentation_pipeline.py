@@ -0,0 +1,123 @@
+"""
+このモジュールはストーリーの生成・評価とスライド内容の生成を1回のLLM呼び出しで行う機能を提供します。
+3つの生成器を順に呼び出す場合に比べて、往復の通信と入力の再処理を2回分省略できます。
+自己評価で不十分と判断された場合は、個別の生成器による改善の流れに引き継ぎます。
+OpenAIとGoogle Gemini両方のAPIに対応しています。
+
+Classes:
+    PresentationPipeline: ストーリー・評価結果・スライド内容を一括で生成するクラス
+"""
+
+import logging
+from typing import Optional
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.language_models.chat_models import BaseChatModel
+
+from datamodel import PresentationPlan
+from llm_cache import ResponseCache, prompt_cache_key
+from preflight import prepare_user_request
+from providers import detect_api_provider
+from rate_limiter import RateLimiter, estimate_tokens
+from slide_contents_generator import SLIDE_CONTENTS_RULES
+
+# ロガーの設定
+logger = logging.getLogger(__name__)
+
+# ストーリー・評価・スライド内容を一括で生成するプロンプト（入力に依存しないため、モジュールの読み込み時に一度だけ作成する）
+PRESENTATION_PLAN_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "あなたはプレゼンテーションのストーリーを作成し、その十分性を評価したうえで、スライドの構成を作成する専門家です。"
+        ),
+        (
+            "human",
+            "末尾のユーザーリクエストについて、以下の3つを順に作成してください。\n"
+            "1. story: ユーザーの意図を理解し、その意図がオーディエンスにしっかりと伝わることを重視したプレゼンテーションのストーリー\n"
+            "2. judgement: そのストーリーに、良いプレゼンテーション資料を作成するために十分で適切な情報が記載されているかどうかの判定と理由\n"
+            "3. slides: そのストーリーに基づくスライドの内容\n\n"
+            "スライドの内容の"
+            + SLIDE_CONTENTS_RULES +
+            # 可変の入力は末尾に置き、固定部分をプロンプトキャッシュの共通プレフィックスにする
+            "ユーザーリクエスト:\n{user_request}"
+        )
+    ]
+)
+
+class PresentationPipeline:
+    """
+    ストーリー・評価結果・スライド内容を1回のLLM呼び出しで生成するクラス
+
+    Attributes:
+        llm (BaseChatModel): 構造化出力をサポートする対話型言語モデルのインスタンス
+        cache (ResponseCache): LLM呼び出し結果のキャッシュ（未指定時はNone）
+        rate_limiter (RateLimiter): 呼び出し前に流量を制限するレートリミッター（未指定時はNone）
+    """
+    def __init__(self, llm: BaseChatModel, cache: Optional[ResponseCache] = None,
+                 rate_limiter: Optional[RateLimiter] = None):
+        """
+        PresentationPipelineクラスの初期化
+
+        Args:
+            llm (BaseChatModel): 対話型言語モデルのインスタンス
+            cache (ResponseCache, optional): LLM呼び出し結果のキャッシュ。指定がなければ無効
+            rate_limiter (RateLimiter, optional): 呼び出し前に流量を制限するレートリミッター。指定がなければ制限しない
+        """
+        self.llm = llm
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        # APIプロバイダーの検出（クラスでチェック）
+        self.api_provider = detect_api_provider(llm)
+        logger.info("PresentationPipeline initialized with %s API", self.api_provider)
+
+    @property
+    def llm(self) -> BaseChatModel:
+        """
+        対話型言語モデルのインスタンス
+        """
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm: BaseChatModel) -> None:
+        """
+        対話型言語モデルを設定し、チェーンを作り直す
+
+        Args:
+            llm (BaseChatModel): 対話型言語モデルのインスタンス
+        """
+        self._llm = llm
+        self._chain = PRESENTATION_PLAN_PROMPT | llm.with_structured_output(PresentationPlan)
+
+    def run(self, user_request: str, llm: Optional[BaseChatModel] = None) -> PresentationPlan:
+        """
+        ユーザーリクエストからストーリー・評価結果・スライド内容を一括で生成する
+        （エラーはそのまま送出し、呼び出し側の再試行・フォールバックに任せる）
+
+        Args:
+            user_request (str): ユーザーからのリクエスト
+            llm (BaseChatModel, optional): この呼び出しに使用するLLM（フォールバック時など）。指定がなければ生成器のLLM
+
+        Returns:
+            PresentationPlan: 生成されたストーリー・評価結果・スライド内容
+        """
+        user_request = prepare_user_request(user_request)
+        inputs = {"user_request": user_request}
+        # フォールバック用のLLMは生成器のLLMを差し替えずに、この呼び出しのチェーンだけで使用する
+        chain = self._chain
+        if llm is None:
+            llm = self._llm
+        elif llm is not self._llm:
+            chain = PRESENTATION_PLAN_PROMPT | llm.with_structured_output(PresentationPlan)
+        cache_key = prompt_cache_key(llm, "presentation_pipeline", PRESENTATION_PLAN_PROMPT, inputs) if self.cache is not None else None
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info("キャッシュされたストーリーとスライド内容を使用します")
+                return PresentationPlan.model_validate_json(cached)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(estimate_tokens(*(message.content for message in PRESENTATION_PLAN_PROMPT.format_messages(**inputs))))
+        plan = chain.invoke(inputs)
+        logger.info("%s APIでストーリーとスライド内容の一括生成に成功しました", self.api_provider)
+        if cache_key is not None:
+            self.cache.set(cache_key, plan.model_dump_json())
+        return plan
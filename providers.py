@@ -0,0 +1,42 @@
+"""
+このモジュールはLLMのインスタンスから使用しているAPIプロバイダーを判定する機能を提供します。
+クラス名の文字列ではなくクラスそのもので判定するため、サブクラスやラッパーも正しく判定できます。
+
+Functions:
+    detect_api_provider: LLMのインスタンスからAPIプロバイダー名を判定する
+"""
+
+import logging
+from typing import Dict
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_openai import ChatOpenAI
+
+# ロガーの設定
+logger = logging.getLogger(__name__)
+
+# LLMのクラスとAPIプロバイダー名の対応表（インストールされていないプロバイダーは含めない）
+PROVIDER_BY_CLASS: Dict[type, str] = {ChatOpenAI: "OpenAI"}
+
+try:
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    PROVIDER_BY_CLASS[ChatGoogleGenerativeAI] = "Google Gemini"
+except ImportError:
+    logger.warning("langchain_google_genai をインポートできませんでした。Google Gemini機能は無効化されます。")
+
+def detect_api_provider(llm: BaseChatModel) -> str:
+    """
+    LLMのインスタンスからAPIプロバイダー名を判定する
+
+    Args:
+        llm (BaseChatModel): 対話型言語モデルのインスタンス
+
+    Returns:
+        str: 検出されたAPIプロバイダー名 ("OpenAI"、"Google Gemini" または "Unknown")
+    """
+    for cls in type(llm).__mro__:
+        provider = PROVIDER_BY_CLASS.get(cls)
+        if provider is not None:
+            return provider
+    logger.warning("不明なLLMタイプです: %s", type(llm).__name__)
+    return "Unknown"
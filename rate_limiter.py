@@ -0,0 +1,152 @@
+"""
+このモジュールはLLM APIの呼び出し頻度を事前に制限する機能を提供します。
+レート制限エラー（429）を受けてから待機するのではなく、呼び出し前にトークンバケットで流量を抑えます。
+同じインスタンスを複数の生成器で共有することで、プロセス全体の呼び出し数とトークン数を制限できます。
+
+Classes:
+    TokenBucket: 一定の速度で補充されるトークンバケット
+    RateLimiter: 1分あたりのリクエスト数とトークン数でAPI呼び出しを制限するクラス
+
+Functions:
+    estimate_tokens: テキストのトークン数を概算する
+"""
+
+import asyncio
+import threading
+import time
+from typing import Optional
+
+def estimate_tokens(*texts: str) -> int:
+    """
+    テキストのトークン数を概算する
+    日本語は概ね1文字1トークン、英語は4文字1トークン程度のため、その中間として2文字を1トークンと見積もる
+
+    Args:
+        *texts: トークン数を見積もるテキスト
+
+    Returns:
+        int: 概算のトークン数
+    """
+    return sum(len(text) for text in texts) // 2 + 1
+
+class TokenBucket:
+    """
+    一定の速度で補充されるトークンバケット
+    取得量が残量を超える場合は残量を負にして予約し、補充されるまでの時間だけ待機する
+
+    Attributes:
+        rate_per_sec (float): 1秒あたりに補充されるトークン数
+        burst (float): バケットに貯められるトークンの上限
+    """
+    def __init__(self, rate_per_sec: float, burst: float):
+        """
+        TokenBucketクラスの初期化
+
+        Args:
+            rate_per_sec (float): 1秒あたりに補充されるトークン数
+            burst (float): バケットに貯められるトークンの上限
+        """
+        self.rate_per_sec = rate_per_sec
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        # 複数スレッドの生成器から共有されるため、残量の更新はロックで保護する
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """
+        トークンを予約し、使用できるようになるまでの待機秒数を返す
+
+        Args:
+            amount (float, optional): 取得するトークン数。デフォルトは1.0
+
+        Returns:
+            float: 待機秒数（すぐに使用できる場合は0）
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_per_sec)
+            self._updated = now
+            self._tokens -= amount
+            return max(0.0, -self._tokens / self.rate_per_sec)
+
+    def acquire(self, amount: float = 1.0) -> None:
+        """
+        トークンを取得する（足りない場合は補充されるまで待機する）
+
+        Args:
+            amount (float, optional): 取得するトークン数。デフォルトは1.0
+        """
+        delay = self.reserve(amount)
+        if delay:
+            time.sleep(delay)
+
+    async def aacquire(self, amount: float = 1.0) -> None:
+        """
+        トークンを非同期に取得する（acquire の非同期版）
+
+        Args:
+            amount (float, optional): 取得するトークン数。デフォルトは1.0
+        """
+        delay = self.reserve(amount)
+        if delay:
+            await asyncio.sleep(delay)
+
+class RateLimiter:
+    """
+    1分あたりのリクエスト数とトークン数でAPI呼び出しを制限するクラス
+
+    Attributes:
+        requests (TokenBucket): リクエスト数のバケット
+        tokens (TokenBucket): トークン数のバケット（トークン数を制限しない場合はNone）
+    """
+    def __init__(self, requests_per_minute: float, tokens_per_minute: Optional[float] = None):
+        """
+        RateLimiterクラスの初期化
+
+        Args:
+            requests_per_minute (float): 1分あたりの最大リクエスト数
+            tokens_per_minute (float, optional): 1分あたりの最大トークン数。指定がなければ制限しない
+        """
+        self.requests = TokenBucket(requests_per_minute / 60.0, requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute else None
+
+    def _reserve(self, tokens: int, requests: int) -> float:
+        """
+        リクエストとトークンを予約し、待機秒数を返す
+
+        Args:
+            tokens (int): 呼び出しで使用する概算のトークン数
+            requests (int): 呼び出し回数
+
+        Returns:
+            float: 待機秒数
+        """
+        delay = self.requests.reserve(requests)
+        if self.tokens is not None:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return delay
+
+    def acquire(self, tokens: int = 0, requests: int = 1) -> None:
+        """
+        API呼び出しの前に呼び出し、制限を超える場合は待機する
+
+        Args:
+            tokens (int, optional): 呼び出しで使用する概算のトークン数。デフォルトは0
+            requests (int, optional): 呼び出し回数（まとめて呼び出す場合に指定）。デフォルトは1
+        """
+        delay = self._reserve(tokens, requests)
+        if delay:
+            time.sleep(delay)
+
+    async def aacquire(self, tokens: int = 0, requests: int = 1) -> None:
+        """
+        API呼び出しの前に呼び出し、制限を超える場合は非同期に待機する（acquire の非同期版）
+
+        Args:
+            tokens (int, optional): 呼び出しで使用する概算のトークン数。デフォルトは0
+            requests (int, optional): 呼び出し回数（まとめて呼び出す場合に指定）。デフォルトは1
+        """
+        delay = self._reserve(tokens, requests)
+        if delay:
+            await asyncio.sleep(delay)
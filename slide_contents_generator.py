@@ -9,22 +9,101 @@ Classes:
 """
 
 import logging
-from typing import Optional
+from typing import List, Optional, Tuple
+from langchain_core.messages import BaseMessage
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import Runnable
+from backoff import acall_with_retries, call_with_retries
+from llm_cache import ResponseCache, TemplateCache, describe_llm, messages_cache_key, with_prompt_cache_key
+from preflight import prepare_user_request
+from providers import detect_api_provider
+from rate_limiter import RateLimiter, estimate_tokens
 
 # ロガーの設定
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Gemini APIの利用可能性をチェック
-try:
-    from langchain_google_genai import ChatGoogleGenerativeAI
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-    logger.warning("langchain_google_genai をインポートできませんでした。Google Gemini機能は無効化されます。")
+# スライド内容の記述ルールと例（ストーリーとスライド内容を一括で生成する場合にも使用する）
+SLIDE_CONTENTS_RULES = (
+    "ルール:\n"
+    "- スライドの内容は、テキストベースで作成してください。\n"
+    "- 使用して良いのはテキスト、図形、表、画像、動画です。\n"
+    "- テキスト以外の要素（図形、表、画像、動画）を使用する場合は、その旨を明記してください。\n"
+    "- 画像を使用する場合は [画像: 説明] のフォーマットで記述し、説明には必要な画像の内容について具体的に書いてください。\n"
+    "- 動画を使用する場合は [動画: 説明] のフォーマットで記述し、説明には必要な動画の内容について具体的に書いてください。\n"
+    "- 図形を使用する場合は [図形: 説明] のフォーマットで記述してください。\n"
+    "- 表を使用する場合は [表: 説明] のフォーマットで記述し、その後に表の内容をテキストで記述してください。\n"
+    "- スライド番号を進める際は、'---next---' と記述してください。\n\n"
+    "例:\n"
+    "# AIエージェントの概要\n"
+    "- AIエージェントとは、特定のタスクを自律的に実行できるAIシステムです\n"
+    "- 主な特徴：\n"
+    "  - 自律性\n"
+    "  - 適応性\n"
+    "  - 目標指向\n"
+    "[図形: AIエージェントの主要コンポーネントを示す図。中央に「AIエージェント」、周囲に「知覚」「判断」「行動」「学習」と配置した円形図]\n\n"
+    "---next---\n\n"
+    "# AIエージェントの応用例\n"
+    "[画像: 様々な産業でのAIエージェント活用例を示す写真コラージュ。医療、金融、製造業などの分野を含む]\n"
+    "- 医療：診断支援、薬剤開発\n"
+    "- 金融：取引自動化、リスク分析\n"
+    "- カスタマーサービス：チャットボット\n"
+    "[動画: AIエージェントが自動運転車を操作する様子のデモンストレーション映像]\n\n"
+)
+
+# スライド内容生成のプロンプト（入力に依存しないため、モジュールの読み込み時に一度だけ作成する）
+SLIDE_CONTENTS_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        # ルールと例はすべての呼び出しで同じため、システムメッセージにまとめてプロンプトキャッシュの共通プレフィックスにする
+        (
+            "system",
+            "あなたは提供されたストーリーに基づいてプレゼンテーションの構成を作成する専門家です。\n"
+            "ユーザーリクエストと生成されたストーリーに基づいて、プレゼンテーションのスライドの内容を作成してください。\n\n"
+            + SLIDE_CONTENTS_RULES
+        ),
+        # 可変の入力のみを末尾のメッセージに置く
+        (
+            "human",
+            "ユーザーリクエスト: {user_request}\n\n"
+            "ストーリー:\n{story}"
+        )
+    ]
+)
+
+# APIエラーで生成できなかった場合に返すスライドの内容（リクエストの冒頭を埋め込んで使用する）
+FALLBACK_SLIDE_CONTENTS = """
+# プレゼンテーション資料
+
+## このプレゼンテーションについて
+- APIエラーが発生したため、基本的なスライド構成のみ生成されました
+- ユーザーリクエスト: {user_request_100}...
+
+---next---
+
+# 目次
+1. 導入
+2. 主要ポイント
+3. まとめ
+
+---next---
+
+# 導入
+- このプレゼンテーションでは、{user_request_50}...について説明します
+
+---next---
+
+# 主要ポイント
+- ポイント1: 詳細情報
+- ポイント2: 詳細情報
+- ポイント3: 詳細情報
+
+---next---
+
+# まとめ
+- 主要ポイントの要約
+- 次のステップ
+                    """
 
 class SlideContentsGenerator:
     """
@@ -33,159 +112,242 @@ class SlideContentsGenerator:
     Attributes:
         llm (BaseChatModel): 対話型言語モデルのインスタンス
         max_retries (int): APIコール失敗時の最大再試行回数
+        base_delay (float): 再試行までの基本待機秒数
+        used_fallback (bool): 直前の実行でフォールバックの内容を返したかどうか
+        cache (ResponseCache): LLM呼び出し結果のキャッシュ（未指定時はNone）
+        max_concurrency (int): 複数のリクエストをまとめて処理する際の最大同時呼び出し数
+        rate_limiter (RateLimiter): 呼び出し前に流量を制限するレートリミッター（未指定時はNone）
+        template_cache (TemplateCache): 語句だけが異なるリクエストのスライド内容のキャッシュ（未指定時はNone）
     """
-    def __init__(self, llm: BaseChatModel, max_retries: int = 2):
+    def __init__(self, llm: BaseChatModel, max_retries: int = 2, cache: Optional[ResponseCache] = None,
+                 base_delay: float = 1.0, max_concurrency: int = 8,
+                 rate_limiter: Optional[RateLimiter] = None, template_cache: Optional[TemplateCache] = None):
         """
         SlideContentsGeneratorクラスの初期化
 
         Args:
             llm (BaseChatModel): 対話型言語モデルのインスタンス
             max_retries (int, optional): 最大再試行回数。デフォルトは2
+            cache (ResponseCache, optional): LLM呼び出し結果のキャッシュ。指定がなければ無効
+            base_delay (float, optional): 再試行までの基本待機秒数。デフォルトは1.0
+            max_concurrency (int, optional): 複数のリクエストをまとめて処理する際の最大同時呼び出し数。デフォルトは8
+            rate_limiter (RateLimiter, optional): 呼び出し前に流量を制限するレートリミッター。指定がなければ制限しない
+            template_cache (TemplateCache, optional): 「」などで囲まれた語句だけが異なるリクエストに、語句を差し替えたスライド内容を返すキャッシュ。指定がなければ無効
         """
         self.llm = llm
         self.max_retries = max_retries
-        # APIプロバイダーの検出（クラス名でチェック）
-        self.api_provider = self._detect_api_provider(llm)
-        logger.info(f"SlideContentsGenerator initialized with {self.api_provider} API")
+        self.base_delay = base_delay
+        self.max_concurrency = max_concurrency
+        self.used_fallback = False
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.template_cache = template_cache
+        # APIプロバイダーの検出（クラスでチェック）
+        self.api_provider = detect_api_provider(llm)
+        logger.info("SlideContentsGenerator initialized with %s API", self.api_provider)
         
-    def _detect_api_provider(self, llm: BaseChatModel) -> str:
+    @property
+    def llm(self) -> BaseChatModel:
         """
-        使用されているAPIプロバイダーを検出する
-        
+        対話型言語モデルのインスタンス
+        """
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm: BaseChatModel) -> None:
+        """
+        対話型言語モデルを設定し、チェーンを作り直す
+
         Args:
             llm (BaseChatModel): 対話型言語モデルのインスタンス
-            
+        """
+        self._llm = llm
+        self._chain = self._build_chain(llm)
+
+    @staticmethod
+    def _build_chain(llm: BaseChatModel) -> Runnable:
+        """
+        スライド内容生成のチェーンを作成する
+        プロンプトは _format で描画済みのメッセージを渡すため、チェーンにはLLM以降のみを含める
+
+        Args:
+            llm (BaseChatModel): 呼び出しに使用するLLM
+
         Returns:
-            str: 検出されたAPIプロバイダー名 ("OpenAI" または "Google Gemini")
+            Runnable: LLMと出力パーサーをつないだチェーン
         """
-        llm_class_str = str(llm.__class__).lower()
-        
-        if "openai" in llm_class_str:
-            return "OpenAI"
-        elif "google" in llm_class_str or "gemini" in llm_class_str:
-            return "Google Gemini"
-        else:
-            logger.warning(f"不明なLLMタイプです: {llm.__class__.__name__}")
-            return "Unknown"
-        
-    def run(self, user_request: str, story: str) -> str:
+        return with_prompt_cache_key(llm, "slide_contents_generator") | StrOutputParser()
+
+    def _resolve(self, llm: Optional[BaseChatModel]) -> Tuple[BaseChatModel, Runnable]:
         """
-        ユーザーリクエストとストーリーからスライドの内容を生成する
+        呼び出しに使用するLLMとチェーンを決める
+        フォールバック用のLLMは生成器のLLMを差し替えずに呼び出しごとに渡すため、並行する呼び出しに影響しない
+
+        Args:
+            llm (BaseChatModel): 呼び出しに使用するLLM（Noneの場合は生成器のLLM）
+
+        Returns:
+            Tuple[BaseChatModel, Runnable]: 呼び出しに使用するLLMとチェーン
+        """
+        if llm is None or llm is self._llm:
+            return self._llm, self._chain
+        return llm, self._build_chain(llm)
+
+    def _format(self, user_request: str, story: str) -> List[BaseMessage]:
+        """
+        スライド内容生成のプロンプトを描画する
 
         Args:
             user_request (str): ユーザーからのリクエスト
             story (str): 生成されたストーリー
 
         Returns:
-            str: 生成されたスライドの内容
+            List[BaseMessage]: LLMに渡すメッセージのリスト
         """
-        # プロンプトを定義
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                (
-                    "system",
-                    "あなたは提供されたストーリーに基づいてプレゼンテーションの構成を作成する専門家です。"
-                ),
-                (
-                    "human",
-                    "以下のユーザーリクエストと生成されたストーリーに基づいて、プレゼンテーションのスライドの内容を作成してください。\n\n"
-                    "ユーザーリクエスト: {user_request}\n\n"
-                    "ストーリー:\n{story}\n\n"
-                    "ルール:\n"
-                    "- スライドの内容は、テキストベースで作成してください。\n"
-                    "- 使用して良いのはテキスト、図形、表、画像、動画です。\n"
-                    "- テキスト以外の要素（図形、表、画像、動画）を使用する場合は、その旨を明記してください。\n"
-                    "- 画像を使用する場合は [画像: 説明] のフォーマットで記述し、説明には必要な画像の内容について具体的に書いてください。\n"
-                    "- 動画を使用する場合は [動画: 説明] のフォーマットで記述し、説明には必要な動画の内容について具体的に書いてください。\n"
-                    "- 図形を使用する場合は [図形: 説明] のフォーマットで記述してください。\n"
-                    "- 表を使用する場合は [表: 説明] のフォーマットで記述し、その後に表の内容をテキストで記述してください。\n"
-                    "- スライド番号を進める際は、'---next---' と記述してください。\n\n"
-                    "例:\n"
-                    "# AIエージェントの概要\n"
-                    "- AIエージェントとは、特定のタスクを自律的に実行できるAIシステムです\n"
-                    "- 主な特徴：\n"
-                    "  - 自律性\n"
-                    "  - 適応性\n"
-                    "  - 目標指向\n"
-                    "[図形: AIエージェントの主要コンポーネントを示す図。中央に「AIエージェント」、周囲に「知覚」「判断」「行動」「学習」と配置した円形図]\n\n"
-                    "---next---\n\n"
-                    "# AIエージェントの応用例\n"
-                    "[画像: 様々な産業でのAIエージェント活用例を示す写真コラージュ。医療、金融、製造業などの分野を含む]\n"
-                    "- 医療：診断支援、薬剤開発\n"
-                    "- 金融：取引自動化、リスク分析\n"
-                    "- カスタマーサービス：チャットボット\n"
-                    "[動画: AIエージェントが自動運転車を操作する様子のデモンストレーション映像]"
-                )
-            ]
-        )
+        return SLIDE_CONTENTS_PROMPT.format_messages(user_request=user_request, story=story)
         
-        # エラーハンドリングを追加
-        last_error = None
-        for attempt in range(self.max_retries + 1):
-            try:
-                # スライド内容を生成するチェーンを作成
-                chain = prompt | self.llm | StrOutputParser()
-                # スライド内容を生成
-                result = chain.invoke({"user_request": user_request, "story": story})
-                logger.info(f"{self.api_provider} APIでスライド内容生成に成功しました")
-                return result
-            except Exception as e:
-                last_error = e
-                error_msg = str(e).lower()
-                
-                # APIクォータ超過エラーまたはレート制限エラーの場合
-                quota_errors = ["insufficient_quota", "quota exceeded", "rate_limit"]
-                if any(err in error_msg for err in quota_errors):
-                    logger.error(f"{self.api_provider} API制限エラー: {e}")
-                    # クォータ超過は再試行しても解決しないので、すぐに例外を発生させる
-                    raise e
-                
-                # レート制限エラーの場合は少し待機してから再試行
-                if "rate" in error_msg and "limit" in error_msg:
-                    logger.warning(f"レート制限エラーが発生しました（試行 {attempt+1}/{self.max_retries+1}）: {e}")
-                    import time
-                    time.sleep(2 ** attempt)  # 指数バックオフ
+    def _fallback_contents(self, user_request: str) -> str:
+        """
+        APIエラーで生成できなかった場合に返すスライドの内容を作成する
+
+        Args:
+            user_request (str): ユーザーからのリクエスト
+
+        Returns:
+            str: 基本的なスライド構成のみのスライドの内容
+        """
+        return FALLBACK_SLIDE_CONTENTS.format(user_request_100=user_request[:100], user_request_50=user_request[:50])
+
+    def run_many(self, user_requests: List[str], stories: List[str]) -> List[str]:
+        """
+        複数のユーザーリクエストとストーリーのスライド内容をまとめて生成する
+        キャッシュにないものだけを同時に呼び出し、失敗したものは run で個別に再試行する
+
+        Args:
+            user_requests (List[str]): ユーザーからのリクエストのリスト
+            stories (List[str]): 各リクエストに対応するストーリーのリスト
+
+        Returns:
+            List[str]: リクエストと同じ順序の、生成されたスライドの内容のリスト
+        """
+        user_requests = [prepare_user_request(user_request) for user_request in user_requests]
+        pairs = list(zip(user_requests, stories))
+        messages = [self._format(user_request, story) for user_request, story in pairs]
+        cache_keys = [messages_cache_key(self.llm, "slide_contents_generator", item) if self.cache is not None else None for item in messages]
+        results = [self.cache.get(key) if key is not None else None for key in cache_keys]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(sum(estimate_tokens(*(message.content for message in messages[i])) for i in pending), requests=len(pending))
+            outputs = self._chain.batch([messages[i] for i in pending], config={"max_concurrency": self.max_concurrency}, return_exceptions=True)
+            for i, output in zip(pending, outputs):
+                if isinstance(output, Exception):
+                    results[i] = self.run(*pairs[i])
                     continue
-                
-                # その他のエラーの場合
-                logger.warning(f"スライド内容生成中にエラーが発生しました（試行 {attempt+1}/{self.max_retries+1}）: {e}")
-                
-                # 最後の試行の場合はフォールバックメッセージを返す
-                if attempt == self.max_retries:
-                    logger.error("最大試行回数に達しました。フォールバックメッセージを返します。")
-                    return f"""
-# プレゼンテーション資料
+                results[i] = output
+                if cache_keys[i] is not None:
+                    self.cache.set(cache_keys[i], output)
+            logger.info("%s APIで%s件のスライド内容をまとめて生成しました", self.api_provider, len(pending))
+        return results
 
-## このプレゼンテーションについて
-- APIエラーが発生したため、基本的なスライド構成のみ生成されました
-- ユーザーリクエスト: {user_request[:100]}...
+    def _cache_lookup(self, llm: BaseChatModel, messages: List[BaseMessage], user_request: str) -> Tuple[Optional[str], Optional[str]]:
+        """
+        同じプロンプト・同じモデルでの呼び出し結果をキャッシュから探す
+        見つからなければ、語句だけが異なるリクエストのスライド内容を語句を差し替えて探す
 
----next---
+        Args:
+            llm (BaseChatModel): 呼び出しに使用するLLM
+            messages (List[BaseMessage]): 描画済みのプロンプト
+            user_request (str): ユーザーからのリクエスト
 
-# 目次
-1. 導入
-2. 主要ポイント
-3. まとめ
+        Returns:
+            Tuple[Optional[str], Optional[str]]: 生成結果を保存するキャッシュキー（使用しない場合はNone）と、キャッシュされたスライド内容（ない場合はNone）
+        """
+        cache_key = messages_cache_key(llm, "slide_contents_generator", messages) if self.cache is not None else None
+        cached = self.cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            logger.info("キャッシュされたスライド内容を使用します")
+        elif self.template_cache is not None:
+            # ストーリーもリクエストから生成されるため、ひな形はリクエストのみで決める
+            cached = self.template_cache.get(f"slide_contents_generator:{describe_llm(llm)}", user_request)
+        return cache_key, cached
 
----next---
+    def _store(self, llm: BaseChatModel, user_request: str, cache_key: Optional[str], result: str) -> str:
+        """
+        生成したスライド内容をキャッシュに保存する（フォールバックの内容は保存しない）
 
-# 導入
-- このプレゼンテーションでは、{user_request[:50]}...について説明します
+        Args:
+            llm (BaseChatModel): 呼び出しに使用したLLM
+            user_request (str): ユーザーからのリクエスト
+            cache_key (str): キャッシュキー（キャッシュしない場合はNone）
+            result (str): 生成されたスライドの内容
 
----next---
+        Returns:
+            str: 生成されたスライドの内容
+        """
+        if not self.used_fallback:
+            logger.info("%s APIでスライド内容生成に成功しました", self.api_provider)
+            if cache_key is not None:
+                self.cache.set(cache_key, result)
+            if self.template_cache is not None:
+                self.template_cache.set(f"slide_contents_generator:{describe_llm(llm)}", user_request, result)
+        return result
 
-# 主要ポイント
-- ポイント1: 詳細情報
-- ポイント2: 詳細情報
-- ポイント3: 詳細情報
+    def run(self, user_request: str, story: str, llm: Optional[BaseChatModel] = None) -> str:
+        """
+        ユーザーリクエストとストーリーからスライドの内容を生成する
 
----next---
+        Args:
+            user_request (str): ユーザーからのリクエスト
+            story (str): 生成されたストーリー
+            llm (BaseChatModel, optional): この呼び出しに使用するLLM（フォールバック時など）。指定がなければ生成器のLLM
 
-# まとめ
-- 主要ポイントの要約
-- 次のステップ
-                    """
+        Returns:
+            str: 生成されたスライドの内容
+        """
+        user_request = prepare_user_request(user_request)
+        self.used_fallback = False
+        llm, chain = self._resolve(llm)
+        messages = self._format(user_request, story)
+        cache_key, cached = self._cache_lookup(llm, messages, user_request)
+        if cached is not None:
+            return cached
+        
+        def invoke() -> str:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(estimate_tokens(*(message.content for message in messages)))
+            return chain.invoke(messages)
+        
+        # 再試行しても生成できない場合は基本的なスライド構成のみを返す
+        result, self.used_fallback = call_with_retries(invoke, self.max_retries, self.base_delay,
+                                                       lambda: self._fallback_contents(user_request), "スライド内容生成")
+        return self._store(llm, user_request, cache_key, result)
+
+    async def arun(self, user_request: str, story: str, llm: Optional[BaseChatModel] = None) -> str:
+        """
+        ユーザーリクエストとストーリーからスライドの内容を非同期に生成する（run の非同期版）
+
+        Args:
+            user_request (str): ユーザーからのリクエスト
+            story (str): 生成されたストーリー
+            llm (BaseChatModel, optional): この呼び出しに使用するLLM（フォールバック時など）。指定がなければ生成器のLLM
+
+        Returns:
+            str: 生成されたスライドの内容
+        """
+        user_request = prepare_user_request(user_request)
+        self.used_fallback = False
+        llm, chain = self._resolve(llm)
+        messages = self._format(user_request, story)
+        cache_key, cached = self._cache_lookup(llm, messages, user_request)
+        if cached is not None:
+            return cached
+        
+        async def invoke() -> str:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.aacquire(estimate_tokens(*(message.content for message in messages)))
+            return await chain.ainvoke(messages)
         
-        # すべての試行が失敗した場合
-        if last_error:
-            raise last_error 
\ No newline at end of file
+        result, self.used_fallback = await acall_with_retries(invoke, self.max_retries, self.base_delay,
+                                                              lambda: self._fallback_contents(user_request), "スライド内容生成")
+        return self._store(llm, user_request, cache_key, result)
@@ -1,6 +1,7 @@
 """
 このモジュールはプレゼンテーションのストーリーを評価するための機能を提供します。
 生成されたストーリーが十分かどうかを評価し、Judgementオブジェクトを返します。
+不十分な場合に改善したストーリーを同じ呼び出しで受け取ることもできます。
 OpenAIとGoogle Gemini両方のAPIに対応しています。
 
 Classes:
@@ -8,96 +9,287 @@ Classes:
 """
 
 import logging
+from typing import List, Optional, Tuple
+from langchain_core.messages import BaseMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import Runnable
 
-from datamodel import Judgement
+from datamodel import Judgement, RevisedJudgement
+from llm_cache import ResponseCache, messages_cache_key
+from preflight import prepare_user_request
+from providers import detect_api_provider
+from rate_limiter import RateLimiter, estimate_tokens
 
 # ロガーの設定
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Gemini APIの利用可能性をチェック
-try:
-    from langchain_google_genai import ChatGoogleGenerativeAI
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-    logger.warning("langchain_google_genai をインポートできませんでした。Google Gemini機能は無効化されます。")
     
+# ストーリー評価のプロンプト（入力に依存しないため、モジュールの読み込み時に一度だけ作成する）
+EVALUATION_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "あなたはプレゼンテーションのストーリーの十分性および適切性を評価する専門家です。"
+        ),
+        (
+            "human",
+            "以下のユーザーリクエストと生成されたストーリーから、良いプレゼンテーション資料を作成するために十分で適切な情報が記載されているかどうかを判断してください。\n\n"
+            "ユーザーリクエスト: {user_request}\n\n"
+            "ストーリー:\n{story}"
+        )
+    ]
+)
+
+# ストーリーの評価と改善を1回の呼び出しで行うプロンプト
+EVALUATION_REVISION_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "あなたはプレゼンテーションのストーリーの十分性および適切性を評価し、不十分な点を改善する専門家です。"
+        ),
+        (
+            "human",
+            "以下のユーザーリクエストと生成されたストーリーから、良いプレゼンテーション資料を作成するために十分で適切な情報が記載されているかどうかを判断してください。\n"
+            "不十分な場合は、判定理由を反映して改善したストーリーの全文も作成してください。十分な場合、改善したストーリーは不要です。\n\n"
+            "ユーザーリクエスト: {user_request}\n\n"
+            "ストーリー:\n{story}"
+        )
+    ]
+)
+
+# 評価中にエラーが発生した場合の判定理由
+ERROR_REASON = "API呼び出し中にエラーが発生したため、ストーリーを再生成します。"
+
 class StoryEvaluator:
     """
     プレゼンテーションのストーリーを評価するクラス
 
     Attributes:
         llm (BaseChatModel): 構造化出力をサポートする対話型言語モデルのインスタンス
+        cache (ResponseCache): LLM呼び出し結果のキャッシュ（未指定時はNone）
+        max_concurrency (int): 複数のストーリーをまとめて評価する際の最大同時呼び出し数
+        rate_limiter (RateLimiter): 呼び出し前に流量を制限するレートリミッター（未指定時はNone）
     """
-    def __init__(self, llm: BaseChatModel):
+    def __init__(self, llm: BaseChatModel, cache: Optional[ResponseCache] = None, max_concurrency: int = 8,
+                 rate_limiter: Optional[RateLimiter] = None):
         """
         StoryEvaluatorクラスの初期化
 
         Args:
             llm (BaseChatModel): 対話型言語モデルのインスタンス
+            cache (ResponseCache, optional): LLM呼び出し結果のキャッシュ。指定がなければ無効
+            max_concurrency (int, optional): 複数のストーリーをまとめて評価する際の最大同時呼び出し数。デフォルトは8
+            rate_limiter (RateLimiter, optional): 呼び出し前に流量を制限するレートリミッター。指定がなければ制限しない
         """
-        self.llm = llm.with_structured_output(Judgement)
-        # APIプロバイダーの検出（クラス名でチェック）
-        self.api_provider = self._detect_api_provider(llm)
-        logger.info(f"StoryEvaluator initialized with {self.api_provider} API")
+        self.llm = llm
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.max_concurrency = max_concurrency
+        # APIプロバイダーの検出（クラスでチェック）
+        self.api_provider = detect_api_provider(llm)
+        logger.info("StoryEvaluator initialized with %s API", self.api_provider)
         
-    def _detect_api_provider(self, llm: BaseChatModel) -> str:
+    @property
+    def llm(self) -> BaseChatModel:
         """
-        使用されているAPIプロバイダーを検出する
-        
+        対話型言語モデルのインスタンス
+        """
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm: BaseChatModel) -> None:
+        """
+        対話型言語モデルを設定し、チェーンを作り直す
+
         Args:
             llm (BaseChatModel): 対話型言語モデルのインスタンス
-            
+        """
+        self._llm = llm
+        # プロンプトは _format で描画済みのメッセージを渡すため、チェーンにはLLM以降のみを含める
+        self._chain = llm.with_structured_output(Judgement)
+        self._revision_chain = llm.with_structured_output(RevisedJudgement)
+
+    def _resolve(self, revise: bool, llm: Optional[BaseChatModel]) -> Tuple[BaseChatModel, Runnable]:
+        """
+        呼び出しに使用するLLMとチェーンを決める
+        フォールバック用のLLMは評価器のLLMを差し替えずに呼び出しごとに渡すため、並行する呼び出しに影響しない
+
+        Args:
+            revise (bool): 評価と改善を同時に行うチェーンを使用するかどうか
+            llm (BaseChatModel): 呼び出しに使用するLLM（Noneの場合は評価器のLLM）
+
         Returns:
-            str: 検出されたAPIプロバイダー名 ("OpenAI" または "Google Gemini")
+            Tuple[BaseChatModel, Runnable]: 呼び出しに使用するLLMとチェーン
         """
-        llm_class_str = str(llm.__class__).lower()
-        
-        if "openai" in llm_class_str:
-            return "OpenAI"
-        elif "google" in llm_class_str or "gemini" in llm_class_str:
-            return "Google Gemini"
-        else:
-            logger.warning(f"不明なLLMタイプです: {llm.__class__.__name__}")
-            return "Unknown"
+        if llm is None or llm is self._llm:
+            return self._llm, self._revision_chain if revise else self._chain
+        return llm, llm.with_structured_output(RevisedJudgement if revise else Judgement)
+
+    def _format(self, revise: bool, user_request: str, story: str) -> List[BaseMessage]:
+        """
+        ストーリー評価のプロンプトを描画する
+
+        Args:
+            revise (bool): 評価と改善を同時に行うプロンプトを使用するかどうか
+            user_request (str): ユーザーからのリクエスト
+            story (str): 評価するストーリー
+
+        Returns:
+            List[BaseMessage]: LLMに渡すメッセージのリスト
+        """
+        prompt = EVALUATION_REVISION_PROMPT if revise else EVALUATION_PROMPT
+        return prompt.format_messages(user_request=user_request, story=story)
         
-    def run(self, user_request: str, story: str) -> Judgement:
+    def _cache_lookup(self, llm: BaseChatModel, revise: bool, user_request: str, story: str) -> Tuple[List[BaseMessage], Optional[str], Optional[Judgement]]:
+        """
+        プロンプトを描画し、同じストーリー・同じモデルでの評価結果をキャッシュから探す
+
+        Args:
+            llm (BaseChatModel): 呼び出しに使用するLLM
+            revise (bool): 評価と改善を同時に行うプロンプトを使用するかどうか
+            user_request (str): 検証済みのユーザーリクエスト
+            story (str): 評価するストーリー
+
+        Returns:
+            Tuple[List[BaseMessage], Optional[str], Optional[Judgement]]: 描画済みのプロンプト、評価結果を保存するキャッシュキー（使用しない場合はNone）、
+                キャッシュされた評価結果（ない場合はNone。revise が True の場合は RevisedJudgement）
+        """
+        messages = self._format(revise, user_request, story)
+        name = "story_evaluator_revision" if revise else "story_evaluator"
+        cache_key = messages_cache_key(llm, name, messages) if self.cache is not None else None
+        cached = self.cache.get(cache_key) if cache_key is not None else None
+        if cached is None:
+            return messages, cache_key, None
+        logger.info("キャッシュされた評価結果を使用します")
+        return messages, cache_key, (RevisedJudgement if revise else Judgement).model_validate_json(cached)
+
+    def _store(self, cache_key: Optional[str], judgement: Judgement) -> Judgement:
+        """
+        評価結果をキャッシュに保存する
+
+        Args:
+            cache_key (str): キャッシュキー（キャッシュしない場合はNone）
+            judgement (Judgement): ストーリーの評価結果
+
+        Returns:
+            Judgement: ストーリーの評価結果
+        """
+        if cache_key is not None:
+            self.cache.set(cache_key, judgement.model_dump_json())
+        return judgement
+
+    def run(self, user_request: str, story: str, llm: Optional[BaseChatModel] = None) -> Judgement:
         """
         ストーリーの十分性および適切性を評価する
 
         Args:
             user_request (str): ユーザーからのリクエスト
             story (str): 評価するストーリー
+            llm (BaseChatModel, optional): この呼び出しに使用するLLM（フォールバック時など）。指定がなければ評価器のLLM
 
         Returns:
             Judgement: ストーリーの評価結果
         """
+        user_request = prepare_user_request(user_request)
         try:
-            # プロンプトを定義
-            prompt = ChatPromptTemplate.from_messages(
-                [
-                    (
-                        "system",
-                        "あなたはプレゼンテーションのストーリーの十分性および適切性を評価する専門家です。"
-                    ),
-                    (
-                        "human",
-                        "以下のユーザーリクエストと生成されたストーリーから、良いプレゼンテーション資料を作成するために十分で適切な情報が記載されているかどうかを判断してください。\n\n"
-                        "ユーザーリクエスト: {user_request}\n\n"
-                        "ストーリー:\n{story}"
-                    )
-                ]
-            )
-            # ストーリーの十分性および適切性を評価するチェーンを作成
-            chain = prompt | self.llm
-            # 評価結果を返す
-            judgement = chain.invoke({"user_request": user_request, "story": story})
-            logger.info(f"{self.api_provider} APIでストーリー評価に成功しました")
-            return judgement
+            llm, chain = self._resolve(False, llm)
+            messages, cache_key, cached = self._cache_lookup(llm, False, user_request, story)
+            if cached is not None:
+                return cached
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(estimate_tokens(*(message.content for message in messages)))
+            judgement = chain.invoke(messages)
+            logger.info("%s APIでストーリー評価に成功しました", self.api_provider)
+            return self._store(cache_key, judgement)
         except Exception as e:
-            logger.error(f"ストーリー評価中にエラーが発生しました: {e}")
+            logger.error("ストーリー評価中にエラーが発生しました: %s", e)
             # エラー発生時は否定的な評価を返す（ストーリー生成のやり直しを促す）
-            return Judgement(judge=False, reason="API呼び出し中にエラーが発生したため、ストーリーを再生成します。") 
\ No newline at end of file
+            return Judgement(judge=False, reason=ERROR_REASON)
+
+    async def arun(self, user_request: str, story: str, llm: Optional[BaseChatModel] = None) -> Judgement:
+        """
+        ストーリーの十分性および適切性を非同期に評価する（run の非同期版）
+
+        Args:
+            user_request (str): ユーザーからのリクエスト
+            story (str): 評価するストーリー
+            llm (BaseChatModel, optional): この呼び出しに使用するLLM（フォールバック時など）。指定がなければ評価器のLLM
+
+        Returns:
+            Judgement: ストーリーの評価結果
+        """
+        user_request = prepare_user_request(user_request)
+        try:
+            llm, chain = self._resolve(False, llm)
+            messages, cache_key, cached = self._cache_lookup(llm, False, user_request, story)
+            if cached is not None:
+                return cached
+            if self.rate_limiter is not None:
+                await self.rate_limiter.aacquire(estimate_tokens(*(message.content for message in messages)))
+            judgement = await chain.ainvoke(messages)
+            logger.info("%s APIでストーリー評価に成功しました", self.api_provider)
+            return self._store(cache_key, judgement)
+        except Exception as e:
+            logger.error("ストーリー評価中にエラーが発生しました: %s", e)
+            return Judgement(judge=False, reason=ERROR_REASON)
+
+    def run_many(self, user_requests: List[str], stories: List[str]) -> List[Judgement]:
+        """
+        複数のストーリーをまとめて評価する
+        キャッシュにないものだけを同時に呼び出し、失敗したものは run で個別に評価する
+
+        Args:
+            user_requests (List[str]): ユーザーからのリクエストのリスト
+            stories (List[str]): 評価するストーリーのリスト
+
+        Returns:
+            List[Judgement]: リクエストと同じ順序の、ストーリーの評価結果のリスト
+        """
+        user_requests = [prepare_user_request(user_request) for user_request in user_requests]
+        pairs = list(zip(user_requests, stories))
+        lookups = [self._cache_lookup(self.llm, False, user_request, story) for user_request, story in pairs]
+        messages = [lookup[0] for lookup in lookups]
+        cache_keys = [lookup[1] for lookup in lookups]
+        results: List[Optional[Judgement]] = [lookup[2] for lookup in lookups]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(sum(estimate_tokens(*(message.content for message in messages[i])) for i in pending), requests=len(pending))
+            outputs = self._chain.batch([messages[i] for i in pending], config={"max_concurrency": self.max_concurrency}, return_exceptions=True)
+            for i, output in zip(pending, outputs):
+                if isinstance(output, Exception):
+                    results[i] = self.run(*pairs[i])
+                    continue
+                results[i] = self._store(cache_keys[i], output)
+            logger.info("%s APIで%s件のストーリーをまとめて評価しました", self.api_provider, len(pending))
+        return results
+
+    def run_and_revise(self, user_request: str, story: str, llm: Optional[BaseChatModel] = None) -> RevisedJudgement:
+        """
+        ストーリーを評価し、不十分な場合は改善したストーリーも合わせて生成する
+        （評価とストーリーの再生成を1回のLLM呼び出しで行う）
+
+        Args:
+            user_request (str): ユーザーからのリクエスト
+            story (str): 評価するストーリー
+            llm (BaseChatModel, optional): この呼び出しに使用するLLM（フォールバック時など）。指定がなければ評価器のLLM
+
+        Returns:
+            RevisedJudgement: ストーリーの評価結果と改善したストーリー
+        """
+        user_request = prepare_user_request(user_request)
+        try:
+            llm, chain = self._resolve(True, llm)
+            messages, cache_key, cached = self._cache_lookup(llm, True, user_request, story)
+            if cached is not None:
+                return cached
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(estimate_tokens(*(message.content for message in messages)))
+            judgement = chain.invoke(messages)
+            logger.info("%s APIでストーリー評価と改善に成功しました", self.api_provider)
+            return self._store(cache_key, judgement)
+        except Exception as e:
+            logger.error("ストーリー評価中にエラーが発生しました: %s", e)
+            # エラー発生時は改善したストーリーを持たない否定的な評価を返す（ストーリー生成のやり直しを促す）
+            return RevisedJudgement(judge=False, reason=ERROR_REASON)
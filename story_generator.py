@@ -9,22 +9,59 @@ Classes:
 """
 
 import logging
-from typing import Optional
+from typing import List, Optional, Tuple
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import Runnable
+from backoff import acall_with_retries, call_with_retries
+from llm_cache import ResponseCache, prompt_cache_key
+from preflight import prepare_user_request
+from providers import detect_api_provider
+from rate_limiter import RateLimiter, estimate_tokens
 
 # ロガーの設定
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Gemini APIの利用可能性をチェック
-try:
-    from langchain_google_genai import ChatGoogleGenerativeAI
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-    logger.warning("langchain_google_genai をインポートできませんでした。Google Gemini機能は無効化されます。")
+# ストーリー生成のプロンプト（入力に依存しないため、モジュールの読み込み時に一度だけ作成する）
+STORY_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            "あなたはプレゼンテーションのストーリーを作成する専門家です。"
+        ),
+        (
+            "human",
+            "以下のユーザーリクエストに基づいて、プレゼンテーションのストーリーを作成してください。\n\n"
+            "ユーザーの意図を理解し、その意図がオーディエンスにしっかりと伝わることを重視してください。\n\n"
+            "ユーザーリクエスト:\n{user_request}"
+        )
+    ]
+)
+
+# APIエラーで生成できなかった場合に返すストーリー
+FALLBACK_STORY = """
+プレゼンテーションの基本構成：
+
+1. 導入部
+   - トピックの紹介と背景情報
+   - 聴衆の注目を集める導入
+
+2. 主要ポイント
+   - トピックの主要な側面を3-5点程度
+   - 各ポイントは明確な見出しと簡潔な説明
+
+3. データと分析
+   - ポイントを裏付けるデータや事実
+   - 簡潔なグラフや図表の提案
+
+4. 結論
+   - 主要ポイントのまとめ
+   - 次のステップや行動の提案
+
+5. 質疑応答
+   - 想定される質問と回答
+                    """
 
 class StoryGenerator:
     """
@@ -33,47 +70,158 @@ class StoryGenerator:
     Attributes:
         llm (BaseChatModel): 対話型言語モデルのインスタンス
         max_retries (int): APIコール失敗時の最大再試行回数
+        base_delay (float): 再試行までの基本待機秒数
+        used_fallback (bool): 直前の実行でフォールバックの内容を返したかどうか
+        cache (ResponseCache): LLM呼び出し結果のキャッシュ（未指定時はNone）
+        max_concurrency (int): 複数のリクエストをまとめて処理する際の最大同時呼び出し数
+        rate_limiter (RateLimiter): 呼び出し前に流量を制限するレートリミッター（未指定時はNone）
     """
-    def __init__(self, llm: BaseChatModel, max_retries: int = 2):
+    def __init__(self, llm: BaseChatModel, max_retries: int = 2, cache: Optional[ResponseCache] = None,
+                 base_delay: float = 1.0, max_concurrency: int = 8,
+                 rate_limiter: Optional[RateLimiter] = None):
         """
         StoryGeneratorクラスの初期化
 
         Args:
             llm (BaseChatModel): 対話型言語モデルのインスタンス
             max_retries (int, optional): 最大再試行回数。デフォルトは2
+            cache (ResponseCache, optional): LLM呼び出し結果のキャッシュ。指定がなければ無効
+            base_delay (float, optional): 再試行までの基本待機秒数。デフォルトは1.0
+            max_concurrency (int, optional): 複数のリクエストをまとめて処理する際の最大同時呼び出し数。デフォルトは8
+            rate_limiter (RateLimiter, optional): 呼び出し前に流量を制限するレートリミッター。指定がなければ制限しない
         """
         self.llm = llm
         self.max_retries = max_retries
-        # APIプロバイダーの検出（クラス名でチェック）
-        self.api_provider = self._detect_api_provider(llm)
-        logger.info(f"StoryGenerator initialized with {self.api_provider} API")
+        self.base_delay = base_delay
+        self.max_concurrency = max_concurrency
+        self.used_fallback = False
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        # APIプロバイダーの検出（クラスでチェック）
+        self.api_provider = detect_api_provider(llm)
+        logger.info("StoryGenerator initialized with %s API", self.api_provider)
         
-    def _detect_api_provider(self, llm: BaseChatModel) -> str:
+    @property
+    def llm(self) -> BaseChatModel:
         """
-        使用されているAPIプロバイダーを検出する
-        
+        対話型言語モデルのインスタンス
+        """
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm: BaseChatModel) -> None:
+        """
+        対話型言語モデルを設定し、チェーンを作り直す
+
         Args:
             llm (BaseChatModel): 対話型言語モデルのインスタンス
-            
+        """
+        self._llm = llm
+        self._chain = self._build_chain(llm)
+
+    @staticmethod
+    def _build_chain(llm: BaseChatModel) -> Runnable:
+        """
+        ストーリー生成のチェーンを作成する
+
+        Args:
+            llm (BaseChatModel): 呼び出しに使用するLLM
+
         Returns:
-            str: 検出されたAPIプロバイダー名 ("OpenAI" または "Google Gemini")
+            Runnable: プロンプト・LLM・出力パーサーをつないだチェーン
         """
-        llm_class_str = str(llm.__class__).lower()
-        
-        if "openai" in llm_class_str:
-            return "OpenAI"
-        elif "google" in llm_class_str or "gemini" in llm_class_str:
-            return "Google Gemini"
-        else:
-            logger.warning(f"不明なLLMタイプです: {llm.__class__.__name__}")
-            return "Unknown"
+        return STORY_PROMPT | llm | StrOutputParser()
+
+    def _resolve(self, llm: Optional[BaseChatModel]) -> Tuple[BaseChatModel, Runnable]:
+        """
+        呼び出しに使用するLLMとチェーンを決める
+        フォールバック用のLLMは生成器のLLMを差し替えずに呼び出しごとに渡すため、並行する呼び出しに影響しない
+
+        Args:
+            llm (BaseChatModel): 呼び出しに使用するLLM（Noneの場合は生成器のLLM）
+
+        Returns:
+            Tuple[BaseChatModel, Runnable]: 呼び出しに使用するLLMとチェーン
+        """
+        if llm is None or llm is self._llm:
+            return self._llm, self._chain
+        return llm, self._build_chain(llm)
         
-    def run(self, user_request: str) -> str:
+    def run_many(self, user_requests: List[str]) -> List[str]:
+        """
+        複数のユーザーリクエストのストーリーをまとめて生成する
+        キャッシュにないものだけを同時に呼び出し、失敗したものは run で個別に再試行する
+
+        Args:
+            user_requests (List[str]): ユーザーからのリクエストのリスト
+
+        Returns:
+            List[str]: リクエストと同じ順序の、生成されたストーリーのリスト
+        """
+        user_requests = [prepare_user_request(user_request) for user_request in user_requests]
+        inputs = [{"user_request": user_request} for user_request in user_requests]
+        cache_keys = [prompt_cache_key(self.llm, "story_generator", STORY_PROMPT, item) if self.cache is not None else None for item in inputs]
+        results = [self.cache.get(key) if key is not None else None for key in cache_keys]
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(sum(estimate_tokens(user_requests[i]) for i in pending), requests=len(pending))
+            outputs = self._chain.batch([inputs[i] for i in pending], config={"max_concurrency": self.max_concurrency}, return_exceptions=True)
+            for i, output in zip(pending, outputs):
+                if isinstance(output, Exception):
+                    results[i] = self.run(user_requests[i])
+                    continue
+                results[i] = output
+                if cache_keys[i] is not None:
+                    self.cache.set(cache_keys[i], output)
+            logger.info("%s APIで%s件のストーリーをまとめて生成しました", self.api_provider, len(pending))
+        return results
+
+    def _cache_lookup(self, llm: BaseChatModel, user_request: str, use_cache: bool) -> Tuple[Optional[str], Optional[str]]:
+        """
+        同じプロンプト・同じモデルでの呼び出し結果をキャッシュから探す
+
+        Args:
+            llm (BaseChatModel): 呼び出しに使用するLLM
+            user_request (str): 検証済みのユーザーリクエスト
+            use_cache (bool): キャッシュを使用するかどうか
+
+        Returns:
+            Tuple[Optional[str], Optional[str]]: 生成結果を保存するキャッシュキー（使用しない場合はNone）と、キャッシュされたストーリー（ない場合はNone）
+        """
+        if not use_cache or self.cache is None:
+            return None, None
+        cache_key = prompt_cache_key(llm, "story_generator", STORY_PROMPT, {"user_request": user_request})
+        cached = self.cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            logger.info("キャッシュされたストーリーを使用します")
+        return cache_key, cached
+
+    def _store(self, cache_key: Optional[str], result: str) -> str:
+        """
+        生成したストーリーをキャッシュに保存する（フォールバックの内容は保存しない）
+
+        Args:
+            cache_key (str): キャッシュキー（キャッシュしない場合はNone）
+            result (str): 生成されたストーリー
+
+        Returns:
+            str: 生成されたストーリー
+        """
+        if not self.used_fallback:
+            logger.info("%s APIでストーリー生成に成功しました", self.api_provider)
+            if cache_key is not None:
+                self.cache.set(cache_key, result)
+        return result
+
+    def run(self, user_request: str, use_cache: bool = True, llm: Optional[BaseChatModel] = None) -> str:
         """
         ユーザーリクエストからプレゼンテーションのストーリーを生成する
 
         Args:
             user_request (str): ユーザーからのリクエスト
+            use_cache (bool, optional): キャッシュを使用するかどうか。評価で差し戻された後の再生成ではFalseを指定する。デフォルトはTrue
+            llm (BaseChatModel, optional): この呼び出しに使用するLLM（フォールバック時など）。指定がなければ生成器のLLM
 
         Returns:
             str: 生成されたプレゼンテーションのストーリー
@@ -81,80 +229,50 @@ class StoryGenerator:
         Raises:
             Exception: APIエラーが発生し、再試行しても解決しない場合
         """
-        # プロンプトを定義
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                (
-                    "system",
-                    "あなたはプレゼンテーションのストーリーを作成する専門家です。"
-                ),
-                (
-                    "human",
-                    "以下のユーザーリクエストに基づいて、プレゼンテーションのストーリーを作成してください。\n\n"
-                    "ユーザーの意図を理解し、その意図がオーディエンスにしっかりと伝わることを重視してください。\n\n"
-                    "ユーザーリクエスト:\n{user_request}"
-                )
-            ]
-        )
+        user_request = prepare_user_request(user_request)
+        self.used_fallback = False
+        llm, chain = self._resolve(llm)
+        cache_key, cached = self._cache_lookup(llm, user_request, use_cache)
+        if cached is not None:
+            return cached
         
-        # ストーリー作成のためのチェーンを作成
-        chain = prompt | self.llm | StrOutputParser()
+        def invoke() -> str:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(estimate_tokens(user_request))
+            return chain.invoke({"user_request": user_request})
         
-        # エラーハンドリングを追加
-        last_error = None
-        for attempt in range(self.max_retries + 1):
-            try:
-                # ストーリーを生成
-                result = chain.invoke({"user_request": user_request})
-                logger.info(f"{self.api_provider} APIでストーリー生成に成功しました")
-                return result
-            except Exception as e:
-                last_error = e
-                error_msg = str(e).lower()
-                
-                # APIクォータ超過エラーまたはレート制限エラーの場合
-                quota_errors = ["insufficient_quota", "quota exceeded", "rate_limit"]
-                if any(err in error_msg for err in quota_errors):
-                    logger.error(f"{self.api_provider} API制限エラー: {e}")
-                    # クォータ超過は再試行しても解決しないので、すぐに例外を発生させる
-                    raise e
-                
-                # レート制限エラーの場合は少し待機してから再試行
-                if "rate" in error_msg and "limit" in error_msg:
-                    logger.warning(f"レート制限エラーが発生しました（試行 {attempt+1}/{self.max_retries+1}）: {e}")
-                    import time
-                    time.sleep(2 ** attempt)  # 指数バックオフ
-                    continue
-                
-                # その他のエラーの場合
-                logger.warning(f"ストーリー生成中にエラーが発生しました（試行 {attempt+1}/{self.max_retries+1}）: {e}")
-                
-                # 最後の試行の場合はフォールバックメッセージを返す
-                if attempt == self.max_retries:
-                    logger.error("最大試行回数に達しました。フォールバックメッセージを返します。")
-                    return """
-プレゼンテーションの基本構成：
-
-1. 導入部
-   - トピックの紹介と背景情報
-   - 聴衆の注目を集める導入
+        # 再試行しても生成できない場合はフォールバックのストーリーを返す
+        result, self.used_fallback = call_with_retries(invoke, self.max_retries, self.base_delay,
+                                                       lambda: FALLBACK_STORY, "ストーリー生成")
+        return self._store(cache_key, result)
 
-2. 主要ポイント
-   - トピックの主要な側面を3-5点程度
-   - 各ポイントは明確な見出しと簡潔な説明
-
-3. データと分析
-   - ポイントを裏付けるデータや事実
-   - 簡潔なグラフや図表の提案
+    async def arun(self, user_request: str, use_cache: bool = True, llm: Optional[BaseChatModel] = None) -> str:
+        """
+        ユーザーリクエストからプレゼンテーションのストーリーを非同期に生成する（run の非同期版）
 
-4. 結論
-   - 主要ポイントのまとめ
-   - 次のステップや行動の提案
+        Args:
+            user_request (str): ユーザーからのリクエスト
+            use_cache (bool, optional): キャッシュを使用するかどうか。評価で差し戻された後の再生成ではFalseを指定する。デフォルトはTrue
+            llm (BaseChatModel, optional): この呼び出しに使用するLLM（フォールバック時など）。指定がなければ生成器のLLM
 
-5. 質疑応答
-   - 想定される質問と回答
-                    """
+        Returns:
+            str: 生成されたプレゼンテーションのストーリー
+            
+        Raises:
+            Exception: APIエラーが発生し、再試行しても解決しない場合
+        """
+        user_request = prepare_user_request(user_request)
+        self.used_fallback = False
+        llm, chain = self._resolve(llm)
+        cache_key, cached = self._cache_lookup(llm, user_request, use_cache)
+        if cached is not None:
+            return cached
+        
+        async def invoke() -> str:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.aacquire(estimate_tokens(user_request))
+            return await chain.ainvoke({"user_request": user_request})
         
-        # すべての試行が失敗した場合
-        if last_error:
-            raise last_error 
\ No newline at end of file
+        result, self.used_fallback = await acall_with_retries(invoke, self.max_retries, self.base_delay,
+                                                              lambda: FALLBACK_STORY, "ストーリー生成")
+        return self._store(cache_key, result)
@@ -1,6 +1,7 @@
 
 # 必要なインポート
 import os
+from io import BytesIO
 from pptx.util import Inches, Pt
 from pptx.enum.text import PP_ALIGN
 from pptx.dml.color import RGBColor
@@ -12,25 +13,32 @@ def set_fill_color_safe(fill, color):
     try:
         if hasattr(fill, 'type') and fill.type == None:
             fill.solid()
-        set_fill_color_safe(fill, color)
+        fill.fore_color.rgb = color
         return True
     except (AttributeError, TypeError) as e:
         print(f"フィルの色設定に失敗しました: {e}")
         try:
             # 別の方法を試す
             fill.solid()
-            set_fill_color_safe(fill, color)
+            fill.fore_color.rgb = color
             return True
         except Exception as e2:
             print(f"フィルの色設定の2回目の試行も失敗しました: {e2}")
             return False
 
+# 読み込み済みの画像データ(同じ画像を複数のスライドで使う場合もファイルの読み込みは1回にする)
+_image_cache = {}
+
 # 画像ファイルを安全に扱うためのヘルパー関数
 def add_image_safe(slide, image_path, left=Inches(1), top=Inches(2), width=Inches(4), height=Inches(3)):
     '''指定された画像を安全に追加する(ファイルが存在しない場合はプレースホルダーを作成)'''
-    if os.path.exists(image_path):
+    if image_path in _image_cache or os.path.exists(image_path):
         try:
-            return add_image_safe(slide, image_path, left, top, width, height)
+            data = _image_cache.get(image_path)
+            if data is None:
+                with open(image_path, 'rb') as f:
+                    data = _image_cache[image_path] = f.read()
+            return slide.shapes.add_picture(BytesIO(data), left, top, width, height)
         except Exception as e:
             print(f"画像の追加に失敗しました: {e}")
             # 画像の追加に失敗した場合 代わりにテキストボックスを作成
@@ -76,112 +84,39 @@ def get_placeholder_safe(slide, idx, default_title="", default_content=""):
 
 
 from pptx import Presentation
-from pptx.util import Inches, Pt
-from pptx.enum.text import PP_ALIGN
-from pptx.enum.shapes import MSO_SHAPE
-from pptx.dml.color import RGBColor
-import os
 
-# テンプレート読み込み
-prs = Presentation('workspace/input/template.pptx')
-slide_layouts = prs.slide_layouts
-
-# スライド1
-slide = prs.slides.add_slide(slide_layouts[2])
-title = slide.shapes.title
-subtitle = get_placeholder_safe(slide, 11)
-title.text = "冒険の始まり！AIエージェントの世界へようこそ！"
-subtitle.text = "AIエージェント入門"
-
-img_path = "workspace/input/images/map.jpg" # 適切な画像ファイル名に変更してください
-left = Inches(1)
-top = Inches(2)
-width = Inches(8)
-add_image_safe(slide, img_path, left, top, width=width)
-
-tf = slide.shapes.add_textbox(Inches(1), Inches(5), Inches(8), Inches(2))
-tf.text = "皆さん、こんにちは！今日はAIエージェントという、ワクワクする新しい世界への冒険に一緒に出かけましょう！プログラミングの基礎知識は既にある皆さんなら、きっとこの旅を楽しめるはずです。スマートスピーカーや自動運転など、AIエージェントはすでに私たちの生活に溶け込んでいます。このプレゼンテーションでは、AIエージェントの基本概念から実装方法まで、分かりやすく解説します。"
-tf.text_frame.paragraphs[0].font.size = Pt(16)
-
-
-# スライド2
-slide = prs.slides.add_slide(slide_layouts[0])
-slide.shapes.title.text = "未知の土地へ！AIエージェントとは？"
-
-left = Inches(1)
-top = Inches(2)
-width = Inches(8)
-height = Inches(3)
-shape = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, left, top, width, height)
-shape.fill.solid()
-set_fill_color_safe(shape.fill, RGBColor(255, 255, 255))
-shape.set_fill_color_safe(line.fill, RGBColor(0, 0, 0))
-
-# 人間とAIエージェントの相互作用図(簡略化)
-# 複雑な図形は外部ツールで作成し、画像として挿入することを推奨
-# 以下はテキストによる説明の代用
-tf = slide.shapes.add_textbox(Inches(1), Inches(5), Inches(8), Inches(3))
-tf.text = "AIエージェントとは、環境を感知し、目標を達成するために自ら行動するプログラムのことです。まるでゲームの主人公のように、自律的に行動します。主な特徴は「知覚」「意思決定」「行動」の3つです。"
-tf.text_frame.paragraphs[0].font.size = Pt(16)
-
-
-# スライド3
-slide = prs.slides.add_slide(slide_layouts[0])
-slide.shapes.title.text = "迷路を解くAIエージェント"
-
-# 迷路のイラスト(簡略化)  画像挿入推奨
-tf = slide.shapes.add_textbox(Inches(1), Inches(2), Inches(8), Inches(5))
-tf.text = "例えば、迷路を解くAIエージェントを考えてみましょう。まず、センサー（知覚）で壁の位置を認識します。次に、最適な経路を計算（意思決定）し、実際に移動（行動）します。このように、AIエージェントは環境を理解し、目標達成のために自律的に行動します。"
-tf.text_frame.paragraphs[0].font.size = Pt(16)
-
-
-# スライド4
-slide = prs.slides.add_slide(slide_layouts[0])
-slide.shapes.title.text = "分岐点！AIエージェント vs. チャットボット"
-
-rows = 4
-cols = 3
-left = Inches(1)
-top = Inches(2)
-width = Inches(8)
-height = Inches(3)
-table = slide.shapes.add_table(rows, cols, left, top, width, height).table
-table.cell(0, 0).text = "項目"
-table.cell(1, 0).text = "主な機能"
-table.cell(2, 0).text = "目的"
-table.cell(3, 0).text = "複雑さ"
-table.cell(0, 1).text = "AIエージェント"
-table.cell(1, 1).text = "環境感知、意思決定、行動、タスク実行"
-table.cell(2, 1).text = "複雑なタスクの自動化"
-table.cell(3, 1).text = "高度"
-table.cell(0, 2).text = "チャットボット"
-table.cell(1, 2).text = "自然言語による会話"
-table.cell(2, 2).text = "ユーザーとの対話、情報提供"
-table.cell(3, 2).text = "比較的単純"
-
-tf = slide.shapes.add_textbox(Inches(1), Inches(5.5), Inches(8), Inches(1))
-tf.text = "AIエージェントとよく似た言葉に「チャットボット」がありますが、両者は異なります。チャットボットは会話に特化していますが、AIエージェントはもっと幅広いタスクを実行できます。"
-tf.text_frame.paragraphs[0].font.size = Pt(16)
-
-
-# スライド5, 6, 7, 8, 9 は同様の手法で作成
-
-
-# スライド6: LangChainコード例
-slide = prs.slides.add_slide(slide_layouts[0])
-slide.shapes.title.text = "魔法のツール！LangChainとLangGraphによる実装"
-
-img_path = "workspace/input/images/langchain_logo.png" # 適切な画像ファイル名に変更してください
-left = Inches(1)
-top = Inches(2)
-width = Inches(4)
-add_image_safe(slide, img_path, left, top, width=width)
-
-img_path = "workspace/input/images/langgraph_logo.png" # 適切な画像ファイル名に変更してください
-left = Inches(5)
-top = Inches(2)
-width = Inches(4)
-add_image_safe(slide, img_path, left, top, width=width)
+# スライドを追加するたびにパッケージ内の全パーツを走査しないよう、パーツ名の連番をテンプレートごとに記録する
+from pptx.opc.package import OpcPackage
+from pptx.opc.packuri import PackURI
+
+def _next_partname(self, tmpl):
+    state = self.__dict__.setdefault("_partname_state", {})
+    if tmpl not in state:
+        # 既存のパーツ名は最初の1回だけ走査する
+        state[tmpl] = [0, {str(part.partname) for part in self.iter_parts()}]
+    counter = state[tmpl]
+    while True:
+        counter[0] += 1
+        candidate = tmpl % counter[0]
+        if candidate not in counter[1]:
+            return PackURI(candidate)
+
+OpcPackage.next_partname = _next_partname
+
+# 繰り返し使用する寸法・フォントサイズ（変換は一度だけ行い、各スライドで再利用する）
+I1 = Inches(1)
+I2 = Inches(2)
+I3 = Inches(3)
+I4 = Inches(4)
+I5 = Inches(5)
+I5_5 = Inches(5.5)
+I8 = Inches(8)
+PT12 = Pt(12)
+PT16 = Pt(16)
+
+# 図形の塗りつぶしと枠線の色
+WHITE = RGBColor(255, 255, 255)
+BLACK = RGBColor(0, 0, 0)
 
 code_text = """
 # 簡単なLangChainのコード例（コメント付き）
@@ -202,13 +137,78 @@ agent = initialize_agent(tools, OpenAI(temperature=0), agent=AgentType.ZERO_SHOT
 # エージェントの実行
 agent.run("東京の人口は？")
 """
-tf = slide.shapes.add_textbox(Inches(1), Inches(4), Inches(8), Inches(4))
-tf.text = code_text
-tf.text_frame.paragraphs[0].font.size = Pt(12)
-tf.text_frame.paragraphs[0].alignment = PP_ALIGN.LEFT
 
+# 各スライドの内容（レイアウト番号、タイトル、サブタイトル、配置する要素のリスト）
+# 要素は (種類, (左, 上, 幅, 高さ), 内容) で、種類は "image" / "rect" / "table" / "text" / "code"
+# 画像のファイル名は適切なものに変更してください
+SLIDES = [
+    (2, "冒険の始まり！AIエージェントの世界へようこそ！", "AIエージェント入門", [
+        ("image", (I1, I2, I8, None), "workspace/input/images/map.jpg"),
+        ("text", (I1, I5, I8, I2), "皆さん、こんにちは！今日はAIエージェントという、ワクワクする新しい世界への冒険に一緒に出かけましょう！プログラミングの基礎知識は既にある皆さんなら、きっとこの旅を楽しめるはずです。スマートスピーカーや自動運転など、AIエージェントはすでに私たちの生活に溶け込んでいます。このプレゼンテーションでは、AIエージェントの基本概念から実装方法まで、分かりやすく解説します。"),
+    ]),
+    # 人間とAIエージェントの相互作用図は簡略化し、枠とテキストによる説明で代用（複雑な図形は画像として挿入することを推奨）
+    (0, "未知の土地へ！AIエージェントとは？", None, [
+        ("rect", (I1, I2, I8, I3), None),
+        ("text", (I1, I5, I8, I3), "AIエージェントとは、環境を感知し、目標を達成するために自ら行動するプログラムのことです。まるでゲームの主人公のように、自律的に行動します。主な特徴は「知覚」「意思決定」「行動」の3つです。"),
+    ]),
+    # 迷路のイラストは簡略化（画像挿入推奨）
+    (0, "迷路を解くAIエージェント", None, [
+        ("text", (I1, I2, I8, I5), "例えば、迷路を解くAIエージェントを考えてみましょう。まず、センサー（知覚）で壁の位置を認識します。次に、最適な経路を計算（意思決定）し、実際に移動（行動）します。このように、AIエージェントは環境を理解し、目標達成のために自律的に行動します。"),
+    ]),
+    (0, "分岐点！AIエージェント vs. チャットボット", None, [
+        ("table", (I1, I2, I8, I3), [
+            ["項目", "AIエージェント", "チャットボット"],
+            ["主な機能", "環境感知、意思決定、行動、タスク実行", "自然言語による会話"],
+            ["目的", "複雑なタスクの自動化", "ユーザーとの対話、情報提供"],
+            ["複雑さ", "高度", "比較的単純"],
+        ]),
+        ("text", (I1, I5_5, I8, I1), "AIエージェントとよく似た言葉に「チャットボット」がありますが、両者は異なります。チャットボットは会話に特化していますが、AIエージェントはもっと幅広いタスクを実行できます。"),
+    ]),
+    # スライド5以降は同様の形式で追加する
+    (0, "魔法のツール！LangChainとLangGraphによる実装", None, [
+        ("image", (I1, I2, I4, None), "workspace/input/images/langchain_logo.png"),
+        ("image", (I5, I2, I4, None), "workspace/input/images/langgraph_logo.png"),
+        ("code", (I1, I4, I8, I4), code_text),
+    ]),
+]
+
+def add_element(slide, kind, box, content):
+    """スライドに要素を1つ追加する"""
+    left, top, width, height = box
+    if kind == "image":
+        add_image_safe(slide, content, left, top, width=width, height=height)
+    elif kind == "rect":
+        shape = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, left, top, width, height)
+        shape.fill.solid()
+        set_fill_color_safe(shape.fill, WHITE)
+        shape.line.color.rgb = BLACK
+    elif kind == "table":
+        table = slide.shapes.add_table(len(content), len(content[0]), left, top, width, height).table
+        for row_idx, row in enumerate(content):
+            for col_idx, text in enumerate(row):
+                table.cell(row_idx, col_idx).text = text
+    else:  # text / code
+        shape = slide.shapes.add_textbox(left, top, width, height)
+        shape.text = content
+        paragraph = shape.text_frame.paragraphs[0]
+        if kind == "code":
+            paragraph.font.size = PT12
+            paragraph.alignment = PP_ALIGN.LEFT
+        else:
+            paragraph.font.size = PT16
 
-# スライド7以降も同様の手法で作成。画像や図表は適切なファイル名で置き換えてください。
-
-prs.save('workspace/output/presentation.pptx')
+# テンプレート読み込み
+prs = Presentation('workspace/input/template.pptx')
+slide_layouts = prs.slide_layouts
 
+for layout_idx, title, subtitle, elements in SLIDES:
+    slide = prs.slides.add_slide(slide_layouts[layout_idx])
+    slide.shapes.title.text = title
+    if subtitle is not None:
+        get_placeholder_safe(slide, 11).text = subtitle
+    for kind, box, content in elements:
+        add_element(slide, kind, box, content)
+
+# 大きなバッファを介して書き出し、パーツごとの細かい書き込みをまとめる
+with open('workspace/output/presentation.pptx', 'wb', buffering=1 << 20) as f:
+    prs.save(f)
@@ -14,31 +14,45 @@ PowerPointプレゼンテーションを安全に生成します。テンプレ
 - 基本的なスライドレイアウトのみを使用します
 """
 
-import os
 import sys
 import datetime
-import random
+import logging
+from functools import lru_cache
 from pptx import Presentation
-from pptx.util import Inches, Pt
-from pptx.enum.text import PP_ALIGN
+from pptx.util import Inches as _Inches, Pt as _Pt
 from pptx.dml.color import RGBColor
 from pptx.enum.shapes import MSO_SHAPE
+from slide_helpers import fast_shape, fast_textbox, generate_unique_filename, save_presentation, set_bullets
 
-def ユニークファイル名生成(プレフィックス="安全_プレゼンテーション", 拡張子="pptx"):
-    """
-    タイムスタンプとランダムな数値を含む一意のファイル名を生成します。
-    
-    @param {string} プレフィックス - ファイル名の先頭部分
-    @param {string} 拡張子 - ファイルの拡張子
-    @return {string} 生成されたファイルパス
-    """
-    現在時刻 = datetime.datetime.now()
-    タイムスタンプ = 現在時刻.strftime("%Y%m%d_%H%M%S")
-    ランダム接尾辞 = f"_{random.randint(1000, 9999)}"
-    ファイル名 = f"{プレフィックス}_{タイムスタンプ}{ランダム接尾辞}.{拡張子}"
-    出力ディレクトリ = os.path.join("workspace", "output")
-    os.makedirs(出力ディレクトリ, exist_ok=True)
-    return os.path.join(出力ディレクトリ, ファイル名)
+# ロガーの設定（出力先の設定はスクリプトとして実行した場合のみ行う）
+logger = logging.getLogger(__name__)
+
+# 寸法・フォントサイズは同じ値を何度も使うため、値ごとに一度だけ変換する
+Inches = lru_cache(maxsize=None)(_Inches)
+Pt = lru_cache(maxsize=None)(_Pt)
+
+# 繰り返し使用する配色（使用箇所ごとに生成せず、一度だけ作成する）
+見出し色 = RGBColor(0, 75, 120)
+本文色 = RGBColor(50, 50, 50)
+図形塗り色 = RGBColor(240, 240, 240)
+図形枠線色 = RGBColor(200, 200, 200)
+接続線色 = RGBColor(100, 100, 100)
+
+# 図解スライドで中央の円を囲む要素（左端・上端のインチ値とラベル）
+周囲要素 = [
+    (1, 2.5, "テキストボックス\n直接配置"),  # 左
+    (7, 2.5, "基本図形のみ\n使用"),  # 右
+    (4, 1, "プレースホルダー\n不使用"),  # 上
+    (4, 5, "ユニークな\nファイル名生成"),  # 下
+]
+
+# 周囲の要素と中央の円を結ぶ線（始点と終点のインチ値）
+接続線 = [
+    (3, 3, 4, 3.5),  # 左
+    (7, 3, 6, 3.5),  # 右
+    (5, 2, 5, 2.5),  # 上
+    (5, 5, 5, 4.5),  # 下
+]
 
 def 安全プレゼンテーション作成():
     """
@@ -54,30 +68,15 @@ def 安全プレゼンテーション作成():
     スライド = プレゼンテーション.slides.add_slide(プレゼンテーション.slide_layouts[0])
     
     # テキストボックスでタイトルを追加
-    タイトル図形 = スライド.shapes.add_textbox(Inches(1), Inches(1), Inches(8), Inches(1.5))
-    タイトルフレーム = タイトル図形.text_frame
-    タイトルフレーム.text = "安全に生成されたプレゼンテーション"
-    タイトルフレーム.paragraphs[0].alignment = PP_ALIGN.CENTER
-    タイトルフレーム.paragraphs[0].font.size = Pt(44)
-    タイトルフレーム.paragraphs[0].font.bold = True
-    タイトルフレーム.paragraphs[0].font.color.rgb = RGBColor(0, 75, 120)
+    fast_textbox(スライド, Inches(1), Inches(1), Inches(8), Inches(1.5), "安全に生成されたプレゼンテーション", Pt(44), bold=True, color=見出し色)
     
     # サブタイトル
-    サブタイトル図形 = スライド.shapes.add_textbox(Inches(2), Inches(3), Inches(6), Inches(1))
-    サブタイトルフレーム = サブタイトル図形.text_frame
-    サブタイトルフレーム.text = "プレースホルダーエラーを回避する安全な実装"
-    サブタイトルフレーム.paragraphs[0].alignment = PP_ALIGN.CENTER
-    サブタイトルフレーム.paragraphs[0].font.size = Pt(28)
-    サブタイトルフレーム.paragraphs[0].font.color.rgb = RGBColor(70, 70, 70)
+    fast_textbox(スライド, Inches(2), Inches(3), Inches(6), Inches(1), "プレースホルダーエラーを回避する安全な実装", Pt(28), color=RGBColor(70, 70, 70))
     
     # 日付情報
-    日付図形 = スライド.shapes.add_textbox(Inches(2), Inches(4.5), Inches(6), Inches(0.5))
-    日付フレーム = 日付図形.text_frame
-    現在日時 = datetime.datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
-    日付フレーム.text = f"作成日時: {現在日時}"
-    日付フレーム.paragraphs[0].alignment = PP_ALIGN.CENTER
-    日付フレーム.paragraphs[0].font.size = Pt(14)
-    日付フレーム.paragraphs[0].font.italic = True
+    # 作成日時とファイル名で同じ時刻を使用する
+    現在時刻 = datetime.datetime.now()
+    fast_textbox(スライド, Inches(2), Inches(4.5), Inches(6), Inches(0.5), f"作成日時: {現在時刻:%Y年%m月%d日 %H:%M:%S}", Pt(14), italic=True)
     
     # 背景を彩るための図形を追加
     左上図形 = スライド.shapes.add_shape(
@@ -102,203 +101,64 @@ def 安全プレゼンテーション作成():
     スライド = プレゼンテーション.slides.add_slide(プレゼンテーション.slide_layouts[1])
     
     # タイトル
-    タイトル図形 = スライド.shapes.add_textbox(Inches(0.5), Inches(0.5), Inches(9), Inches(1))
-    タイトルフレーム = タイトル図形.text_frame
-    タイトルフレーム.text = "安全なプレゼンテーション生成"
-    タイトルフレーム.paragraphs[0].alignment = PP_ALIGN.CENTER
-    タイトルフレーム.paragraphs[0].font.size = Pt(40)
-    タイトルフレーム.paragraphs[0].font.bold = True
-    タイトルフレーム.paragraphs[0].font.color.rgb = RGBColor(0, 75, 120)
+    fast_textbox(スライド, Inches(0.5), Inches(0.5), Inches(9), Inches(1), "安全なプレゼンテーション生成", Pt(40), bold=True, color=見出し色)
     
     # 背景図形
-    背景図形 = スライド.shapes.add_shape(
-        MSO_SHAPE.RECTANGLE, 
-        Inches(0.5), Inches(1.8), 
-        Inches(9), Inches(4.2)
-    )
-    背景図形.fill.solid()
-    背景図形.fill.fore_color.rgb = RGBColor(245, 245, 250)
-    背景図形.line.color.rgb = RGBColor(220, 220, 230)
+    fast_shape(スライド, MSO_SHAPE.RECTANGLE, Inches(0.5), Inches(1.8), Inches(9), Inches(4.2), RGBColor(245, 245, 250), RGBColor(220, 220, 230))
     
     # コンテンツ
-    コンテンツ図形 = スライド.shapes.add_textbox(Inches(1), Inches(2), Inches(8), Inches(4))
-    コンテンツフレーム = コンテンツ図形.text_frame
-    
-    段落 = コンテンツフレーム.paragraphs[0]
-    段落.text = "• プレースホルダーエラーを回避するために安全モードで生成"
-    段落.font.size = Pt(24)
-    段落.font.color.rgb = RGBColor(50, 50, 50)
-    
-    段落 = コンテンツフレーム.add_paragraph()
-    段落.text = "• テキストボックスと図形のみを使用"
-    段落.font.size = Pt(24)
-    段落.font.color.rgb = RGBColor(50, 50, 50)
-    
-    段落 = コンテンツフレーム.add_paragraph()
-    段落.text = "• 日付とタイムスタンプを含む一意なファイル名"
-    段落.font.size = Pt(24)
-    段落.font.color.rgb = RGBColor(50, 50, 50)
-    
-    段落 = コンテンツフレーム.add_paragraph()
-    段落.text = "• エラー処理を強化し安定した動作を確保"
-    段落.font.size = Pt(24)
-    段落.font.color.rgb = RGBColor(50, 50, 50)
+    コンテンツフレーム = スライド.shapes.add_textbox(Inches(1), Inches(2), Inches(8), Inches(4)).text_frame
+    箇条書き = [
+        "• プレースホルダーエラーを回避するために安全モードで生成",
+        "• テキストボックスと図形のみを使用",
+        "• 日付とタイムスタンプを含む一意なファイル名",
+        "• エラー処理を強化し安定した動作を確保",
+    ]
+    set_bullets(コンテンツフレーム, 箇条書き, Pt(24), 本文色)
     
     # 図解スライド
     スライド = プレゼンテーション.slides.add_slide(プレゼンテーション.slide_layouts[1])
     
     # タイトル
-    タイトル図形 = スライド.shapes.add_textbox(Inches(0.5), Inches(0.5), Inches(9), Inches(1))
-    タイトルフレーム = タイトル図形.text_frame
-    タイトルフレーム.text = "安全実装の図解"
-    タイトルフレーム.paragraphs[0].alignment = PP_ALIGN.CENTER
-    タイトルフレーム.paragraphs[0].font.size = Pt(40)
-    タイトルフレーム.paragraphs[0].font.bold = True
-    タイトルフレーム.paragraphs[0].font.color.rgb = RGBColor(0, 75, 120)
+    fast_textbox(スライド, Inches(0.5), Inches(0.5), Inches(9), Inches(1), "安全実装の図解", Pt(40), bold=True, color=見出し色)
     
     # 図解の配置
     # 中央の円
-    中央円 = スライド.shapes.add_shape(
-        MSO_SHAPE.OVAL, 
-        Inches(4), Inches(2.5), 
-        Inches(2), Inches(2)
-    )
-    中央円.fill.solid()
-    中央円.fill.fore_color.rgb = RGBColor(0, 112, 192)
-    中央円.line.color.rgb = RGBColor(0, 80, 160)
+    fast_shape(スライド, MSO_SHAPE.OVAL, Inches(4), Inches(2.5), Inches(2), Inches(2), RGBColor(0, 112, 192), RGBColor(0, 80, 160))
     
     # 中央円のテキスト
-    中央テキスト = スライド.shapes.add_textbox(
-        Inches(4.25), Inches(3.2), 
-        Inches(1.5), Inches(0.6)
-    )
-    中央テキストフレーム = 中央テキスト.text_frame
-    中央テキストフレーム.text = "安全な\n生成方式"
-    中央テキストフレーム.paragraphs[0].alignment = PP_ALIGN.CENTER
-    中央テキストフレーム.paragraphs[0].font.size = Pt(14)
-    中央テキストフレーム.paragraphs[0].font.bold = True
-    中央テキストフレーム.paragraphs[0].font.color.rgb = RGBColor(255, 255, 255)
-    
-    # 左の要素
-    左図形 = スライド.shapes.add_shape(
-        MSO_SHAPE.ROUNDED_RECTANGLE, 
-        Inches(1), Inches(2.5), 
-        Inches(2), Inches(1)
-    )
-    左図形.fill.solid()
-    左図形.fill.fore_color.rgb = RGBColor(240, 240, 240)
-    左図形.line.color.rgb = RGBColor(200, 200, 200)
+    fast_textbox(スライド, Inches(4.25), Inches(3.2), Inches(1.5), Inches(0.6), "安全な\n生成方式", Pt(14), bold=True, color=RGBColor(255, 255, 255))
     
-    左テキスト = スライド.shapes.add_textbox(
-        Inches(1.1), Inches(2.7), 
-        Inches(1.8), Inches(0.6)
-    )
-    左テキストフレーム = 左テキスト.text_frame
-    左テキストフレーム.text = "テキストボックス\n直接配置"
-    左テキストフレーム.paragraphs[0].alignment = PP_ALIGN.CENTER
-    左テキストフレーム.paragraphs[0].font.size = Pt(12)
-    左テキストフレーム.paragraphs[0].font.color.rgb = RGBColor(50, 50, 50)
-    
-    # 右の要素
-    右図形 = スライド.shapes.add_shape(
-        MSO_SHAPE.ROUNDED_RECTANGLE, 
-        Inches(7), Inches(2.5), 
-        Inches(2), Inches(1)
-    )
-    右図形.fill.solid()
-    右図形.fill.fore_color.rgb = RGBColor(240, 240, 240)
-    右図形.line.color.rgb = RGBColor(200, 200, 200)
-    
-    右テキスト = スライド.shapes.add_textbox(
-        Inches(7.1), Inches(2.7), 
-        Inches(1.8), Inches(0.6)
-    )
-    右テキストフレーム = 右テキスト.text_frame
-    右テキストフレーム.text = "基本図形のみ\n使用"
-    右テキストフレーム.paragraphs[0].alignment = PP_ALIGN.CENTER
-    右テキストフレーム.paragraphs[0].font.size = Pt(12)
-    右テキストフレーム.paragraphs[0].font.color.rgb = RGBColor(50, 50, 50)
-    
-    # 上の要素
-    上図形 = スライド.shapes.add_shape(
-        MSO_SHAPE.ROUNDED_RECTANGLE, 
-        Inches(4), Inches(1), 
-        Inches(2), Inches(1)
-    )
-    上図形.fill.solid()
-    上図形.fill.fore_color.rgb = RGBColor(240, 240, 240)
-    上図形.line.color.rgb = RGBColor(200, 200, 200)
-    
-    上テキスト = スライド.shapes.add_textbox(
-        Inches(4.1), Inches(1.2), 
-        Inches(1.8), Inches(0.6)
-    )
-    上テキストフレーム = 上テキスト.text_frame
-    上テキストフレーム.text = "プレースホルダー\n不使用"
-    上テキストフレーム.paragraphs[0].alignment = PP_ALIGN.CENTER
-    上テキストフレーム.paragraphs[0].font.size = Pt(12)
-    上テキストフレーム.paragraphs[0].font.color.rgb = RGBColor(50, 50, 50)
-    
-    # 下の要素
-    下図形 = スライド.shapes.add_shape(
-        MSO_SHAPE.ROUNDED_RECTANGLE, 
-        Inches(4), Inches(5), 
-        Inches(2), Inches(1)
-    )
-    下図形.fill.solid()
-    下図形.fill.fore_color.rgb = RGBColor(240, 240, 240)
-    下図形.line.color.rgb = RGBColor(200, 200, 200)
-    
-    下テキスト = スライド.shapes.add_textbox(
-        Inches(4.1), Inches(5.2), 
-        Inches(1.8), Inches(0.6)
-    )
-    下テキストフレーム = 下テキスト.text_frame
-    下テキストフレーム.text = "ユニークな\nファイル名生成"
-    下テキストフレーム.paragraphs[0].alignment = PP_ALIGN.CENTER
-    下テキストフレーム.paragraphs[0].font.size = Pt(12)
-    下テキストフレーム.paragraphs[0].font.color.rgb = RGBColor(50, 50, 50)
+    # 周囲の要素（角丸四角形とラベル）
+    for 左, 上, ラベル in 周囲要素:
+        fast_shape(スライド, MSO_SHAPE.ROUNDED_RECTANGLE, Inches(左), Inches(上), Inches(2), Inches(1), 図形塗り色, 図形枠線色)
+        fast_textbox(スライド, Inches(左 + 0.1), Inches(上 + 0.2), Inches(1.8), Inches(0.6), ラベル, Pt(12), color=本文色)
     
     # 線を引いて接続
-    左線 = スライド.shapes.add_connector(
-        1, Inches(3), Inches(3), Inches(4), Inches(3.5)
-    )
-    左線.line.color.rgb = RGBColor(100, 100, 100)
-    
-    右線 = スライド.shapes.add_connector(
-        1, Inches(7), Inches(3), Inches(6), Inches(3.5)
-    )
-    右線.line.color.rgb = RGBColor(100, 100, 100)
-    
-    上線 = スライド.shapes.add_connector(
-        1, Inches(5), Inches(2), Inches(5), Inches(2.5)
-    )
-    上線.line.color.rgb = RGBColor(100, 100, 100)
-    
-    下線 = スライド.shapes.add_connector(
-        1, Inches(5), Inches(5), Inches(5), Inches(4.5)
-    )
-    下線.line.color.rgb = RGBColor(100, 100, 100)
+    for 始点X, 始点Y, 終点X, 終点Y in 接続線:
+        線 = スライド.shapes.add_connector(1, Inches(始点X), Inches(始点Y), Inches(終点X), Inches(終点Y))
+        線.line.color.rgb = 接続線色
     
-    # 保存
-    出力ファイル名 = ユニークファイル名生成()
+    # 保存（一時ファイルに書き込んでから置き換え、書きかけのファイルが残らないようにする）
+    出力ファイル名 = generate_unique_filename("安全_プレゼンテーション", now=現在時刻)
     try:
-        プレゼンテーション.save(出力ファイル名)
-        print(f"プレゼンテーションが正常に生成されました！保存先: {出力ファイル名}")
+        save_presentation(プレゼンテーション, 出力ファイル名)
+        logger.info("プレゼンテーションが正常に生成されました！保存先: %s", 出力ファイル名)
         return 出力ファイル名
     except Exception as エラー:
-        print(f"保存中にエラーが発生しました: {エラー}")
+        logger.error("保存中にエラーが発生しました: %s", エラー)
         # フォールバックとして別の名前で保存を試みる
-        フォールバック名 = os.path.join("workspace", "output", f"安全プレゼンテーション_緊急_{random.randint(1000, 9999)}.pptx")
+        フォールバック名 = generate_unique_filename("安全プレゼンテーション_緊急")
         try:
-            プレゼンテーション.save(フォールバック名)
-            print(f"フォールバックで保存に成功しました: {フォールバック名}")
+            save_presentation(プレゼンテーション, フォールバック名)
+            logger.info("フォールバックで保存に成功しました: %s", フォールバック名)
             return フォールバック名
         except Exception as 二次エラー:
-            print(f"フォールバック保存にも失敗しました: {二次エラー}")
+            logger.error("フォールバック保存にも失敗しました: %s", 二次エラー)
             return None
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     try:
         出力ファイル = 安全プレゼンテーション作成()
         if 出力ファイル:
@@ -0,0 +1,165 @@
+"""
+スライド生成スクリプトで共通に使用するヘルパー関数
+temp_slide_generator.py と safe_pptx_generator.py の両方から読み込み、
+ファイル名の生成・保存・XMLテンプレートによる図形の追加を1か所にまとめます。
+
+Functions:
+    generate_unique_filename: タイムスタンプとプロセス内の連番を使用して一意のファイル名を生成する
+    save_presentation: 一時ファイルを介してプレゼンテーションを保存する
+    fast_textbox: 書式を設定したテキストボックスをXMLから追加する
+    set_bullets: テキストフレームの段落を項目ごとの段落にまとめて置き換える
+    fast_shape: 塗りつぶしと枠線の色を設定した図形をXMLから追加する
+"""
+
+import os
+import datetime
+import itertools
+from xml.sax.saxutils import escape
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls
+from pptx.shapes.autoshape import AutoShapeType
+
+# ファイル名の接尾辞に使用するプロセス内の連番（プロセスIDと組み合わせ、同じ秒に生成しても重複しない）
+_filename_counter = itertools.count(1)
+
+# 出力ディレクトリ
+OUTPUT_DIR = os.path.join("workspace", "output")
+
+# 出力ディレクトリの作成を確認済みかどうか（makedirsのシステムコールはプロセスごとに一度だけ行う）
+_output_dir_ready = False
+
+def generate_unique_filename(prefix="Presentation", ext="pptx", now=None):
+    """
+    タイムスタンプとプロセス内の連番を使用して一意のファイル名を生成します
+    
+    Args:
+        prefix (str): ファイル名の接頭辞
+        ext (str): ファイルの拡張子
+        now (datetime.datetime): ファイル名に使用する時刻（スライドに表示する時刻と揃える場合に指定）
+        
+    Returns:
+        str: 生成されたファイルパス
+    """
+    now = now or datetime.datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
+    unique_suffix = f"_{os.getpid():x}{next(_filename_counter):04x}"
+    filename = f"{prefix}_{timestamp}{unique_suffix}.{ext}"
+    
+    # 出力ディレクトリの確認と作成（プロセスごとに一度だけ）
+    global _output_dir_ready
+    if not _output_dir_ready:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        _output_dir_ready = True
+    
+    return os.path.join(OUTPUT_DIR, filename)
+
+# 保存時の書き込みバッファサイズ（1MB）
+SAVE_BUFFER_SIZE = 1 << 20
+
+def save_presentation(prs, path):
+    """
+    大きなバッファを介してプレゼンテーションを保存します
+    （ZIP内の各パーツの細かい書き込みをまとめ、書き込み回数を減らす）
+    一時ファイルに書き込んでから置き換えるため、失敗しても書きかけのファイルは残りません
+    
+    Args:
+        prs (Presentation): 保存するプレゼンテーション
+        path (str): 保存先のファイルパス
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb", buffering=SAVE_BUFFER_SIZE) as f:
+        prs.save(f)
+    os.replace(tmp_path, path)
+
+# 書式付きテキストボックスの<p:sp>要素のテンプレート
+# （add_textboxで作成した要素を段落・フォントのプロパティ経由で書き換える代わりに、完成形のXMLを一度に組み立てる）
+TEXTBOX_SP_TEMPLATE = (
+    '<p:sp %s>'
+    '<p:nvSpPr><p:cNvPr id="{id}" name="TextBox {name_id}"/><p:cNvSpPr txBox="1"/><p:nvPr/></p:nvSpPr>'
+    '<p:spPr><a:xfrm><a:off x="{x}" y="{y}"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+    '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom><a:noFill/></p:spPr>'
+    '<p:txBody><a:bodyPr wrap="none"><a:spAutoFit/></a:bodyPr><a:lstStyle/>'
+    '{paragraphs}</p:txBody></p:sp>'
+) % nsdecls("p", "a")
+# テキストボックス内の1段落分の要素のテンプレート（改行ごとに1段落）
+TEXTBOX_PARAGRAPH_TEMPLATE = '<a:p><a:pPr algn="{align}"/><a:r><a:rPr lang="ja-JP" sz="{size}"{attrs}>{fill}</a:rPr><a:t>{text}</a:t></a:r></a:p>'
+
+def fast_textbox(slide, left, top, width, height, text, size, bold=False, italic=False, align="ctr", color=None):
+    """
+    書式を設定したテキストボックスを、XMLを一度組み立てるだけでスライドに追加します
+    
+    Args:
+        slide (Slide): テキストボックスを追加するスライド
+        left, top, width, height (Length): テキストボックスの位置と大きさ
+        text (str): 表示するテキスト（改行ごとに段落を分け、すべての段落に同じ書式を設定する）
+        size (Length): フォントサイズ（Pt(...)で指定）
+        bold (bool): 太字にするかどうか
+        italic (bool): 斜体にするかどうか
+        align (str): 段落の配置（"l" / "ctr" / "r"）
+        color (RGBColor): 文字色（Noneの場合はテーマの既定色）
+    """
+    shape_id = slide.shapes._next_shape_id
+    attrs = (' b="1"' if bold else "") + (' i="1"' if italic else "")
+    fill = f'<a:solidFill><a:srgbClr val="{color}"/></a:solidFill>' if color is not None else ""
+    paragraphs = "".join(
+        TEXTBOX_PARAGRAPH_TEMPLATE.format(align=align, size=size.centipoints, attrs=attrs, fill=fill, text=escape(line))
+        for line in text.split("\n")
+    )
+    sp = parse_xml(TEXTBOX_SP_TEMPLATE.format(
+        id=shape_id, name_id=shape_id - 1, x=int(left), y=int(top), cx=int(width), cy=int(height), paragraphs=paragraphs,
+    ))
+    slide.shapes._spTree.insert_element_before(sp, "p:extLst")
+
+# 箇条書きの1項目分の段落要素のテンプレート
+BULLET_PARAGRAPH_TEMPLATE = '<a:p><a:r><a:rPr lang="ja-JP" sz="{size}">{fill}</a:rPr><a:t>{text}</a:t></a:r></a:p>'
+
+def set_bullets(text_frame, items, size, color=None):
+    """
+    テキストフレームの段落を、項目ごとの段落にまとめて置き換えます
+    （add_paragraphを項目ごとに呼ぶ代わりに、全段落のXMLを一度に組み立てて追加する）
+    
+    Args:
+        text_frame (TextFrame): 段落を設定するテキストフレーム
+        items (list): 各段落のテキスト
+        size (Length): フォントサイズ（Pt(...)で指定）
+        color (RGBColor): 文字色（Noneの場合はテーマの既定色）
+    """
+    txBody = text_frame._txBody
+    for p in txBody.p_lst:
+        txBody.remove(p)
+    fill = f'<a:solidFill><a:srgbClr val="{color}"/></a:solidFill>' if color is not None else ""
+    paragraphs = "".join(
+        BULLET_PARAGRAPH_TEMPLATE.format(size=size.centipoints, fill=fill, text=escape(item)) for item in items
+    )
+    txBody.extend(list(parse_xml(f'<a:txBody {nsdecls("a")}>{paragraphs}</a:txBody>')))
+
+# 塗りつぶしと枠線の色を指定した図形の<p:sp>要素のテンプレート（add_shapeが作成する要素と同じ構造）
+AUTOSHAPE_SP_TEMPLATE = (
+    '<p:sp %s>'
+    '<p:nvSpPr><p:cNvPr id="{id}" name="{basename} {name_id}"/><p:cNvSpPr/><p:nvPr/></p:nvSpPr>'
+    '<p:spPr><a:xfrm><a:off x="{x}" y="{y}"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+    '<a:prstGeom prst="{prst}"><a:avLst/></a:prstGeom>'
+    '<a:solidFill><a:srgbClr val="{fill}"/></a:solidFill><a:ln><a:solidFill><a:srgbClr val="{line}"/></a:solidFill></a:ln></p:spPr>'
+    '<p:style><a:lnRef idx="1"><a:schemeClr val="accent1"/></a:lnRef><a:fillRef idx="3"><a:schemeClr val="accent1"/></a:fillRef>'
+    '<a:effectRef idx="2"><a:schemeClr val="accent1"/></a:effectRef><a:fontRef idx="minor"><a:schemeClr val="lt1"/></a:fontRef></p:style>'
+    '<p:txBody><a:bodyPr rtlCol="0" anchor="ctr"/><a:lstStyle/><a:p><a:pPr algn="ctr"/></a:p></p:txBody></p:sp>'
+) % nsdecls("p", "a")
+
+def fast_shape(slide, shape_type, left, top, width, height, fill_color, line_color):
+    """
+    塗りつぶしと枠線の色を設定した図形を、XMLを一度組み立てるだけでスライドに追加します
+    
+    Args:
+        slide (Slide): 図形を追加するスライド
+        shape_type (MSO_SHAPE): 図形の種類
+        left, top, width, height (Length): 図形の位置と大きさ
+        fill_color (RGBColor): 塗りつぶしの色
+        line_color (RGBColor): 枠線の色
+    """
+    autoshape_type = AutoShapeType(shape_type)
+    shape_id = slide.shapes._next_shape_id
+    sp = parse_xml(AUTOSHAPE_SP_TEMPLATE.format(
+        id=shape_id, basename=autoshape_type.basename, name_id=shape_id - 1, prst=autoshape_type.prst,
+        x=int(left), y=int(top), cx=int(width), cy=int(height), fill=fill_color, line=line_color,
+    ))
+    slide.shapes._spTree.insert_element_before(sp, "p:extLst")
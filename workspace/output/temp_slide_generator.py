@@ -23,43 +23,65 @@ Date: 2025-04-04
 import os
 import sys
 import datetime
-import random
-import traceback
+import logging
+from functools import lru_cache
 
 # 必要なライブラリを確認してインポート
 try:
     from pptx import Presentation
-    from pptx.util import Inches, Pt
-    from pptx.enum.text import PP_ALIGN
+    from pptx.util import Inches as _Inches, Pt as _Pt
     from pptx.dml.color import RGBColor
     from pptx.enum.shapes import MSO_SHAPE
+    from slide_helpers import fast_shape, fast_textbox, generate_unique_filename, save_presentation, set_bullets
 except ImportError:
     print("python-pptxライブラリがインストールされていません。")
     print("次のコマンドでインストールしてください: pip install python-pptx")
     sys.exit(1)
 
-# 一意のファイル名を生成
-def generate_unique_filename(prefix="Presentation", ext="pptx"):
+# ロガーの設定（出力先の設定はスクリプトとして実行した場合のみ行う）
+logger = logging.getLogger(__name__)
+
+# 寸法・フォントサイズは同じ値を何度も使うため、値ごとに一度だけ変換する
+Inches = lru_cache(maxsize=None)(_Inches)
+Pt = lru_cache(maxsize=None)(_Pt)
+
+# 配色（スライドごとに生成せず、モジュール読み込み時に一度だけ作成する）
+PRIMARY_COLOR = RGBColor(0, 112, 192)  # 青
+SECONDARY_COLOR = RGBColor(255, 192, 0)  # 黄色
+ACCENT_COLOR = RGBColor(112, 48, 160)  # 紫
+BLACK = RGBColor(0, 0, 0)  # 図形の枠線
+ERROR_COLOR = RGBColor(192, 0, 0)  # 赤色（エラー表示）
+
+def _save_error_deck(error):
     """
-    タイムスタンプとランダムな値を使用して一意のファイル名を生成します
+    エラー内容を記載した代替プレゼンテーションを作成して保存します
     
     Args:
-        prefix (str): ファイル名の接頭辞
-        ext (str): ファイルの拡張子
+        error (Exception): 発生したエラー
         
     Returns:
-        str: 生成されたファイルパス
+        str: 生成されたファイルのパス（代替プレゼンテーションの作成にも失敗した場合はNone）
     """
-    now = datetime.datetime.now()
-    timestamp = now.strftime("%Y%m%d_%H%M%S")
-    random_suffix = f"_{random.randint(1000, 9999)}"
-    filename = f"{prefix}_{timestamp}{random_suffix}.{ext}"
-    
-    # 出力ディレクトリの確認と作成
-    output_dir = os.path.join("workspace", "output")
-    os.makedirs(output_dir, exist_ok=True)
-    
-    return os.path.join(output_dir, filename)
+    try:
+        logger.info("代替プレゼンテーションを作成します...")
+        error_time = datetime.datetime.now()
+        error_ppt_filename = generate_unique_filename("Error_Presentation", now=error_time)
+        
+        prs = Presentation()
+        slide = prs.slides.add_slide(prs.slide_layouts[0])
+        
+        # 段落・フォントのプロパティを経由せず、書式込みのXMLとしてテキストボックスを追加する
+        fast_textbox(slide, Inches(1), Inches(1), Inches(8), Inches(1.5), "エラーが発生しました", Pt(44), bold=True, color=ERROR_COLOR)
+        fast_textbox(slide, Inches(1), Inches(3), Inches(8), Inches(2), f"プレゼンテーション生成中にエラーが発生しました:\n{error}", Pt(20))
+        fast_textbox(slide, Inches(1), Inches(5.5), Inches(8), Inches(0.5), f"エラー発生時刻: {error_time:%Y年%m月%d日 %H:%M:%S}", Pt(14))
+        
+        save_presentation(prs, error_ppt_filename)
+        logger.info("エラー用プレゼンテーションが生成されました: %s", error_ppt_filename)
+        return error_ppt_filename
+        
+    except Exception as err:
+        logger.exception("代替プレゼンテーションの作成中にエラーが発生しました: %s", err)
+        return None
 
 def create_presentation():
     """
@@ -72,49 +94,26 @@ def create_presentation():
         # 新しいプレゼンテーションを作成
         prs = Presentation()
         
-        # プライマリカラーの定義
-        primary_color = RGBColor(0, 112, 192)  # 青
-        secondary_color = RGBColor(255, 192, 0)  # 黄色
-        accent_color = RGBColor(112, 48, 160)  # 紫
-        
         # 1. タイトルスライド
         slide = prs.slides.add_slide(prs.slide_layouts[0])  # 標準の最初のレイアウト
         
         # テキストボックスでタイトルを追加 (プレースホルダーを使用しない)
-        title_shape = slide.shapes.add_textbox(Inches(1), Inches(1), Inches(8), Inches(1.5))
-        title_frame = title_shape.text_frame
-        title_frame.text = "自動生成プレゼンテーション"
-        title_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-        title_frame.paragraphs[0].font.size = Pt(44)
-        title_frame.paragraphs[0].font.bold = True
-        title_frame.paragraphs[0].font.color.rgb = primary_color
+        fast_textbox(slide, Inches(1), Inches(1), Inches(8), Inches(1.5), "自動生成プレゼンテーション", Pt(44), bold=True, color=PRIMARY_COLOR)
         
         # サブタイトル
-        subtitle_shape = slide.shapes.add_textbox(Inches(2), Inches(3), Inches(6), Inches(1))
-        subtitle_frame = subtitle_shape.text_frame
-        subtitle_frame.text = "安全なプレースホルダー非依存アプローチ"
-        subtitle_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-        subtitle_frame.paragraphs[0].font.size = Pt(32)
-        subtitle_frame.paragraphs[0].font.italic = True
+        fast_textbox(slide, Inches(2), Inches(3), Inches(6), Inches(1), "安全なプレースホルダー非依存アプローチ", Pt(32), italic=True)
         
         # 作成日時
-        current_date = datetime.datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
-        date_shape = slide.shapes.add_textbox(Inches(2), Inches(4), Inches(6), Inches(0.5))
-        date_frame = date_shape.text_frame
-        date_frame.text = f"作成日時: {current_date}"
-        date_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-        date_frame.paragraphs[0].font.size = Pt(16)
+        # 作成日時とファイル名で同じ時刻を使用する
+        now = datetime.datetime.now()
+        current_date = now.strftime("%Y年%m月%d日 %H:%M:%S")
+        fast_textbox(slide, Inches(2), Inches(4), Inches(6), Inches(0.5), f"作成日時: {current_date}", Pt(16))
         
         # 2. 特徴スライド
         slide = prs.slides.add_slide(prs.slide_layouts[1])  # 標準の2番目のレイアウト
         
         # タイトル
-        title_shape = slide.shapes.add_textbox(Inches(0.5), Inches(0.5), Inches(9), Inches(1))
-        title_frame = title_shape.text_frame
-        title_frame.text = "このプレゼンテーションの特徴"
-        title_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-        title_frame.paragraphs[0].font.size = Pt(40)
-        title_frame.paragraphs[0].font.bold = True
+        fast_textbox(slide, Inches(0.5), Inches(0.5), Inches(9), Inches(1), "このプレゼンテーションの特徴", Pt(40), bold=True)
         
         # コンテンツ
         content_shape = slide.shapes.add_textbox(Inches(1), Inches(2), Inches(8), Inches(4))
@@ -129,74 +128,36 @@ def create_presentation():
             "• 堅牢なエラーハンドリング機能"
         ]
         
-        # 最初のパラグラフ
-        p = content_frame.paragraphs[0]
-        p.text = features[0]
-        p.font.size = Pt(24)
-        
-        # 残りの機能を追加
-        for feature in features[1:]:
-            p = content_frame.add_paragraph()
-            p.text = feature
-            p.font.size = Pt(24)
-            p.level = 0
+        set_bullets(content_frame, features, Pt(24))
         
         # 3. 図形スライド
         slide = prs.slides.add_slide(prs.slide_layouts[1])
         
         # タイトル
-        title_shape = slide.shapes.add_textbox(Inches(0.5), Inches(0.5), Inches(9), Inches(1))
-        title_frame = title_shape.text_frame
-        title_frame.text = "図形とテキストボックスの例"
-        title_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-        title_frame.paragraphs[0].font.size = Pt(40)
-        title_frame.paragraphs[0].font.bold = True
+        fast_textbox(slide, Inches(0.5), Inches(0.5), Inches(9), Inches(1), "図形とテキストボックスの例", Pt(40), bold=True)
         
         # 円形を追加
-        circle = slide.shapes.add_shape(MSO_SHAPE.OVAL, Inches(2), Inches(2), Inches(2), Inches(2))
-        circle.fill.solid()
-        circle.fill.fore_color.rgb = primary_color
-        circle.line.color.rgb = RGBColor(0, 0, 0)
+        fast_shape(slide, MSO_SHAPE.OVAL, Inches(2), Inches(2), Inches(2), Inches(2), PRIMARY_COLOR, BLACK)
         
         # 四角形を追加
-        rectangle = slide.shapes.add_shape(MSO_SHAPE.RECTANGLE, Inches(5), Inches(2), Inches(2), Inches(2))
-        rectangle.fill.solid()
-        rectangle.fill.fore_color.rgb = secondary_color
-        rectangle.line.color.rgb = RGBColor(0, 0, 0)
+        fast_shape(slide, MSO_SHAPE.RECTANGLE, Inches(5), Inches(2), Inches(2), Inches(2), SECONDARY_COLOR, BLACK)
         
         # 三角形を追加（MSO_SHAPE.TRIANGLEが存在しないため、RIGHT_TRIANGLEを使用）
-        triangle = slide.shapes.add_shape(MSO_SHAPE.RIGHT_TRIANGLE, Inches(3.5), Inches(4), Inches(2), Inches(2))
-        triangle.fill.solid()
-        triangle.fill.fore_color.rgb = accent_color
-        triangle.line.color.rgb = RGBColor(0, 0, 0)
+        fast_shape(slide, MSO_SHAPE.RIGHT_TRIANGLE, Inches(3.5), Inches(4), Inches(2), Inches(2), ACCENT_COLOR, BLACK)
         
         # 説明テキストを追加
-        text_shape = slide.shapes.add_textbox(Inches(1), Inches(6), Inches(8), Inches(1))
-        text_frame = text_shape.text_frame
-        text_frame.text = "図形とテキストボックスを使用したスライド作成例"
-        text_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-        text_frame.paragraphs[0].font.size = Pt(20)
-        text_frame.paragraphs[0].font.italic = True
+        fast_textbox(slide, Inches(1), Inches(6), Inches(8), Inches(1), "図形とテキストボックスを使用したスライド作成例", Pt(20), italic=True)
         
         # 4. まとめスライド
         slide = prs.slides.add_slide(prs.slide_layouts[1])
         
         # タイトル
-        title_shape = slide.shapes.add_textbox(Inches(0.5), Inches(0.5), Inches(9), Inches(1))
-        title_frame = title_shape.text_frame
-        title_frame.text = "まとめ"
-        title_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-        title_frame.paragraphs[0].font.size = Pt(40)
-        title_frame.paragraphs[0].font.bold = True
+        fast_textbox(slide, Inches(0.5), Inches(0.5), Inches(9), Inches(1), "まとめ", Pt(40), bold=True)
         
         # コンテンツ
         content_shape = slide.shapes.add_textbox(Inches(1), Inches(2), Inches(8), Inches(4))
         content_frame = content_shape.text_frame
         
-        p = content_frame.paragraphs[0]
-        p.text = "このプレゼンテーションは以下の手法で作成されました："
-        p.font.size = Pt(24)
-        
         bullet_points = [
             "• python-pptxライブラリを使用した直接生成",
             "• テンプレートファイルやプレースホルダーに依存しない",
@@ -204,71 +165,24 @@ def create_presentation():
             "• 毎回新しいファイル名で保存"
         ]
         
-        for point in bullet_points:
-            p = content_frame.add_paragraph()
-            p.text = point
-            p.font.size = Pt(24)
-            p.level = 0
+        set_bullets(content_frame, ["このプレゼンテーションは以下の手法で作成されました："] + bullet_points, Pt(24))
         
         # フッター情報
-        footer_shape = slide.shapes.add_textbox(Inches(1), Inches(6.5), Inches(8), Inches(0.5))
-        footer_frame = footer_shape.text_frame
-        footer_frame.text = "© 2025 AI自動生成プレゼンテーション"
-        footer_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-        footer_frame.paragraphs[0].font.size = Pt(12)
+        fast_textbox(slide, Inches(1), Inches(6.5), Inches(8), Inches(0.5), "© 2025 AI自動生成プレゼンテーション", Pt(12))
         
         # プレゼンテーションを保存
-        output_filename = generate_unique_filename("Safe_Presentation")
-        prs.save(output_filename)
-        print(f"プレゼンテーションが正常に生成されました！保存先: {output_filename}")
+        output_filename = generate_unique_filename("Safe_Presentation", now=now)
+        save_presentation(prs, output_filename)
+        logger.info("プレゼンテーションが正常に生成されました！保存先: %s", output_filename)
         return output_filename
         
     except Exception as e:
-        print(f"エラーが発生しました: {e}")
-        traceback.print_exc()
+        logger.exception("エラーが発生しました: %s", e)
         
-        try:
-            # エラー時の代替プレゼンテーション
-            print("代替プレゼンテーションを作成します...")
-            error_ppt_filename = generate_unique_filename("Error_Presentation")
-            
-            prs = Presentation()
-            slide = prs.slides.add_slide(prs.slide_layouts[0])
-            
-            # エラータイトル
-            title_shape = slide.shapes.add_textbox(Inches(1), Inches(1), Inches(8), Inches(1.5))
-            title_frame = title_shape.text_frame
-            title_frame.text = "エラーが発生しました"
-            title_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-            title_frame.paragraphs[0].font.size = Pt(44)
-            title_frame.paragraphs[0].font.bold = True
-            title_frame.paragraphs[0].font.color.rgb = RGBColor(192, 0, 0)  # 赤色
-            
-            # エラーメッセージ
-            error_shape = slide.shapes.add_textbox(Inches(1), Inches(3), Inches(8), Inches(2))
-            error_frame = error_shape.text_frame
-            error_frame.text = f"プレゼンテーション生成中にエラーが発生しました:\n{str(e)}"
-            error_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-            error_frame.paragraphs[0].font.size = Pt(20)
-            
-            # タイムスタンプ
-            now = datetime.datetime.now().strftime("%Y年%m月%d日 %H:%M:%S")
-            date_shape = slide.shapes.add_textbox(Inches(1), Inches(5.5), Inches(8), Inches(0.5))
-            date_frame = date_shape.text_frame
-            date_frame.text = f"エラー発生時刻: {now}"
-            date_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-            date_frame.paragraphs[0].font.size = Pt(14)
-            
-            prs.save(error_ppt_filename)
-            print(f"エラー用プレゼンテーションが生成されました: {error_ppt_filename}")
-            return error_ppt_filename
-            
-        except Exception as err:
-            print(f"代替プレゼンテーションの作成中にエラーが発生しました: {err}")
-            traceback.print_exc()
-            return None
+        return _save_error_deck(e)
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     try:
         output_file = create_presentation()
         if output_file:
@@ -279,6 +193,5 @@ if __name__ == "__main__":
             print("プレゼンテーションの生成に失敗しました。")
             sys.exit(1)
     except Exception as e:
-        print(f"予期せぬエラーが発生しました: {e}")
-        traceback.print_exc()
+        logger.exception("予期せぬエラーが発生しました: %s", e)
         sys.exit(1) 
\ No newline at end of file